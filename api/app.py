@@ -1,5 +1,8 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
 import os
 import google.generativeai as genai
@@ -19,6 +22,11 @@ else:
 # ----------------------------------------------------------------
 
 from .db import init_db
+from .services import extraction
+from .services.breaker import CircuitOpen
+from .services.gemini_keys import KeysExhausted
+from .services.jobs import job_queue
+from .services.metrics import MetricsMiddleware
 from .routers.auth import router as auth_router
 from .routers.admin import router as admin_router
 from .routers.groups_files import router as groups_files_router
@@ -30,10 +38,22 @@ from .routers.chat import router as chat_router
 from .routers.health import router as health_router
 from .routers.performance import router as perf_router
 from .routers.updates import router as updates_router
+from .routers.jobs import router as jobs_router
+from .routers.search import router as search_router
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Workers start after every router has registered its job handlers
+    job_queue.start()
+    yield
+    job_queue.stop()
+    # Stop the PDF extraction worker processes
+    extraction.shutdown()
 
 
 def create_app() -> FastAPI:
-    app = FastAPI(title="Student Analyzer AI - FastAPI Backend", version="0.2.0")
+    app = FastAPI(title="Student Analyzer AI - FastAPI Backend", version="0.2.0", lifespan=lifespan)
 
     app.add_middleware(
         CORSMiddleware,
@@ -41,7 +61,21 @@ def create_app() -> FastAPI:
         allow_credentials=False,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["X-Next-Cursor"],
     )
+    # Per-route latency, status counts and DB/Gemini time, scraped from GET /metrics
+    app.add_middleware(MetricsMiddleware)
+
+    @app.exception_handler(KeysExhausted)
+    async def keys_exhausted(request: Request, exc: KeysExhausted):
+        # Every Gemini key is cooling down or out of budget; the client should retry later
+        return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "30"})
+
+    @app.exception_handler(CircuitOpen)
+    async def circuit_open(request: Request, exc: CircuitOpen):
+        # A dependency's breaker is open and there was no cached or degraded answer to give
+        retry_after = str(int(exc.retry_after) + 1)
+        return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": retry_after})
 
     # Ensure DB is initialized
     init_db()
@@ -58,6 +92,8 @@ def create_app() -> FastAPI:
     app.include_router(health_router)
     app.include_router(perf_router)
     app.include_router(updates_router)
+    app.include_router(jobs_router)
+    app.include_router(search_router)
 
     @app.get("/")
     def root():
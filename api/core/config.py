@@ -50,4 +50,111 @@ DATABASE_URL: Optional[str] = os.getenv("DATABASE_URL")
 RESEND_API_KEY: Optional[str] = os.getenv("RESEND_API_KEY")
 EMAIL_SENDER: Optional[str] = os.getenv("EMAIL_SENDER")
 
+# Database connection pool
+DB_POOL_MIN_SIZE: int = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE: int = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT: float = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+# Apply pending schema migrations at startup. Set to false when migrations are run
+# ahead of deploy (python -m api.manage migrate) so workers only check the version.
+DB_AUTO_MIGRATE: bool = os.getenv("DB_AUTO_MIGRATE", "true").lower() not in ("0", "false", "no")
+
+# Seconds each Gemini generation in POST /groups/{group_id}/analysis may take
+ANALYSIS_TASK_TIMEOUT: float = float(os.getenv("ANALYSIS_TASK_TIMEOUT", "90"))
+
+# Gemini response cache
+GEMINI_CACHE_ENABLED: bool = os.getenv("GEMINI_CACHE_ENABLED", "true").lower() not in ("0", "false", "no")
+GEMINI_CACHE_TTL: float = float(os.getenv("GEMINI_CACHE_TTL", str(7 * 24 * 3600)))
+GEMINI_CACHE_MAX_ENTRIES: int = int(os.getenv("GEMINI_CACHE_MAX_ENTRIES", "2000"))
+
+# Blob store for uploaded files and images (content-addressed by sha256).
+# Defaults to a "blobs" directory next to the SQLite database, e.g. /data/blobs.
+BLOB_STORE_BACKEND: str = os.getenv("BLOB_STORE_BACKEND", "local")
+BLOB_STORE_DIR: str = os.getenv("BLOB_STORE_DIR") or os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "blobs")
+
+# PDF text extraction (runs in a process pool off the request path)
+PDF_EXTRACT_WORKERS: int = int(os.getenv("PDF_EXTRACT_WORKERS", "2"))
+PDF_MAX_PAGES: int = int(os.getenv("PDF_MAX_PAGES", "500"))
+PDF_MAX_BYTES: int = int(os.getenv("PDF_MAX_BYTES", str(25 * 1024 * 1024)))
+
+# Background jobs (POST ...?background=true). Running jobs refresh a heartbeat every
+# JOB_STALE_AFTER / 4 seconds; a job whose heartbeat is older than JOB_STALE_AFTER was
+# orphaned by a restart or crash and is run again, up to JOB_MAX_ATTEMPTS times.
+JOB_WORKERS: int = int(os.getenv("JOB_WORKERS", "4"))
+JOB_STALE_AFTER: float = float(os.getenv("JOB_STALE_AFTER", "60"))
+JOB_MAX_ATTEMPTS: int = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+# Text chat memory. The prompt's syllabus + analysis + conversation history is kept under
+# CHAT_CONTEXT_TOKENS (estimated at ~4 characters per token). The last CHAT_RECENT_MESSAGES
+# messages are sent verbatim; older ones are folded into a rolling per-session summary.
+CHAT_CONTEXT_TOKENS: int = int(os.getenv("CHAT_CONTEXT_TOKENS", "8000"))
+CHAT_RECENT_MESSAGES: int = int(os.getenv("CHAT_RECENT_MESSAGES", "8"))
+CHAT_SUMMARY_WORDS: int = int(os.getenv("CHAT_SUMMARY_WORDS", "250"))
+
+# Retrieval over uploaded files: chunk size/overlap in words, chunks put into chat and
+# quiz prompts, and how many groups' BM25 indexes each process keeps in memory
+RETRIEVAL_CHUNK_WORDS: int = int(os.getenv("RETRIEVAL_CHUNK_WORDS", "200"))
+RETRIEVAL_CHUNK_OVERLAP: int = int(os.getenv("RETRIEVAL_CHUNK_OVERLAP", "40"))
+CHAT_RETRIEVAL_TOP_K: int = int(os.getenv("CHAT_RETRIEVAL_TOP_K", "4"))
+QUIZ_RETRIEVAL_TOP_K: int = int(os.getenv("QUIZ_RETRIEVAL_TOP_K", "12"))
+RETRIEVAL_INDEX_CACHE_GROUPS: int = int(os.getenv("RETRIEVAL_INDEX_CACHE_GROUPS", "64"))
+
+# Full-text search (GET /search): longest text kept per document; the rest of a very
+# long file is not searchable (Postgres tsvectors are capped at 1 MB)
+SEARCH_MAX_BODY_CHARS: int = int(os.getenv("SEARCH_MAX_BODY_CHARS", "200000"))
+
+# YouTube transcripts for video chat: cached per video; videos without a transcript are
+# remembered for a shorter time in case captions are added later
+YOUTUBE_TRANSCRIPT_TTL: float = float(os.getenv("YOUTUBE_TRANSCRIPT_TTL", str(30 * 24 * 3600)))
+YOUTUBE_UNAVAILABLE_TTL: float = float(os.getenv("YOUTUBE_UNAVAILABLE_TTL", str(6 * 3600)))
+YOUTUBE_TRANSCRIPT_LANGUAGES: tuple = tuple(
+    lang.strip() for lang in os.getenv("YOUTUBE_TRANSCRIPT_LANGUAGES", "en").split(",") if lang.strip()
+)
+# Video chat prompts include only the VIDEO_RETRIEVAL_TOP_K transcript windows (of
+# VIDEO_WINDOW_SECONDS, overlapping by VIDEO_WINDOW_OVERLAP) most relevant to the question
+VIDEO_WINDOW_SECONDS: float = float(os.getenv("VIDEO_WINDOW_SECONDS", "90"))
+VIDEO_WINDOW_OVERLAP: float = float(os.getenv("VIDEO_WINDOW_OVERLAP", "15"))
+VIDEO_RETRIEVAL_TOP_K: int = int(os.getenv("VIDEO_RETRIEVAL_TOP_K", "5"))
+
+# /recommendations: results cached per normalized query; on a miss the search backends
+# are raced, each starting RECOMMENDATION_HEDGE_DELAY s after the previous one, and the
+# request gives up after RECOMMENDATION_BUDGET s
+RECOMMENDATION_CACHE_TTL: float = float(os.getenv("RECOMMENDATION_CACHE_TTL", str(24 * 3600)))
+RECOMMENDATION_CACHE_MAX_ENTRIES: int = int(os.getenv("RECOMMENDATION_CACHE_MAX_ENTRIES", "5000"))
+RECOMMENDATION_BUDGET: float = float(os.getenv("RECOMMENDATION_BUDGET", "8"))
+RECOMMENDATION_HEDGE_DELAY: float = float(os.getenv("RECOMMENDATION_HEDGE_DELAY", "1.5"))
+
+# Outbound HTTP (api/services/http_client.py): timeouts in seconds, retries with
+# exponential backoff for idempotent calls, pooled connections and concurrent calls per host
+HTTP_CONNECT_TIMEOUT: float = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05"))
+HTTP_READ_TIMEOUT: float = float(os.getenv("HTTP_READ_TIMEOUT", "10"))
+HTTP_RETRIES: int = int(os.getenv("HTTP_RETRIES", "2"))
+HTTP_BACKOFF: float = float(os.getenv("HTTP_BACKOFF", "0.3"))
+HTTP_POOL_SIZE: int = int(os.getenv("HTTP_POOL_SIZE", "10"))
+HTTP_MAX_PER_HOST: int = int(os.getenv("HTTP_MAX_PER_HOST", "10"))
+
+# Resized variants of update images, served via /updates/{id}/image?w=
+IMAGE_VARIANT_FORMAT: str = os.getenv("IMAGE_VARIANT_FORMAT", "WEBP").upper()  # WEBP or JPEG
+IMAGE_VARIANT_QUALITY: int = int(os.getenv("IMAGE_VARIANT_QUALITY", "80"))
+
+# Live poll results (SSE): events buffered per slow subscriber, idle keepalive interval
+PUBSUB_QUEUE_SIZE: int = int(os.getenv("PUBSUB_QUEUE_SIZE", "100"))
+SSE_KEEPALIVE_SECONDS: float = float(os.getenv("SSE_KEEPALIVE_SECONDS", "15"))
+
+# Per-key Gemini budgets, enforced per process (divide a key's quota by the number of worker
+# processes). Defaults are the gemini-2.0-flash free tier; 0 disables a limit.
+GEMINI_KEY_RPM: int = int(os.getenv("GEMINI_KEY_RPM", "15"))
+GEMINI_KEY_TPM: int = int(os.getenv("GEMINI_KEY_TPM", "1000000"))
+# Seconds a key rests after a 429, doubled for each consecutive 429 up to the max
+GEMINI_KEY_COOLDOWN: float = float(os.getenv("GEMINI_KEY_COOLDOWN", "30"))
+GEMINI_KEY_MAX_COOLDOWN: float = float(os.getenv("GEMINI_KEY_MAX_COOLDOWN", "600"))
+# Longest a call waits for a key with budget left before giving up
+GEMINI_KEY_MAX_WAIT: float = float(os.getenv("GEMINI_KEY_MAX_WAIT", "10"))
+
+# Circuit breakers for Gemini, SerpAPI, YouTube and Resend: consecutive failures that open
+# a breaker, seconds it stays open before trial calls, and how many trials run at once
+BREAKER_FAILURE_THRESHOLD: int = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT: float = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+BREAKER_HALF_OPEN_CALLS: int = int(os.getenv("BREAKER_HALF_OPEN_CALLS", "1"))
+
 
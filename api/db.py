@@ -1,9 +1,14 @@
 import os
 import hashlib
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Optional, Any
+from typing import Optional, Any, Callable, Iterator, List, TypeVar
 import sqlite3
 
+from starlette.concurrency import run_in_threadpool
+
 # Import conditionally to avoid errors if not installed locally
 try:
     import psycopg2
@@ -11,7 +16,10 @@ try:
 except ImportError:
     psycopg2 = None
 
-from .core.config import DB_PATH, DATABASE_URL
+from .services.metrics import record_db_query
+from .core.config import DB_PATH, DATABASE_URL, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT, DB_AUTO_MIGRATE
+
+T = TypeVar("T")
 
 class SmartCursor:
     def __init__(self, cursor, is_postgres):
@@ -20,6 +28,13 @@ class SmartCursor:
         self._lastrowid = None
 
     def execute(self, query: str, params: Any = None):
+        started = time.perf_counter()
+        try:
+            self._execute(query, params)
+        finally:
+            record_db_query(time.perf_counter() - started)
+
+    def _execute(self, query: str, params: Any = None):
         if self.is_postgres:
             # Replace ? with %s for PostgreSQL
             if params:
@@ -81,225 +96,210 @@ class SmartConn:
     def __getattr__(self, name):
         return getattr(self.conn, name)
 
-def init_db() -> SmartConn:
-    is_postgres = False
+class PoolTimeout(Exception):
+    """Raised when no connection could be checked out within the pool timeout."""
+
+
+def _connect_sqlite() -> SmartConn:
+    raw_conn = sqlite3.connect(DB_PATH, check_same_thread=False, timeout=DB_POOL_TIMEOUT)
+    # WAL lets readers proceed while another pooled connection is writing
+    try:
+        raw_conn.execute("PRAGMA journal_mode=WAL")
+    except Exception:
+        pass
+    return SmartConn(raw_conn, False)
+
+
+def _connect_postgres() -> SmartConn:
+    return SmartConn(psycopg2.connect(DATABASE_URL), True)
+
+
+def _select_backend():
+    """Decides once which backend the pool connects to, keeping the SQLite fallback."""
     if DATABASE_URL:
         try:
-            raw_conn = psycopg2.connect(DATABASE_URL)
-            is_postgres = True
+            probe = _connect_postgres()
             print("Connected to PostgreSQL database.")
+            return _connect_postgres, probe
         except Exception as e:
             print(f"Failed to connect to PostgreSQL: {e}. Falling back to SQLite.")
-            raw_conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    else:
-        raw_conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-        print(f"Connected to SQLite database at {DB_PATH}")
+            return _connect_sqlite, _connect_sqlite()
+    print(f"Connected to SQLite database at {DB_PATH}")
+    return _connect_sqlite, _connect_sqlite()
+
+
+class ConnectionPool:
+    """
+    A thread-safe pool of SmartConn objects.
+
+    Connections are checked out per request (see get_conn) and returned when the
+    request finishes. Borrowed connections are health-checked with a trivial query
+    and transparently replaced if the server dropped them.
+    """
+
+    def __init__(self, connect, min_size: int = 1, max_size: int = 10, timeout: float = 30.0, initial: Optional[SmartConn] = None):
+        self._connect = connect
+        self.min_size = max(0, min_size)
+        self.max_size = max(1, max_size, self.min_size)
+        self.timeout = timeout
+        self._idle: List[SmartConn] = []
+        self._size = 0
+        self._cond = threading.Condition()
+
+        if initial is not None:
+            self._idle.append(initial)
+            self._size = 1
+        while self._size < self.min_size:
+            self._idle.append(self._connect())
+            self._size += 1
+
+        self.is_postgres = self._idle[0].is_postgres if self._idle else False
+
+    def _is_healthy(self, conn: SmartConn) -> bool:
+        try:
+            c = conn.conn.cursor()
+            c.execute("SELECT 1")
+            c.fetchone()
+            return True
+        except Exception:
+            return False
 
-    conn = SmartConn(raw_conn, is_postgres)
-    c = conn.cursor()
+    def _discard(self, conn: SmartConn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def acquire(self, timeout: Optional[float] = None) -> SmartConn:
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        while True:
+            conn = None
+            create = False
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(f"No database connection available within {self.timeout}s")
+                    self._cond.wait(remaining)
+                if self._idle:
+                    conn = self._idle.pop()
+                else:
+                    self._size += 1
+                    create = True
+
+            if create:
+                try:
+                    return self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+
+            if self._is_healthy(conn):
+                return conn
+            print("[DB POOL] Discarding broken connection")
+            self._discard(conn)
+
+    def release(self, conn: SmartConn) -> None:
+        # Never hand the next borrower a half-finished transaction
+        try:
+            conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self) -> Iterator[SmartConn]:
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "max_size": self.max_size,
+            }
+
+    def close_all(self) -> None:
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+def create_pool() -> ConnectionPool:
+    connect, first = _select_backend()
+    return ConnectionPool(
+        connect,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        timeout=DB_POOL_TIMEOUT,
+        initial=first,
+    )
 
-    # Define table creation SQL with compatibility adjustments
-    def run_create(sql):
-        if is_postgres:
-            # SQLite specific types to Postgres
-            sql = sql.replace('INTEGER PRIMARY KEY AUTOINCREMENT', 'SERIAL PRIMARY KEY')
-            sql = sql.replace('AUTOINCREMENT', '') # Fallback if part of a list
-            sql = sql.replace('BLOB', 'BYTEA')
-            sql = sql.replace('REAL', 'DOUBLE PRECISION')
-        c.execute(sql)
-
-    run_create('''CREATE TABLE IF NOT EXISTS admin_users (
-                   id INTEGER PRIMARY KEY AUTOINCREMENT,
-                   username TEXT UNIQUE,
-                   email TEXT,
-                   password TEXT,
-                   admin_code TEXT UNIQUE)''')
-
-    run_create('''CREATE TABLE IF NOT EXISTS users (
-                   id INTEGER PRIMARY KEY AUTOINCREMENT,
-                   username TEXT UNIQUE,
-                   password TEXT,
-                   course_id TEXT,
-                   education_level TEXT,
-                   admin_id INTEGER REFERENCES admin_users(id))''')
-    
-    # Migrations for existing tables
-    try:
-        c.execute("ALTER TABLE admin_users ADD COLUMN admin_code TEXT")
-        print("Migrated admin_users: added admin_code column")
-    except Exception: pass
 
-    try:
-        if is_postgres:
-            c.execute("ALTER TABLE users ADD COLUMN admin_id INTEGER REFERENCES admin_users(id)")
-        else:
-            c.execute("ALTER TABLE users ADD COLUMN admin_id INTEGER")
-        print("Migrated users: added admin_id column")
-    except Exception: pass
-
-    run_create('''CREATE TABLE IF NOT EXISTS admin_otp (
-                   code TEXT PRIMARY KEY,
-                   created_at TEXT)''')
-
-    run_create('''CREATE TABLE IF NOT EXISTS file_groups (
-                   id INTEGER PRIMARY KEY AUTOINCREMENT,
-                   user_id INTEGER REFERENCES users(id),
-                   group_name TEXT,
-                   created_at TEXT)''')
-
-    run_create('''CREATE TABLE IF NOT EXISTS files (
-                   id INTEGER PRIMARY KEY AUTOINCREMENT,
-                   group_id INTEGER REFERENCES file_groups(id),
-                   course_id TEXT,
-                   file_name TEXT,
-                   file_type TEXT,
-                   file_content BLOB,
-                   uploaded_at TEXT)''')
-    
-    # Migration: Add course_id to files if missing
-    try:
-        c.execute("ALTER TABLE files ADD COLUMN course_id TEXT")
-        print("Migrated files: added course_id column")
-    except Exception: pass
+pool = create_pool()
 
-    # Migration: Add extracted_text to files for binary preservation
-    try:
-        c.execute("ALTER TABLE files ADD COLUMN extracted_text TEXT")
-        print("Migrated files: added extracted_text column")
-    except Exception: pass
-
-    run_create('''CREATE TABLE IF NOT EXISTS syllabus (
-                   id INTEGER PRIMARY KEY AUTOINCREMENT,
-                   course_id TEXT,
-                   syllabus_content TEXT,
-                   saved_at TEXT)''')
-
-    run_create('''CREATE TABLE IF NOT EXISTS syllabus_for_students (
-                   id INTEGER PRIMARY KEY AUTOINCREMENT,
-                   group_id TEXT,
-                   syllabus_content TEXT,
-                   topics_ratings TEXT,
-                   saved_at TEXT)''')
-
-    run_create('''CREATE TABLE IF NOT EXISTS analysis_results (
-                   id INTEGER PRIMARY KEY AUTOINCREMENT,
-                   group_id INTEGER UNIQUE REFERENCES file_groups(id),
-                   analysis TEXT,
-                   timetable TEXT,
-                   roadmap TEXT,
-                   timestamp TEXT)''')
-
-    run_create('''CREATE TABLE IF NOT EXISTS chat_sessions (
-                   id TEXT PRIMARY KEY,
-                   user_id INTEGER,
-                   group_id INTEGER,
-                   title TEXT,
-                   created_at TEXT)''')
-
-    run_create('''CREATE TABLE IF NOT EXISTS chat_history (
-                   id INTEGER PRIMARY KEY AUTOINCREMENT,
-                   user_id INTEGER REFERENCES users(id),
-                   group_id INTEGER REFERENCES file_groups(id),
-                   session_id TEXT REFERENCES chat_sessions(id),
-                   role TEXT,
-                   message TEXT,
-                   timestamp TEXT)''')
-    
-    try: c.execute("ALTER TABLE chat_history ADD COLUMN session_id TEXT")
-    except Exception: pass
-
-    run_create('''CREATE TABLE IF NOT EXISTS chat_history_image (
-                   id INTEGER PRIMARY KEY AUTOINCREMENT,
-                   user_id INTEGER REFERENCES users(id),
-                   group_id INTEGER REFERENCES file_groups(id),
-                   session_id TEXT REFERENCES chat_sessions(id),
-                   image_id TEXT,
-                   image_path TEXT,
-                   role TEXT,
-                   message TEXT,
-                   timestamp TEXT)''')
-    
-    try: c.execute("ALTER TABLE chat_history_image ADD COLUMN session_id TEXT")
-    except Exception: pass
-
-    run_create('''CREATE TABLE IF NOT EXISTS chat_history_video (
-                   id INTEGER PRIMARY KEY AUTOINCREMENT,
-                   user_id INTEGER REFERENCES users(id),
-                   group_id INTEGER REFERENCES file_groups(id),
-                   session_id TEXT REFERENCES chat_sessions(id),
-                   video_id TEXT,
-                   video_url TEXT,
-                   role TEXT,
-                   message TEXT,
-                   timestamp TEXT)''')
-    
-    try: c.execute("ALTER TABLE chat_history_video ADD COLUMN session_id TEXT")
-    except Exception: pass
-
-    run_create('''CREATE TABLE IF NOT EXISTS session_history (
-                   id INTEGER PRIMARY KEY AUTOINCREMENT,
-                   user_id INTEGER REFERENCES users(id),
-                   group_id INTEGER REFERENCES file_groups(id),
-                   action TEXT,
-                   timestamp TEXT,
-                   details TEXT)'''
-    )
-    
-    run_create('''CREATE TABLE IF NOT EXISTS quiz_results (
-                   id INTEGER PRIMARY KEY AUTOINCREMENT,
-                   user_id INTEGER REFERENCES users(id),
-                   group_id INTEGER REFERENCES file_groups(id),
-                   subject TEXT,
-                   quiz_date TEXT,
-                   total_marks DOUBLE PRECISION,
-                   details TEXT)'''
-    )
 
-    # Updates & Polls
-    run_create('''CREATE TABLE IF NOT EXISTS updates (
-                   id INTEGER PRIMARY KEY AUTOINCREMENT,
-                   course_id TEXT,
-                   content TEXT,
-                   image_path TEXT,
-                   external_url TEXT,
-                   image_data BLOB,
-                   created_at TEXT)'''
-    )
+def get_conn() -> Iterator[SmartConn]:
+    """FastAPI dependency: checks a connection out of the pool for the duration of a request."""
+    with pool.connection() as conn:
+        yield conn
 
-    try:
-        c.execute("ALTER TABLE updates ADD COLUMN image_data BLOB")
-    except Exception: pass
-
-    run_create('''CREATE TABLE IF NOT EXISTS polls (
-                   id INTEGER PRIMARY KEY AUTOINCREMENT,
-                   course_id TEXT,
-                   question TEXT,
-                   created_at TEXT)'''
-    )
 
-    run_create('''CREATE TABLE IF NOT EXISTS poll_options (
-                   id INTEGER PRIMARY KEY AUTOINCREMENT,
-                   poll_id INTEGER REFERENCES polls(id),
-                   option_text TEXT)'''
-    )
+async def run_with_conn(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    For async endpoints: runs fn(conn, *args, **kwargs) in the threadpool on a pooled
+    connection that is returned as soon as fn does, so no connection (or thread) is
+    held while the endpoint awaits something slow. fn commits its own writes.
+    """
+    def call() -> T:
+        with pool.connection() as conn:
+            return fn(conn, *args, **kwargs)
+    return await run_in_threadpool(call)
 
-    run_create('''CREATE TABLE IF NOT EXISTS poll_votes (
-                   id INTEGER PRIMARY KEY AUTOINCREMENT,
-                   poll_id INTEGER REFERENCES polls(id),
-                   option_id INTEGER REFERENCES poll_options(id),
-                   user_id INTEGER REFERENCES users(id),
-                   UNIQUE(poll_id, user_id))'''
-    )
 
-    conn.commit()
-    return conn
+def init_db(conn: Optional[SmartConn] = None) -> None:
+    """
+    Brings the schema up to date. A worker whose database is already current only
+    pays for one schema_version read; with DB_AUTO_MIGRATE=false pending migrations
+    are reported but left for `python -m api.manage migrate`.
+    """
+    from .migrations import LATEST_VERSION, current_version, migrate
+
+    if conn is None:
+        with pool.connection() as pooled:
+            return init_db(pooled)
+
+    version = current_version(conn)
+    if version >= LATEST_VERSION:
+        return
+    if not DB_AUTO_MIGRATE:
+        print(f"[DB] Schema is at version {version}, latest is {LATEST_VERSION}. Run `python -m api.manage migrate`.")
+        return
+    migrate(conn)
 
-conn = init_db()
 
 def hash_password(password: str) -> str:
     return hashlib.sha256(password.encode()).hexdigest()
 
-def log_action(user_id: Optional[int], group_id: Optional[int], action: str, details: str = "") -> None:
+def log_action(conn: SmartConn, user_id: Optional[int], group_id: Optional[int], action: str, details: str = "") -> None:
     c = conn.cursor()
     timestamp = datetime.now().isoformat()
     # Handle NULLs correctly in the Tuple
@@ -308,23 +308,3 @@ def log_action(user_id: Optional[int], group_id: Optional[int], action: str, det
         (user_id, group_id, action, timestamp, details),
     )
     conn.commit()
-
-
-def get_group_report_text(group_id: int) -> str:
-    c = conn.cursor()
-    c.execute("SELECT file_content FROM files WHERE group_id=?", (group_id,))
-    files_data = c.fetchall()
-    report = ""
-    for (file_content,) in files_data:
-        try:
-            if isinstance(file_content, bytes):
-                # Handle Postgres memoryview vs SQLite bytes
-                if hasattr(file_content, 'tobytes'):
-                    report += file_content.tobytes().decode("utf-8") + "\n"
-                else:
-                    report += file_content.decode("utf-8") + "\n"
-            else:
-                report += str(file_content) + "\n"
-        except Exception:
-            report += str(file_content) + "\n"
-    return report
@@ -0,0 +1,129 @@
+"""
+Maintenance commands for the backend database.
+
+    python -m api.manage migrate            # apply pending schema migrations
+    python -m api.manage migrate --to 1     # apply up to a given version
+    python -m api.manage status             # show applied and pending versions
+    python -m api.manage move-blobs         # move inline file/image BLOBs into the blob store
+    python -m api.manage reconcile-votes    # rebuild poll vote counters from poll_votes
+    python -m api.manage image-variants     # render missing resized variants of update images
+    python -m api.manage search-reindex     # rebuild the full-text search index
+"""
+import argparse
+import sys
+
+from .db import pool
+from .migrations import LATEST_VERSION, MIGRATIONS, current_version, migrate
+
+
+def cmd_migrate(args) -> int:
+    with pool.connection() as conn:
+        applied = migrate(conn, target=args.to or LATEST_VERSION)
+        version = current_version(conn)
+    if applied:
+        print(f"Applied versions {applied}; schema is now at version {version}.")
+    else:
+        print(f"Nothing to do; schema is at version {version}.")
+    return 0
+
+
+def cmd_status(args) -> int:
+    with pool.connection() as conn:
+        version = current_version(conn)
+    for number, description, _ in MIGRATIONS:
+        state = "applied" if number <= version else "pending"
+        print(f"{number:>4}  {state:<8} {description}")
+    return 0 if version >= LATEST_VERSION else 1
+
+
+def cmd_move_blobs(args) -> int:
+    from .services.blobstore import blob_store, move_blobs_out
+
+    with pool.connection() as conn:
+        if current_version(conn) < 3:
+            print("Run `python -m api.manage migrate` first.")
+            return 1
+        moved = move_blobs_out(conn, blob_store, batch_size=args.batch_size)
+        is_postgres = conn.is_postgres
+    print(f"Moved {moved['files']} file(s) and {moved['updates']} image(s) into the blob store.")
+    if is_postgres and any(moved.values()):
+        print("Run VACUUM on files and updates to reclaim the space.")
+    return 0
+
+
+def cmd_reconcile_votes(args) -> int:
+    from .services.polls import reconcile_vote_counts
+
+    with pool.connection() as conn:
+        if current_version(conn) < 6:
+            print("Run `python -m api.manage migrate` first.")
+            return 1
+        drifted = reconcile_vote_counts(conn)
+    for option_id, stored, actual in drifted:
+        print(f"  option {option_id}: {stored} -> {actual}")
+    print(f"Corrected {len(drifted)} vote counter(s).")
+    return 0
+
+
+def cmd_image_variants(args) -> int:
+    from .services.images import generate_variants
+
+    with pool.connection() as conn:
+        if current_version(conn) < 7:
+            print("Run `python -m api.manage migrate` first.")
+            return 1
+        c = conn.cursor()
+        c.execute("SELECT DISTINCT image_sha256 FROM updates WHERE image_sha256 IS NOT NULL")
+        digests = [row[0] for row in c.fetchall()]
+    rendered = 0
+    for digest in digests:
+        try:
+            rendered += len(generate_variants(digest))
+        except Exception as e:
+            print(f"  {digest[:12]}: {e}")
+    print(f"Rendered {rendered} variant(s) for {len(digests)} image(s).")
+    return 0
+
+
+def cmd_search_reindex(args) -> int:
+    from .services.search import reindex
+
+    with pool.connection() as conn:
+        if current_version(conn) < 10:
+            print("Run `python -m api.manage migrate` first.")
+            return 1
+        count = reindex(conn)
+    print(f"Indexed {count} document(s) for search.")
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m api.manage")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("migrate", help="Apply pending schema migrations")
+    p.add_argument("--to", type=int, default=None, help="Target version (default: latest)")
+    p.set_defaults(func=cmd_migrate)
+
+    p = sub.add_parser("status", help="Show schema migration status")
+    p.set_defaults(func=cmd_status)
+
+    p = sub.add_parser("move-blobs", help="Move inline BLOBs into the blob store")
+    p.add_argument("--batch-size", type=int, default=50)
+    p.set_defaults(func=cmd_move_blobs)
+
+    p = sub.add_parser("reconcile-votes", help="Rebuild poll vote counters from poll_votes")
+    p.set_defaults(func=cmd_reconcile_votes)
+
+    p = sub.add_parser("image-variants", help="Render missing resized variants of update images")
+    p.set_defaults(func=cmd_image_variants)
+
+    p = sub.add_parser("search-reindex", help="Rebuild the full-text search index")
+    p.set_defaults(func=cmd_search_reindex)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,467 @@
+"""
+Ordered schema migrations.
+
+Each migration runs once, in its own transaction, and is recorded in schema_version.
+Workers migrating at the same time are serialized by a lock held for each step's
+transaction (pg_advisory_xact_lock on PostgreSQL, BEGIN IMMEDIATE on SQLite).
+Startup only reads the current version; pending steps are applied either by the app
+(DB_AUTO_MIGRATE=true, the default) or ahead of deploy with:
+
+    python -m api.manage migrate
+"""
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+from .db import SmartConn
+
+
+def to_dialect(sql: str, is_postgres: bool) -> str:
+    """Rewrites SQLite DDL types for PostgreSQL."""
+    if is_postgres:
+        sql = sql.replace('INTEGER PRIMARY KEY AUTOINCREMENT', 'SERIAL PRIMARY KEY')
+        sql = sql.replace('AUTOINCREMENT', '') # Fallback if part of a list
+        sql = sql.replace('BLOB', 'BYTEA')
+        sql = sql.replace('REAL', 'DOUBLE PRECISION')
+    return sql
+
+
+def column_exists(c, table: str, column: str, is_postgres: bool) -> bool:
+    if is_postgres:
+        c.execute(
+            "SELECT 1 FROM information_schema.columns WHERE table_name=? AND column_name=?",
+            (table, column),
+        )
+        return c.fetchone() is not None
+    c.execute(f"PRAGMA table_info({table})")
+    return any(row[1] == column for row in c.fetchall())
+
+
+def add_column(c, table: str, column: str, definition: str, is_postgres: bool) -> None:
+    """ALTER TABLE ... ADD COLUMN, skipped when the column is already there."""
+    if not column_exists(c, table, column, is_postgres):
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {to_dialect(definition, is_postgres)}")
+        print(f"Migrated {table}: added {column} column")
+
+
+def _baseline(c, is_postgres: bool) -> None:
+    def run_create(sql):
+        c.execute(to_dialect(sql, is_postgres))
+
+    run_create('''CREATE TABLE IF NOT EXISTS admin_users (
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   username TEXT UNIQUE,
+                   email TEXT,
+                   password TEXT,
+                   admin_code TEXT UNIQUE)''')
+
+    run_create('''CREATE TABLE IF NOT EXISTS users (
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   username TEXT UNIQUE,
+                   password TEXT,
+                   course_id TEXT,
+                   education_level TEXT,
+                   admin_id INTEGER REFERENCES admin_users(id))''')
+
+    # Columns added after the first deployments
+    add_column(c, "admin_users", "admin_code", "TEXT", is_postgres)
+    add_column(c, "users", "admin_id", "INTEGER REFERENCES admin_users(id)" if is_postgres else "INTEGER", is_postgres)
+
+    run_create('''CREATE TABLE IF NOT EXISTS admin_otp (
+                   code TEXT PRIMARY KEY,
+                   created_at TEXT)''')
+
+    run_create('''CREATE TABLE IF NOT EXISTS file_groups (
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   user_id INTEGER REFERENCES users(id),
+                   group_name TEXT,
+                   created_at TEXT)''')
+
+    run_create('''CREATE TABLE IF NOT EXISTS files (
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   group_id INTEGER REFERENCES file_groups(id),
+                   course_id TEXT,
+                   file_name TEXT,
+                   file_type TEXT,
+                   file_content BLOB,
+                   uploaded_at TEXT)''')
+
+    add_column(c, "files", "course_id", "TEXT", is_postgres)
+    # extracted_text keeps the AI-readable text next to the binary original
+    add_column(c, "files", "extracted_text", "TEXT", is_postgres)
+
+    run_create('''CREATE TABLE IF NOT EXISTS syllabus (
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   course_id TEXT,
+                   syllabus_content TEXT,
+                   saved_at TEXT)''')
+
+    run_create('''CREATE TABLE IF NOT EXISTS syllabus_for_students (
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   group_id TEXT,
+                   syllabus_content TEXT,
+                   topics_ratings TEXT,
+                   saved_at TEXT)''')
+
+    run_create('''CREATE TABLE IF NOT EXISTS analysis_results (
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   group_id INTEGER UNIQUE REFERENCES file_groups(id),
+                   analysis TEXT,
+                   timetable TEXT,
+                   roadmap TEXT,
+                   timestamp TEXT)''')
+
+    run_create('''CREATE TABLE IF NOT EXISTS chat_sessions (
+                   id TEXT PRIMARY KEY,
+                   user_id INTEGER,
+                   group_id INTEGER,
+                   title TEXT,
+                   created_at TEXT)''')
+
+    run_create('''CREATE TABLE IF NOT EXISTS chat_history (
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   user_id INTEGER REFERENCES users(id),
+                   group_id INTEGER REFERENCES file_groups(id),
+                   session_id TEXT REFERENCES chat_sessions(id),
+                   role TEXT,
+                   message TEXT,
+                   timestamp TEXT)''')
+
+    add_column(c, "chat_history", "session_id", "TEXT", is_postgres)
+
+    run_create('''CREATE TABLE IF NOT EXISTS chat_history_image (
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   user_id INTEGER REFERENCES users(id),
+                   group_id INTEGER REFERENCES file_groups(id),
+                   session_id TEXT REFERENCES chat_sessions(id),
+                   image_id TEXT,
+                   image_path TEXT,
+                   role TEXT,
+                   message TEXT,
+                   timestamp TEXT)''')
+
+    add_column(c, "chat_history_image", "session_id", "TEXT", is_postgres)
+
+    run_create('''CREATE TABLE IF NOT EXISTS chat_history_video (
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   user_id INTEGER REFERENCES users(id),
+                   group_id INTEGER REFERENCES file_groups(id),
+                   session_id TEXT REFERENCES chat_sessions(id),
+                   video_id TEXT,
+                   video_url TEXT,
+                   role TEXT,
+                   message TEXT,
+                   timestamp TEXT)''')
+
+    add_column(c, "chat_history_video", "session_id", "TEXT", is_postgres)
+
+    run_create('''CREATE TABLE IF NOT EXISTS session_history (
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   user_id INTEGER REFERENCES users(id),
+                   group_id INTEGER REFERENCES file_groups(id),
+                   action TEXT,
+                   timestamp TEXT,
+                   details TEXT)'''
+    )
+
+    run_create('''CREATE TABLE IF NOT EXISTS quiz_results (
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   user_id INTEGER REFERENCES users(id),
+                   group_id INTEGER REFERENCES file_groups(id),
+                   subject TEXT,
+                   quiz_date TEXT,
+                   total_marks DOUBLE PRECISION,
+                   details TEXT)'''
+    )
+
+    # Updates & Polls
+    run_create('''CREATE TABLE IF NOT EXISTS updates (
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   course_id TEXT,
+                   content TEXT,
+                   image_path TEXT,
+                   external_url TEXT,
+                   image_data BLOB,
+                   created_at TEXT)'''
+    )
+
+    add_column(c, "updates", "image_data", "BLOB", is_postgres)
+
+    run_create('''CREATE TABLE IF NOT EXISTS polls (
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   course_id TEXT,
+                   question TEXT,
+                   created_at TEXT)'''
+    )
+
+    run_create('''CREATE TABLE IF NOT EXISTS poll_options (
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   poll_id INTEGER REFERENCES polls(id),
+                   option_text TEXT)'''
+    )
+
+    run_create('''CREATE TABLE IF NOT EXISTS poll_votes (
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   poll_id INTEGER REFERENCES polls(id),
+                   option_id INTEGER REFERENCES poll_options(id),
+                   user_id INTEGER REFERENCES users(id),
+                   UNIQUE(poll_id, user_id))'''
+    )
+
+    run_create('''CREATE TABLE IF NOT EXISTS response_cache (
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   namespace TEXT,
+                   cache_key TEXT,
+                   value TEXT,
+                   created_at REAL,
+                   last_access REAL,
+                   UNIQUE(namespace, cache_key))'''
+    )
+
+
+def _hot_lookup_indexes(c, is_postgres: bool) -> None:
+    for sql in [
+        "CREATE INDEX IF NOT EXISTS idx_files_group_id ON files(group_id)",
+        "CREATE INDEX IF NOT EXISTS idx_files_course_id ON files(course_id)",
+        "CREATE INDEX IF NOT EXISTS idx_chat_history_user_group_session ON chat_history(user_id, group_id, session_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_chat_history_image_lookup ON chat_history_image(user_id, group_id, image_id)",
+        "CREATE INDEX IF NOT EXISTS idx_chat_history_video_lookup ON chat_history_video(user_id, group_id, video_id)",
+        "CREATE INDEX IF NOT EXISTS idx_chat_sessions_user_group_created ON chat_sessions(user_id, group_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_quiz_results_user_group ON quiz_results(user_id, group_id, quiz_date)",
+        "CREATE INDEX IF NOT EXISTS idx_file_groups_user_id ON file_groups(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_syllabus_course_id ON syllabus(course_id)",
+        "CREATE INDEX IF NOT EXISTS idx_syllabus_for_students_group_id ON syllabus_for_students(group_id)",
+        # poll_votes(poll_id, user_id) is already covered by its UNIQUE constraint
+        "CREATE INDEX IF NOT EXISTS idx_poll_votes_option_id ON poll_votes(option_id)",
+        "CREATE INDEX IF NOT EXISTS idx_poll_options_poll_id ON poll_options(poll_id)",
+        "CREATE INDEX IF NOT EXISTS idx_polls_course_created ON polls(course_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_updates_course_created ON updates(course_id, created_at)",
+    ]:
+        c.execute(sql)
+
+
+def _blob_references(c, is_postgres: bool) -> None:
+    add_column(c, "files", "blob_sha256", "TEXT", is_postgres)
+    add_column(c, "files", "file_size", "INTEGER", is_postgres)
+    add_column(c, "updates", "image_sha256", "TEXT", is_postgres)
+    add_column(c, "updates", "image_size", "INTEGER", is_postgres)
+
+
+def _extraction_status(c, is_postgres: bool) -> None:
+    # NULL means the row predates background extraction and its text is already in place
+    add_column(c, "files", "extraction_status", "TEXT", is_postgres)
+    add_column(c, "files", "extraction_error", "TEXT", is_postgres)
+
+
+def _jobs(c, is_postgres: bool) -> None:
+    c.execute(to_dialect('''CREATE TABLE IF NOT EXISTS jobs (
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   kind TEXT NOT NULL,
+                   params TEXT,
+                   status TEXT NOT NULL,
+                   result TEXT,
+                   error TEXT,
+                   idempotency_key TEXT UNIQUE,
+                   attempts INTEGER DEFAULT 0,
+                   created_at TEXT,
+                   started_at TEXT,
+                   finished_at TEXT)''', is_postgres))
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, kind)")
+
+
+def _poll_vote_counts(c, is_postgres: bool) -> None:
+    # Maintained by POST /polls/vote; `python -m api.manage reconcile-votes` rebuilds it
+    add_column(c, "poll_options", "vote_count", "INTEGER DEFAULT 0", is_postgres)
+    c.execute(
+        "UPDATE poll_options SET vote_count = "
+        "(SELECT COUNT(*) FROM poll_votes v WHERE v.option_id = poll_options.id)"
+    )
+
+
+def _image_variants(c, is_postgres: bool) -> None:
+    c.execute(to_dialect('''CREATE TABLE IF NOT EXISTS image_variants (
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   source_sha256 TEXT NOT NULL,
+                   variant TEXT NOT NULL,
+                   blob_sha256 TEXT NOT NULL,
+                   media_type TEXT,
+                   width INTEGER,
+                   height INTEGER,
+                   size INTEGER,
+                   created_at TEXT,
+                   UNIQUE(source_sha256, variant))''', is_postgres))
+
+
+def _chat_memory(c, is_postgres: bool) -> None:
+    c.execute(to_dialect('''CREATE TABLE IF NOT EXISTS chat_session_memory (
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   session_id TEXT UNIQUE NOT NULL,
+                   summary TEXT,
+                   summarized_until INTEGER DEFAULT 0,
+                   updated_at TEXT)''', is_postgres))
+
+
+def _file_chunks(c, is_postgres: bool) -> None:
+    c.execute(to_dialect('''CREATE TABLE IF NOT EXISTS file_chunks (
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   file_id INTEGER NOT NULL,
+                   group_id INTEGER,
+                   chunk_index INTEGER NOT NULL,
+                   content TEXT NOT NULL,
+                   created_at TEXT)''', is_postgres))
+    c.execute("CREATE INDEX IF NOT EXISTS idx_file_chunks_group_id ON file_chunks(group_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_file_chunks_file_id ON file_chunks(file_id)")
+
+
+def _search_index(c, is_postgres: bool) -> None:
+    from .services.search import backfill
+
+    if is_postgres:
+        c.execute('''CREATE TABLE IF NOT EXISTS search_documents (
+                       id SERIAL PRIMARY KEY,
+                       kind TEXT NOT NULL,
+                       ref_id INTEGER NOT NULL,
+                       user_id INTEGER,
+                       group_id INTEGER,
+                       course_id TEXT,
+                       session_id TEXT,
+                       title TEXT,
+                       body TEXT,
+                       created_at TEXT,
+                       document tsvector GENERATED ALWAYS AS (
+                           setweight(to_tsvector('english', COALESCE(title, '')), 'A') ||
+                           setweight(to_tsvector('english', COALESCE(body, '')), 'B')
+                       ) STORED,
+                       UNIQUE(kind, ref_id))''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_search_documents_document ON search_documents USING GIN(document)")
+    else:
+        c.execute('''CREATE TABLE IF NOT EXISTS search_documents (
+                       id INTEGER PRIMARY KEY AUTOINCREMENT,
+                       kind TEXT NOT NULL,
+                       ref_id INTEGER NOT NULL,
+                       user_id INTEGER,
+                       group_id INTEGER,
+                       course_id TEXT,
+                       session_id TEXT,
+                       title TEXT,
+                       body TEXT,
+                       created_at TEXT,
+                       UNIQUE(kind, ref_id))''')
+        # External-content FTS5 index over search_documents, kept in step by triggers
+        c.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5("
+            "title, body, content='search_documents', content_rowid='id', tokenize='porter unicode61')"
+        )
+        c.execute('''CREATE TRIGGER IF NOT EXISTS search_documents_ai AFTER INSERT ON search_documents BEGIN
+                       INSERT INTO search_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+                   END''')
+        c.execute('''CREATE TRIGGER IF NOT EXISTS search_documents_ad AFTER DELETE ON search_documents BEGIN
+                       INSERT INTO search_fts(search_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+                   END''')
+        c.execute('''CREATE TRIGGER IF NOT EXISTS search_documents_au AFTER UPDATE ON search_documents BEGIN
+                       INSERT INTO search_fts(search_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+                       INSERT INTO search_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+                   END''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_search_documents_user_id ON search_documents(user_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_search_documents_group_id ON search_documents(group_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_search_documents_course_id ON search_documents(course_id)")
+    c.execute("SELECT COUNT(*) FROM search_documents")
+    if c.fetchone()[0] == 0:
+        print(f"Indexed {backfill(c, is_postgres)} existing document(s) for search")
+
+
+def _video_transcripts(c, is_postgres: bool) -> None:
+    c.execute(to_dialect('''CREATE TABLE IF NOT EXISTS video_transcripts (
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   video_id TEXT UNIQUE NOT NULL,
+                   title TEXT,
+                   segments TEXT,
+                   status TEXT NOT NULL,
+                   error TEXT,
+                   fetched_at REAL NOT NULL)''', is_postgres))
+
+
+def _job_heartbeats(c, is_postgres: bool) -> None:
+    add_column(c, "jobs", "heartbeat_at", "TEXT", is_postgres)
+
+
+# (version, description, step). Append new steps; never renumber or edit applied ones.
+MIGRATIONS: List[Tuple[int, str, Callable]] = [
+    (1, "Baseline schema", _baseline),
+    (2, "Indexes for hot lookup columns", _hot_lookup_indexes),
+    (3, "Blob store references on files and updates", _blob_references),
+    (4, "Extraction status on files", _extraction_status),
+    (5, "Background jobs", _jobs),
+    (6, "Materialized vote counts on poll options", _poll_vote_counts),
+    (7, "Resized image variants", _image_variants),
+    (8, "Rolling chat session summaries", _chat_memory),
+    (9, "Chunked file text for retrieval", _file_chunks),
+    (10, "Full-text search index", _search_index),
+    (11, "Cached YouTube transcripts", _video_transcripts),
+    (12, "Heartbeats on running jobs", _job_heartbeats),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# Advisory lock key (Postgres) shared by every process that migrates this database
+MIGRATION_LOCK_ID = 51_337_006
+
+SCHEMA_VERSION_DDL = '''CREATE TABLE IF NOT EXISTS schema_version (
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   version INTEGER UNIQUE,
+                   description TEXT,
+                   applied_at TEXT)'''
+
+
+def current_version(conn: SmartConn) -> int:
+    """The highest applied version, 0 for a database that has never been migrated."""
+    c = conn.cursor()
+    try:
+        c.execute("SELECT MAX(version) FROM schema_version")
+        row = c.fetchone()
+        return (row[0] if row else None) or 0
+    except Exception:
+        conn.rollback()
+        return 0
+
+
+def _lock(c, is_postgres: bool) -> None:
+    """
+    Starts a transaction holding the migration lock until it commits or rolls back,
+    so workers migrating at boot apply each step once, one after another.
+    """
+    if is_postgres:
+        c.execute("SELECT pg_advisory_xact_lock(?)", (MIGRATION_LOCK_ID,))
+    else:
+        c.execute("BEGIN IMMEDIATE")
+
+
+def migrate(conn: SmartConn, target: int = LATEST_VERSION) -> List[int]:
+    """Applies every pending migration up to target and returns the versions applied."""
+    if current_version(conn) >= target:
+        return []
+
+    c = conn.cursor()
+    applied = []
+    for number, description, step in MIGRATIONS:
+        if number > target:
+            break
+        try:
+            _lock(c, conn.is_postgres)
+            c.execute(to_dialect(SCHEMA_VERSION_DDL, conn.is_postgres))
+            # Another worker may have applied it while this one waited for the lock
+            if current_version(conn) >= number:
+                conn.commit()
+                continue
+            step(c, conn.is_postgres)
+            c.execute(
+                "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                (number, description, datetime.now().isoformat()),
+            )
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"Schema version {number} ({description}) failed: {e}")
+            raise
+        print(f"Applied schema version {number}: {description}")
+        applied.append(number)
+    return applied
@@ -1,13 +1,18 @@
 import os
 import random
 import string
-import requests
 from typing import List
 from datetime import datetime
-from fastapi import APIRouter, HTTPException, UploadFile, File, BackgroundTasks, Response
+from fastapi import APIRouter, HTTPException, UploadFile, File, BackgroundTasks, Depends, Request
 
 from ..core.config import RESEND_API_KEY
-from ..db import conn, hash_password, log_action
+from ..db import SmartConn, get_conn, hash_password, log_action, run_with_conn
+from ..services import http_client
+from ..services.blobstore import blob_store, _as_bytes
+from ..services.http_cache import blob_response, bytes_response
+from ..services.retrieval import delete_file_chunks
+from ..services.search import remove_document
+from .groups_files import store_uploaded_file
 from ..schemas import (
     SignupRequest, 
     CreateGroupRequest, 
@@ -25,7 +30,7 @@ router = APIRouter(prefix="/admin", tags=["admin"])
 
 
 @router.post("/users")
-def create_user(req: SignupRequest):
+def create_user(req: SignupRequest, conn: SmartConn = Depends(get_conn)):
     c = conn.cursor()
     # Check if admin_id is valid
     try:
@@ -51,7 +56,7 @@ def create_user(req: SignupRequest):
 
 
 @router.get("/users")
-def list_users():
+def list_users(conn: SmartConn = Depends(get_conn)):
     c = conn.cursor()
     c.execute("SELECT id, username, course_id, education_level FROM users ORDER BY id")
     rows = c.fetchall()
@@ -62,14 +67,14 @@ def list_users():
 
 
 @router.get("/courses")
-def list_course_ids():
+def list_course_ids(conn: SmartConn = Depends(get_conn)):
     c = conn.cursor()
     c.execute("SELECT DISTINCT course_id FROM users")
     return [row[0] for row in c.fetchall() if row[0] is not None]
 
 
 @router.get("/courses/{course_id}/users")
-def list_users_by_course(course_id: str):
+def list_users_by_course(course_id: str, conn: SmartConn = Depends(get_conn)):
     c = conn.cursor()
     c.execute("SELECT id, username FROM users WHERE course_id=?", (course_id,))
     rows = c.fetchall()
@@ -78,7 +83,7 @@ def list_users_by_course(course_id: str):
 
 # Admin helpers for groups/files (mirrors UI in admin.py)
 @router.get("/users/{user_id}/groups")
-def admin_get_user_groups(user_id: int):
+def admin_get_user_groups(user_id: int, conn: SmartConn = Depends(get_conn)):
     c = conn.cursor()
     c.execute("SELECT id, group_name FROM file_groups WHERE user_id=?", (user_id,))
     groups = c.fetchall()
@@ -86,7 +91,7 @@ def admin_get_user_groups(user_id: int):
 
 
 @router.post("/users/{user_id}/groups")
-def admin_create_group(user_id: int, req: CreateGroupRequest):
+def admin_create_group(user_id: int, req: CreateGroupRequest, conn: SmartConn = Depends(get_conn)):
     c = conn.cursor()
     created_at = datetime.now().isoformat()
     c.execute(
@@ -94,62 +99,37 @@ def admin_create_group(user_id: int, req: CreateGroupRequest):
         (user_id, req.group_name, created_at),
     )
     conn.commit()
-    log_action(user_id, c.lastrowid, "create_group", f"Created group: {req.group_name} by admin")
+    log_action(conn, user_id, c.lastrowid, "create_group", f"Created group: {req.group_name} by admin")
     return {"status": "ok", "group_id": c.lastrowid}
 
 
-def _read_pdf_bytes_or_text(content_type: str, data: bytes) -> str:
-    if content_type == "text/plain":
-        try:
-            return data.decode("utf-8")
-        except Exception:
-            return data.decode("latin-1", errors="ignore")
-    if content_type == "application/pdf":
-        try:
-            import fitz  # type: ignore
-        except Exception:
-            raise HTTPException(status_code=500, detail="PyMuPDF not installed")
-        text = ""
-        doc = fitz.open(stream=data, filetype="pdf")
-        for p in doc:
-            text += p.get_text()
-        return text
-    raise HTTPException(status_code=400, detail="Unsupported file type")
-
-
 @router.post("/groups/{group_id}/files", response_model=FileResponse)
 async def admin_upload_file(group_id: int, file: UploadFile = File(...)):
     raw = await file.read()
-    content = _read_pdf_bytes_or_text(file.content_type, raw)
-    c = conn.cursor()
-    uploaded_at = datetime.now().isoformat()
-    c.execute(
-        "INSERT INTO files (group_id, file_name, file_type, file_content, uploaded_at) VALUES (?, ?, ?, ?, ?)",
-        (group_id, file.filename, file.content_type, content, uploaded_at),
-    )
-    conn.commit()
-    return FileResponse(id=c.lastrowid, file_name=file.filename, file_type=file.content_type, uploaded_at=uploaded_at)
+    return await run_with_conn(store_uploaded_file, file, raw, group_id=group_id)
 
 
 @router.get("/groups/{group_id}/files", response_model=List[FileResponse])
-def admin_list_files(group_id: int):
+def admin_list_files(group_id: int, conn: SmartConn = Depends(get_conn)):
     c = conn.cursor()
-    c.execute("SELECT id, file_name, file_type, uploaded_at FROM files WHERE group_id=?", (group_id,))
+    c.execute("SELECT id, file_name, file_type, uploaded_at, extraction_status FROM files WHERE group_id=?", (group_id,))
     rows = c.fetchall()
-    return [FileResponse(id=r[0], file_name=r[1], file_type=r[2], uploaded_at=r[3]) for r in rows]
+    return [FileResponse(id=r[0], file_name=r[1], file_type=r[2], uploaded_at=r[3], extraction_status=r[4] or "done") for r in rows]
 
 
 @router.delete("/files/{file_id}")
-def admin_delete_file(file_id: int):
+def admin_delete_file(file_id: int, conn: SmartConn = Depends(get_conn)):
     c = conn.cursor()
     c.execute("DELETE FROM files WHERE id=?", (file_id,))
+    delete_file_chunks(conn, file_id)
+    remove_document(conn, "file", file_id)
     conn.commit()
     return {"status": "ok"}
 
 
 # Admin syllabus management (course-level)
 @router.get("/courses/{course_id}/syllabus")
-def admin_get_course_syllabus(course_id: str):
+def admin_get_course_syllabus(course_id: str, conn: SmartConn = Depends(get_conn)):
     c = conn.cursor()
     c.execute("SELECT syllabus_content, saved_at FROM syllabus WHERE course_id=?", (course_id,))
     row = c.fetchone()
@@ -159,7 +139,7 @@ def admin_get_course_syllabus(course_id: str):
 
 
 @router.put("/courses/{course_id}/syllabus")
-def admin_save_course_syllabus(course_id: str, body: dict):
+def admin_save_course_syllabus(course_id: str, body: dict, conn: SmartConn = Depends(get_conn)):
     syllabus_content = body.get("syllabus_content", "")
     c = conn.cursor()
     saved_at = datetime.now().isoformat()
@@ -180,57 +160,62 @@ def admin_save_course_syllabus(course_id: str, body: dict):
 @router.post("/courses/{course_id}/files", response_model=FileResponse)
 async def admin_upload_course_file(course_id: str, file: UploadFile = File(...)):
     raw = await file.read()
-    content = _read_pdf_bytes_or_text(file.content_type, raw)
-    c = conn.cursor()
-    uploaded_at = datetime.now().isoformat()
     # Note: group_id is NULL for course files
-    # file_content stores binary raw, extracted_text stores text for AI
-    c.execute(
-        "INSERT INTO files (course_id, file_name, file_type, file_content, extracted_text, uploaded_at) VALUES (?, ?, ?, ?, ?, ?)",
-        (course_id, file.filename, file.content_type, raw, content, uploaded_at),
-    )
-    conn.commit()
-    return FileResponse(id=c.lastrowid, file_name=file.filename, file_type=file.content_type, course_id=course_id, uploaded_at=uploaded_at)
+    # The original goes to the blob store (deduplicated by sha256); extracted_text stores text for AI
+    return await run_with_conn(store_uploaded_file, file, raw, course_id=course_id, keep_original=True)
 
 @router.get("/courses/files/{file_id}/download")
-def admin_download_course_file(file_id: int):
+def admin_download_course_file(file_id: int, request: Request, conn: SmartConn = Depends(get_conn)):
     c = conn.cursor()
-    c.execute("SELECT file_name, file_type, file_content, extracted_text FROM files WHERE id=?", (file_id,))
+    c.execute("SELECT file_name, file_type, blob_sha256, file_size, extracted_text FROM files WHERE id=?", (file_id,))
     row = c.fetchone()
     if not row:
         raise HTTPException(status_code=404, detail="File not found")
-    
-    file_name, file_type, content, ext_text = row
-    
+
+    file_name, file_type, digest, file_size, ext_text = row
+
+    if digest:
+        # ETag, 304s and Range requests (PDF viewers fetch large files piecewise)
+        return blob_response(
+            request, blob_store, digest,
+            size=file_size,
+            media_type=file_type,
+            headers={"Content-Disposition": f"attachment; filename={file_name}"},
+        )
+
+    # Rows not yet moved by `python -m api.manage move-blobs` still hold the bytes inline
+    c.execute("SELECT file_content FROM files WHERE id=?", (file_id,))
+    content = c.fetchone()[0]
+
     # If ext_text is NULL, it's a legacy file where file_content IS the text
     if ext_text is None:
         # Convert to bytes if it's stored as a string
         body = content.encode("utf-8") if isinstance(content, str) else content
-        return Response(
-            content=body,
+        return bytes_response(
+            request, body or b"",
             media_type="text/plain",
             headers={"Content-Disposition": f"attachment; filename={file_name}.txt"},
         )
     
-    return Response(
-        content=content,
+    return bytes_response(
+        request, _as_bytes(content) or b"",
         media_type=file_type,
         headers={"Content-Disposition": f"attachment; filename={file_name}"},
     )
 
 
 @router.get("/courses/{course_id}/files", response_model=List[FileResponse])
-def admin_list_course_files(course_id: str):
+def admin_list_course_files(course_id: str, conn: SmartConn = Depends(get_conn)):
     c = conn.cursor()
-    c.execute("SELECT id, file_name, file_type, uploaded_at FROM files WHERE course_id=?", (course_id,))
+    c.execute("SELECT id, file_name, file_type, uploaded_at, extraction_status FROM files WHERE course_id=?", (course_id,))
     rows = c.fetchall()
-    return [FileResponse(id=r[0], file_name=r[1], file_type=r[2], course_id=course_id, uploaded_at=r[3]) for r in rows]
+    return [FileResponse(id=r[0], file_name=r[1], file_type=r[2], course_id=course_id, uploaded_at=r[3], extraction_status=r[4] or "done") for r in rows]
 
 
 # --- Admin Auth ---
 
 @router.get("/auth/check", response_model=AdminCheckResponse)
-def check_admin_exists():
+def check_admin_exists(conn: SmartConn = Depends(get_conn)):
     c = conn.cursor()
     try:
         c.execute("SELECT COUNT(*) FROM admin_users")
@@ -257,8 +242,10 @@ def send_email(to_email: str, subject: str, body: str):
     if RESEND_API_KEY:
         try:
             print(f"[DEBUG] Sending professional email via Resend to {to_email}")
-            response = requests.post(
+            # While Resend's breaker is open this fails fast and the SMTP fallback below is used
+            response = http_client.post(
                 "https://api.resend.com/emails",
+                circuit="resend",
                 headers={
                     "Authorization": f"Bearer {RESEND_API_KEY}",
                     "Content-Type": "application/json",
@@ -303,7 +290,7 @@ def send_email(to_email: str, subject: str, body: str):
         return False
 
 @router.post("/auth/generate-otp")
-def generate_setup_otp(req: AdminGenerateOtpRequest, background_tasks: BackgroundTasks):
+def generate_setup_otp(req: AdminGenerateOtpRequest, background_tasks: BackgroundTasks, conn: SmartConn = Depends(get_conn)):
     c = conn.cursor()
     try:
         c.execute("SELECT COUNT(*) FROM admin_users")
@@ -333,7 +320,7 @@ def generate_setup_otp(req: AdminGenerateOtpRequest, background_tasks: Backgroun
 
 
 @router.post("/auth/setup")
-def setup_admin(req: AdminSetupRequest):
+def setup_admin(req: AdminSetupRequest, conn: SmartConn = Depends(get_conn)):
     c = conn.cursor()
     
     # 1. Verify OTP
@@ -366,7 +353,7 @@ def setup_admin(req: AdminSetupRequest):
 
 
 @router.post("/auth/login", response_model=AdminLoginResponse)
-def login_admin(req: AdminLoginRequest):
+def login_admin(req: AdminLoginRequest, conn: SmartConn = Depends(get_conn)):
     c = conn.cursor()
     try:
         c.execute("SELECT id, username, admin_code FROM admin_users WHERE username=? AND password=?", (req.username, hash_password(req.password)))
@@ -401,7 +388,7 @@ def login_admin(req: AdminLoginRequest):
 
 
 @router.post("/auth/signup-student")
-def signup_student(req: StudentSignupRequest):
+def signup_student(req: StudentSignupRequest, conn: SmartConn = Depends(get_conn)):
     c = conn.cursor()
     # 1. Resolve Admin Code to ID
     c.execute("SELECT id FROM admin_users WHERE admin_code=?", (req.admin_code.upper(),))
@@ -1,16 +1,65 @@
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from datetime import datetime
-from typing import Optional
+from typing import Dict, Optional, Tuple
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends, Query, Header
 
-from ..db import conn
+from ..core.config import ANALYSIS_TASK_TIMEOUT
+from ..db import SmartConn, get_conn, pool, run_with_conn
 from ..schemas import AnalysisResponse
-from ..services.gemini import analyze_report, generate_timetable, generate_roadmap
+from ..services import jobs
+from ..services.gemini import GEMINI_UNAVAILABLE, analyze_report, generate_roadmap, generate_timetable, run_blocking
+from .jobs import job_accepted
 
 router = APIRouter(prefix="/groups", tags=["analysis"])
 
+# Shared across requests; each analysis submits three independent generations.
+_executor = ThreadPoolExecutor(max_workers=12, thread_name_prefix="analysis")
 
-def save_analysis_result(group_id: int, analysis: str, timetable: str, roadmap: str):
+
+def run_generations(
+    report: str, syllabus: str, timeout: float = ANALYSIS_TASK_TIMEOUT, use_cache: bool = True
+) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """
+    Runs analysis, timetable and roadmap generation concurrently.
+    Returns (results, errors); a part that failed, timed out or came back empty is
+    reported in errors instead of failing the others.
+    """
+    def submit(fn, *args, **kwargs):
+        # Carry the request's context so Gemini time is charged to this request in /metrics
+        return _executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+    futures = {
+        "analysis": submit(analyze_report, report, use_cache=use_cache),
+        "timetable": submit(generate_timetable, report, syllabus, use_cache=use_cache),
+        "roadmap": submit(generate_roadmap, report, syllabus, use_cache=use_cache),
+    }
+    deadline = time.monotonic() + timeout
+    results: Dict[str, str] = {}
+    errors: Dict[str, str] = {}
+    for name, future in futures.items():
+        try:
+            text = future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeout:
+            # The worker thread finishes in the background; its result is discarded
+            errors[name] = f"timed out after {timeout:.0f}s"
+            continue
+        except Exception as e:
+            errors[name] = str(e)
+            continue
+        if text == GEMINI_UNAVAILABLE:
+            # The placeholder must never be saved as the group's analysis
+            errors[name] = "Gemini unavailable"
+        elif text:
+            results[name] = text
+        else:
+            errors[name] = "empty response"
+    return results, errors
+
+
+def save_analysis_result(conn: SmartConn, group_id: int, analysis: str, timetable: str, roadmap: str):
     """Saves or updates the analysis results for a given group."""
     c = conn.cursor()
     timestamp = datetime.now().isoformat()
@@ -28,10 +77,42 @@ def save_analysis_result(group_id: int, analysis: str, timetable: str, roadmap:
     )
     conn.commit()
 
+@jobs.register("analysis")
+def run_analysis_job(params: dict) -> dict:
+    group_id = params["group_id"]
+    # No connection is held while the three generations run
+    with pool.connection() as conn:
+        report, syllabus = analysis_inputs(conn, group_id)
+    results, errors = run_generations(report, syllabus, use_cache=params.get("use_cache", True))
+    with pool.connection() as conn:
+        return save_generations(conn, group_id, results, errors)
+
+
 @router.post("/{group_id}/analysis")
-def perform_analysis(group_id: int):
+async def perform_analysis(
+    group_id: int,
+    no_cache: bool = Query(False, description="Bypass the Gemini response cache"),
+    background: bool = Query(False, description="Run as a background job and poll GET /jobs/{job_id}"),
+    idempotency_key: Optional[str] = Header(None),
+):
+    if background:
+        return await run_with_conn(job_accepted, "analysis", {"group_id": group_id, "use_cache": not no_cache}, idempotency_key)
+    # No connection is held while Gemini works; it is borrowed to read the inputs and to save
+    report, syllabus = await run_with_conn(analysis_inputs, group_id)
+    # The same run_generations() the background job uses, awaited off the event loop
+    results, errors = await run_blocking(run_generations, report, syllabus, use_cache=not no_cache)
+    return await run_with_conn(save_generations, group_id, results, errors)
+
+
+def analysis_inputs(conn: SmartConn, group_id: int) -> Tuple[str, str]:
+    """(report, syllabus) for a group's analysis; 400 when either is missing."""
     c = conn.cursor()
-    c.execute("SELECT COALESCE(extracted_text, file_content) FROM files WHERE group_id=?", (group_id,))
+    # PDFs still being extracted have no text yet and are left out
+    c.execute(
+        "SELECT COALESCE(extracted_text, file_content) FROM files "
+        "WHERE group_id=? AND COALESCE(extracted_text, file_content) IS NOT NULL",
+        (group_id,),
+    )
     report_rows = c.fetchall()
     if not report_rows:
         raise HTTPException(status_code=400, detail="No report files found for this group.")
@@ -41,30 +122,56 @@ def perform_analysis(group_id: int):
     syllabus_row = c.fetchone()
     if not syllabus_row or not syllabus_row[0]:
         raise HTTPException(status_code=400, detail="No syllabus found for this group.")
-    syllabus = syllabus_row[0]
+    return report, syllabus_row[0]
 
-    try:
-        analysis_text = analyze_report(report)
-        timetable_text = generate_timetable(report, syllabus)
-        roadmap_text = generate_roadmap(report, syllabus)
 
-        if not all([analysis_text, timetable_text, roadmap_text]):
-             raise HTTPException(status_code=500, detail="AI service failed to generate a complete analysis.")
-
-        save_analysis_result(group_id, analysis_text, timetable_text, roadmap_text)
-        
+def save_generations(conn: SmartConn, group_id: int, results: Dict[str, str], errors: Dict[str, str]) -> dict:
+    """Saves what was generated, keeping the previous text for parts that failed, and builds the response."""
+    if not results:
+        # Nothing could be generated (e.g. Gemini's breaker is open): serve the last saved analysis, marked stale
+        c = conn.cursor()
+        c.execute("SELECT analysis, timetable, roadmap, timestamp FROM analysis_results WHERE group_id=?", (group_id,))
+        previous = c.fetchone()
+        if not previous:
+            raise HTTPException(status_code=500, detail=f"AI service failed to generate the analysis: {errors}")
+        print(f"[ANALYSIS] Serving the saved analysis for group {group_id}: {errors}")
         return {
-            "analysis": analysis_text,
-            "timetable": timetable_text,
-            "roadmap": roadmap_text,
-            "timestamp": datetime.now().isoformat()
+            "analysis": previous[0],
+            "timetable": previous[1],
+            "roadmap": previous[2],
+            "timestamp": previous[3],
+            "errors": errors,
+            "stale": True,
         }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"An error occurred during AI generation: {e}")
+
+    if errors:
+        # Keep the previously saved text for any part that failed this time
+        print(f"[ANALYSIS] Partial result for group {group_id}: {errors}")
+        c = conn.cursor()
+        c.execute("SELECT analysis, timetable, roadmap FROM analysis_results WHERE group_id=?", (group_id,))
+        previous = c.fetchone()
+        if previous:
+            for name, value in zip(("analysis", "timetable", "roadmap"), previous):
+                if name not in results and value:
+                    results[name] = value
+
+    analysis_text = results.get("analysis", "")
+    timetable_text = results.get("timetable", "")
+    roadmap_text = results.get("roadmap", "")
+    save_analysis_result(conn, group_id, analysis_text, timetable_text, roadmap_text)
+
+    return {
+        "analysis": analysis_text,
+        "timetable": timetable_text,
+        "roadmap": roadmap_text,
+        "timestamp": datetime.now().isoformat(),
+        "errors": errors,
+        "stale": False,
+    }
 
 
 @router.get("/{group_id}/analysis")
-def get_latest_analysis(group_id: int):
+def get_latest_analysis(group_id: int, conn: SmartConn = Depends(get_conn)):
     c = conn.cursor()
     c.execute(
         "SELECT analysis, timetable, roadmap, timestamp FROM analysis_results WHERE group_id=? ORDER BY timestamp DESC LIMIT 1",
@@ -76,7 +183,7 @@ def get_latest_analysis(group_id: int):
     return AnalysisResponse(analysis=row[0], timetable=row[1], roadmap=row[2], timestamp=row[3])
 
 @router.get("/{group_id}/status")
-def get_analysis_status(group_id: int):
+def get_analysis_status(group_id: int, conn: SmartConn = Depends(get_conn)):
     """Checks if a group has the necessary components for an analysis."""
     c = conn.cursor()
     
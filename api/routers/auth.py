@@ -1,6 +1,6 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends
 
-from ..db import conn, hash_password, log_action
+from ..db import SmartConn, get_conn, hash_password, log_action
 from ..schemas import LoginRequest, LoginResponse, ChangePasswordRequest
 
 
@@ -8,7 +8,7 @@ router = APIRouter(prefix="/auth", tags=["auth"])
 
 
 @router.post("/login", response_model=LoginResponse)
-def login(req: LoginRequest):
+def login(req: LoginRequest, conn: SmartConn = Depends(get_conn)):
     c = conn.cursor()
     
     # 1. Validate Admin Code
@@ -37,12 +37,12 @@ def login(req: LoginRequest):
     # Optional: Link legacy user to this admin on first valid login?
     # For now, let's just proceed.
 
-    log_action(user_id, None, "login", "User logged in")
+    log_action(conn, user_id, None, "login", "User logged in")
     return LoginResponse(user_id=user_id, username=username, course_id=course_id, education_level=education_level)
 
 
 @router.post("/change-password")
-def change_password(req: ChangePasswordRequest):
+def change_password(req: ChangePasswordRequest, conn: SmartConn = Depends(get_conn)):
     c = conn.cursor()
     c.execute("UPDATE users SET password=? WHERE id=?", (hash_password(req.new_password), req.user_id))
     conn.commit()
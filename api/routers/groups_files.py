@@ -1,22 +1,27 @@
 from datetime import datetime
-from typing import List
+from typing import List, Optional
 
-from fastapi import APIRouter, UploadFile, File, HTTPException, Response
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Request
 
-from ..db import conn, log_action
-from ..schemas import CreateGroupRequest, FileResponse
-
-try:
-    import fitz
-except Exception:
-    fitz = None
+from ..core.config import PDF_MAX_BYTES
+from ..db import SmartConn, get_conn, log_action, pool, run_with_conn
+from ..schemas import CreateGroupRequest, FileResponse, FileStatusResponse
+from ..services import jobs
+from ..services.blobstore import blob_store
+from ..services.extraction import decode_text, extract_pdf_text
+from ..services.http_cache import bytes_response
+from ..services.retrieval import delete_file_chunks, index_file
+from ..services.search import index_document, remove_document
 
 
 router = APIRouter(tags=["groups-files"])
 
+# Seconds a client is asked to wait before retrying a download whose PDF is still being extracted
+EXTRACTION_RETRY_AFTER = 5
+
 
 @router.get("/users/{user_id}/groups")
-def get_user_groups(user_id: int):
+def get_user_groups(user_id: int, conn: SmartConn = Depends(get_conn)):
     c = conn.cursor()
     c.execute("SELECT id, group_name FROM file_groups WHERE user_id=?", (user_id,))
     groups = c.fetchall()
@@ -24,7 +29,7 @@ def get_user_groups(user_id: int):
 
 
 @router.post("/users/{user_id}/groups")
-def create_group(user_id: int, req: CreateGroupRequest):
+def create_group(user_id: int, req: CreateGroupRequest, conn: SmartConn = Depends(get_conn)):
     c = conn.cursor()
     created_at = datetime.now().isoformat()
     c.execute(
@@ -32,55 +37,145 @@ def create_group(user_id: int, req: CreateGroupRequest):
         (user_id, req.group_name, created_at),
     )
     conn.commit()
-    log_action(user_id, c.lastrowid, "create_group", f"Created group: {req.group_name}")
+    log_action(conn, user_id, c.lastrowid, "create_group", f"Created group: {req.group_name}")
     return {"status": "ok", "group_id": c.lastrowid}
 
 
-def read_pdf_bytes(data: bytes) -> str:
-    if fitz is None:
-        raise HTTPException(status_code=500, detail="PyMuPDF not installed")
-    text = ""
-    doc = fitz.open(stream=data, filetype="pdf")
-    for p in doc:
-        text += p.get_text()
-    return text
+def index_file_text(conn: SmartConn, file_id: int, group_id: Optional[int], course_id: Optional[str], file_name: str, text: str) -> None:
+    """Makes a file's text available to chat/quiz retrieval and to /search. The caller commits."""
+    index_file(conn, file_id, group_id, text)
+    index_document(conn, "file", file_id, text, title=file_name, group_id=group_id, course_id=course_id)
 
 
-@router.post("/groups/{group_id}/files", response_model=FileResponse)
-async def upload_file(group_id: int, file: UploadFile = File(...)):
-    raw = await file.read()
-    if file.content_type == "text/plain":
-        try:
-            content = raw.decode("utf-8")
-        except Exception:
-            content = raw.decode("latin-1", errors="ignore")
-    elif file.content_type == "application/pdf":
-        content = read_pdf_bytes(raw)
+def _save_extraction(conn: SmartConn, file_id: int, text: Optional[str], error: Optional[str] = None) -> None:
+    c = conn.cursor()
+    if error is None:
+        c.execute(
+            "UPDATE files SET extracted_text=?, extraction_status='done', extraction_error=NULL WHERE id=?",
+            (text, file_id),
+        )
+        c.execute("SELECT group_id, course_id, file_name FROM files WHERE id=?", (file_id,))
+        row = c.fetchone()
+        if row:
+            index_file_text(conn, file_id, row[0], row[1], row[2], text)
     else:
+        c.execute(
+            "UPDATE files SET extraction_status='failed', extraction_error=? WHERE id=?",
+            (error, file_id),
+        )
+    conn.commit()
+
+
+@jobs.register("extract")
+def run_extraction_job(params: dict) -> dict:
+    """Runs PyMuPDF in the process pool on the stored PDF, then records the text (or the failure) on the row."""
+    file_id = params["file_id"]
+    with pool.connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT blob_sha256 FROM files WHERE id=?", (file_id,))
+        row = c.fetchone()
+    if not row:
+        return {"file_id": file_id, "status": "deleted"}
+    if not row[0]:
+        raise ValueError(f"File {file_id} has no stored PDF to extract")
+    try:
+        text = extract_pdf_text(blob_store.read(row[0]))
+    except Exception as e:
+        print(f"[EXTRACT] File {file_id} failed: {e}")
+        with pool.connection() as conn:
+            _save_extraction(conn, file_id, None, str(e))
+        raise
+    with pool.connection() as conn:
+        _save_extraction(conn, file_id, text)
+    return {"file_id": file_id, "status": "done", "chars": len(text)}
+
+
+def store_uploaded_file(
+    conn: SmartConn,
+    file: UploadFile,
+    raw: bytes,
+    group_id: Optional[int] = None,
+    course_id: Optional[str] = None,
+    keep_original: bool = False,
+) -> FileResponse:
+    """
+    Inserts an uploaded text/PDF file. Text is decoded inline; PDFs go to the blob store
+    with extraction_status='pending' and are parsed by an "extract" job, which survives a
+    restart, so the client polls GET /files/{file_id}/status. With keep_original text
+    uploads keep their raw bytes in the blob store too. Blocking: async endpoints call it
+    through run_with_conn.
+    """
+    if file.content_type not in ("text/plain", "application/pdf"):
         raise HTTPException(status_code=400, detail="Unsupported file type")
+    if file.content_type == "application/pdf" and len(raw) > PDF_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"PDF exceeds the {PDF_MAX_BYTES // (1024 * 1024)} MB limit")
+
+    text = decode_text(raw) if file.content_type == "text/plain" else None
+    status = "done" if text is not None else "pending"
+    # The extraction job reads PDFs back from the blob store
+    digest = blob_store.put(raw) if keep_original or status == "pending" else None
 
     c = conn.cursor()
     uploaded_at = datetime.now().isoformat()
-    c.execute(
-        "INSERT INTO files (group_id, file_name, file_type, file_content, uploaded_at) VALUES (?, ?, ?, ?, ?)",
-        (group_id, file.filename, file.content_type, content, uploaded_at),
-    )
+    if digest:
+        c.execute(
+            "INSERT INTO files (group_id, course_id, file_name, file_type, blob_sha256, file_size, extracted_text, extraction_status, uploaded_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (group_id, course_id, file.filename, file.content_type, digest, len(raw), text, status, uploaded_at),
+        )
+    else:
+        # Text uploads keep their content in file_content; extracted PDF text lands in extracted_text
+        c.execute(
+            "INSERT INTO files (group_id, course_id, file_name, file_type, file_content, extraction_status, uploaded_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (group_id, course_id, file.filename, file.content_type, text, status, uploaded_at),
+        )
+    file_id = c.lastrowid
+    if text is not None:
+        index_file_text(conn, file_id, group_id, course_id, file.filename, text)
     conn.commit()
-    return FileResponse(id=c.lastrowid, file_name=file.filename, file_type=file.content_type, uploaded_at=uploaded_at)
+
+    if status == "pending":
+        jobs.enqueue(conn, "extract", {"file_id": file_id})
+
+    return FileResponse(
+        id=file_id,
+        file_name=file.filename,
+        file_type=file.content_type,
+        course_id=course_id,
+        uploaded_at=uploaded_at,
+        extraction_status=status,
+    )
+
+
+@router.post("/groups/{group_id}/files", response_model=FileResponse)
+async def upload_file(group_id: int, file: UploadFile = File(...)):
+    raw = await file.read()
+    return await run_with_conn(store_uploaded_file, file, raw, group_id=group_id)
+
+
+@router.get("/files/{file_id}/status", response_model=FileStatusResponse)
+def get_file_status(file_id: int, conn: SmartConn = Depends(get_conn)):
+    c = conn.cursor()
+    c.execute("SELECT extraction_status, extraction_error FROM files WHERE id=?", (file_id,))
+    row = c.fetchone()
+    if not row:
+        raise HTTPException(status_code=404, detail="File not found")
+    return FileStatusResponse(id=file_id, extraction_status=row[0] or "done", extraction_error=row[1])
 
 
 @router.get("/groups/{group_id}/files", response_model=List[FileResponse])
-def list_files(group_id: int):
+def list_files(group_id: int, conn: SmartConn = Depends(get_conn)):
     c = conn.cursor()
-    c.execute("SELECT id, file_name, file_type, uploaded_at FROM files WHERE group_id=?", (group_id,))
+    c.execute("SELECT id, file_name, file_type, uploaded_at, extraction_status FROM files WHERE group_id=?", (group_id,))
     rows = c.fetchall()
-    return [FileResponse(id=r[0], file_name=r[1], file_type=r[2], uploaded_at=r[3]) for r in rows]
+    return [FileResponse(id=r[0], file_name=r[1], file_type=r[2], uploaded_at=r[3], extraction_status=r[4] or "done") for r in rows]
 
 
 @router.get("/files/{file_id}/content")
-def get_file_content(file_id: int):
+def get_file_content(file_id: int, conn: SmartConn = Depends(get_conn)):
     c = conn.cursor()
-    c.execute("SELECT file_name, file_content FROM files WHERE id=?", (file_id,))
+    c.execute("SELECT file_name, COALESCE(extracted_text, file_content) FROM files WHERE id=?", (file_id,))
     row = c.fetchone()
     if not row:
         raise HTTPException(status_code=404, detail="File not found")
@@ -88,24 +183,39 @@ def get_file_content(file_id: int):
 
 
 @router.delete("/files/{file_id}")
-def delete_file(file_id: int):
+def delete_file(file_id: int, conn: SmartConn = Depends(get_conn)):
     c = conn.cursor()
     c.execute("DELETE FROM files WHERE id=?", (file_id,))
+    delete_file_chunks(conn, file_id)
+    remove_document(conn, "file", file_id)
     conn.commit()
     return {"status": "ok"}
 
 
 @router.get("/files/{file_id}/download")
-def download_file(file_id: int):
+def download_file(file_id: int, request: Request, conn: SmartConn = Depends(get_conn)):
     c = conn.cursor()
-    c.execute("SELECT file_name, file_content FROM files WHERE id=?", (file_id,))
+    c.execute(
+        "SELECT file_name, COALESCE(extracted_text, file_content), extraction_status, extraction_error FROM files WHERE id=?",
+        (file_id,),
+    )
     row = c.fetchone()
     if not row:
         raise HTTPException(status_code=404, detail="File not found")
-    
-    file_name, content = row
-    return Response(
-        content=content,
+
+    file_name, content, status, error = row
+    # A PDF has no text until its extraction job finishes; an empty 200 would look like a finished download
+    if status == "pending":
+        raise HTTPException(
+            status_code=409,
+            detail="Text extraction is still running; retry shortly",
+            headers={"Retry-After": str(EXTRACTION_RETRY_AFTER)},
+        )
+    if status == "failed":
+        raise HTTPException(status_code=422, detail=f"Text extraction failed: {error}")
+    body = content.encode("utf-8") if isinstance(content, str) else (content or b"")
+    return bytes_response(
+        request, bytes(body),
         media_type="text/plain",
         headers={"Content-Disposition": f"attachment; filename={file_name}.txt"},
     )
@@ -1,11 +1,71 @@
 from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from ..db import pool
+from ..services import breaker
+from ..services.gemini import gemini_cache
+from ..services.gemini_keys import scheduler as key_scheduler
+from ..services.metrics import Callback, registry
+from ..services.recommendations import recommendation_cache
 
 
 router = APIRouter(tags=["health"])
 
+BREAKER_STATE_VALUES = {breaker.CLOSED: 0, breaker.HALF_OPEN: 1, breaker.OPEN: 2}
+
+registry.register(Callback("db_pool_connections", "DB pool connections by state", "state", pool.stats))
+registry.register(Callback(
+    "gemini_cache_events_total", "Gemini response cache lookups and writes", "event",
+    lambda: {k: v for k, v in gemini_cache.stats().items() if k in ("hits", "misses", "stores", "evictions")},
+    kind="counter",
+))
+registry.register(Callback(
+    "recommendation_cache_events_total", "Recommendation cache lookups and writes", "event",
+    lambda: {k: v for k, v in recommendation_cache.stats().items() if k in ("hits", "misses", "stores", "evictions")},
+    kind="counter",
+))
+registry.register(Callback(
+    "gemini_key_requests_utilization", "Fraction of each Gemini key's requests-per-minute budget in use", "key",
+    lambda: key_scheduler.utilization("requests"),
+))
+registry.register(Callback(
+    "gemini_key_tokens_utilization", "Fraction of each Gemini key's tokens-per-minute budget in use", "key",
+    lambda: key_scheduler.utilization("tokens"),
+))
+registry.register(Callback(
+    "gemini_key_health", "Gemini key health score (error rate and remaining budget), 0-1", "key",
+    lambda: {k["key"]: k["score"] for k in key_scheduler.snapshot()},
+))
+registry.register(Callback(
+    "gemini_key_cooldown_seconds", "Seconds until a rate-limited Gemini key is used again", "key",
+    lambda: {k["key"]: k["cooldown_seconds"] for k in key_scheduler.snapshot()},
+))
+registry.register(Callback(
+    "circuit_breaker_state", "External dependency circuit breaker state: 0 closed, 1 half-open, 2 open", "breaker",
+    lambda: {name: BREAKER_STATE_VALUES[b["state"]] for name, b in breaker.snapshot().items()},
+))
+
 
 @router.get("/health")
 def health():
-    return {"status": "ok"}
+    # Degraded while any external dependency's breaker is not closed; the app still serves what it can
+    breakers = breaker.snapshot()
+    degraded = any(b["state"] != breaker.CLOSED for b in breakers.values())
+    return {"status": "degraded" if degraded else "ok", "breakers": breakers}
+
+
+@router.get("/health/cache")
+def cache_stats():
+    return {"gemini": gemini_cache.stats(), "recommendations": recommendation_cache.stats()}
+
+
+@router.get("/health/gemini-keys")
+def gemini_key_stats():
+    """Budget, cooldown and health score of each Gemini key, by position in API_KEYS."""
+    return key_scheduler.snapshot()
 
 
+@router.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus scrape endpoint."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,33 @@
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import JSONResponse
+
+from ..db import SmartConn, get_conn
+from ..schemas import JobResponse
+from ..services import jobs
+
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+
+def job_accepted(conn: SmartConn, kind: str, params: dict, idempotency_key: Optional[str] = None) -> JSONResponse:
+    """Enqueues a job and answers 202 with where to poll for it; 422 if the key was used for other params."""
+    try:
+        job_id, created = jobs.enqueue(conn, kind, params, idempotency_key)
+    except jobs.IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    job = jobs.get_job(conn, job_id)
+    return JSONResponse(
+        status_code=202,
+        content={"job_id": job_id, "status": job["status"], "created": created, "status_url": f"/jobs/{job_id}"},
+        headers={"Location": f"/jobs/{job_id}"},
+    )
+
+
+@router.get("/{job_id}", response_model=JobResponse)
+def get_job(job_id: int, conn: SmartConn = Depends(get_conn)):
+    job = jobs.get_job(conn, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JobResponse(**job)
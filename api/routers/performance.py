@@ -1,14 +1,14 @@
 import json
-from fastapi import APIRouter, Query
+from fastapi import APIRouter, Query, Depends
 
-from ..db import conn
+from ..db import SmartConn, get_conn
 
 
 router = APIRouter(tags=["performance"])
 
 
 @router.get("/groups/{group_id}/performance")
-def performance(group_id: int, user_id: int = Query(...)):
+def performance(group_id: int, user_id: int = Query(...), conn: SmartConn = Depends(get_conn)):
     c = conn.cursor()
     c.execute(
         "SELECT subject, quiz_date, total_marks, details FROM quiz_results WHERE user_id=? AND group_id=? ORDER BY quiz_date",
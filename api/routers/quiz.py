@@ -1,11 +1,12 @@
 import json
 import traceback
 from datetime import datetime
-from typing import List
+from typing import List, Optional, Tuple
 
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Depends, Header
 
-from ..db import conn, log_action
+from ..core.config import QUIZ_RETRIEVAL_TOP_K
+from ..db import SmartConn, get_conn, log_action, pool, run_with_conn
 from ..schemas import (
     QuizGenerateRequest,
     QuizModelResponse,
@@ -13,22 +14,59 @@ from ..schemas import (
     QuizGradeResponse,
     QuizSaveRequest,
 )
-from ..services.gemini import generate_quiz_json
+from ..services import jobs
+from ..services.breaker import CircuitOpen
+from ..services.gemini import generate_quiz_json, run_blocking
+from ..services.gemini_keys import KeysExhausted
+from ..services.retrieval import render_chunks, search_group
+from .jobs import job_accepted
 
 
 router = APIRouter(prefix="/quizzes", tags=["quiz"])
 
 
+@jobs.register("quiz")
+def run_quiz_job(params: dict) -> dict:
+    with pool.connection() as conn:
+        report, syllabus = quiz_inputs(conn, params["group_id"], params["subject"])
+    quiz = build_quiz(report, syllabus, params["subject"], use_cache=params.get("use_cache", True))
+    return quiz.dict()
+
+
 @router.post("/groups/{group_id}/generate", response_model=QuizModelResponse)
-def generate_quiz(group_id: int, req: QuizGenerateRequest):
+async def generate_quiz(
+    group_id: int,
+    req: QuizGenerateRequest,
+    no_cache: bool = Query(False, description="Bypass the Gemini response cache"),
+    background: bool = Query(False, description="Run as a background job and poll GET /jobs/{job_id}"),
+    idempotency_key: Optional[str] = Header(None),
+):
+    if background:
+        params = {"group_id": group_id, "subject": req.subject, "use_cache": not no_cache}
+        return await run_with_conn(job_accepted, "quiz", params, idempotency_key)
+    report, syllabus = await run_with_conn(quiz_inputs, group_id, req.subject)
+    return await run_blocking(build_quiz, report, syllabus, req.subject, use_cache=not no_cache)
+
+
+def build_quiz(report: str, syllabus: str, subject: str, use_cache: bool = True) -> QuizModelResponse:
+    try:
+        data = generate_quiz_json(report, syllabus, subject, use_cache=use_cache)
+        return quiz_response(subject, data)
+    except Exception as e:
+        raise quiz_failed(e)
+
+
+def quiz_inputs(conn: SmartConn, group_id: int, subject: str) -> Tuple[str, str]:
+    """(study material, syllabus) for a quiz prompt; 400 when the group has no files."""
     c = conn.cursor()
-    c.execute("SELECT COALESCE(extracted_text, file_content) FROM files WHERE group_id=?", (group_id,))
-    rows = c.fetchall()
-    report = "".join([r[0] if isinstance(r[0], str) else str(r[0]) for r in rows])
-    
     c.execute("SELECT syllabus_content FROM syllabus_for_students WHERE group_id=?", (group_id,))
     row = c.fetchone()
     syllabus = row[0] if row else ""
+
+    # Only the chunks most relevant to the subject and syllabus go into the prompt.
+    # PDFs still being extracted have no chunks yet and are left out.
+    chunks = search_group(conn, group_id, f"{subject}\n{syllabus}", QUIZ_RETRIEVAL_TOP_K, fill=True)
+    report = render_chunks(chunks)
     
     # Check if we have files (report)
     if not report:
@@ -37,9 +75,9 @@ def generate_quiz(group_id: int, req: QuizGenerateRequest):
     # If no syllabus, provide a default one based on the subject
     if not syllabus:
         syllabus = f"""
-        Course: {req.subject}
+        Course: {subject}
         
-        This is a general syllabus for {req.subject}. Topics may include:
+        This is a general syllabus for {subject}. Topics may include:
         - Fundamental concepts and principles
         - Core theories and methodologies  
         - Practical applications and examples
@@ -47,30 +85,35 @@ def generate_quiz(group_id: int, req: QuizGenerateRequest):
         - Current trends and developments
         
         Learning objectives:
-        - Understand key concepts in {req.subject}
+        - Understand key concepts in {subject}
         - Apply theoretical knowledge to practical problems
         - Analyze and evaluate different approaches
         - Demonstrate proficiency in core skills
         """
     
-    try:
-        print(f"DEBUG: Generating quiz for group_id={group_id}, subject={req.subject}")
-        print(f"DEBUG: Report length: {len(report)}, Syllabus length: {len(syllabus)}")
-        
-        data = generate_quiz_json(report, syllabus, req.subject)
-        print(f"DEBUG: Quiz data generated: {data}")
-        
-        return QuizModelResponse(
-            subject=req.subject,
-            questions=data.get("questions", []),
-            options=data.get("options", []),
-            answers=data.get("answers", []),
-            explanations=data.get("explanations", []) or data.get("expanation", []),
-        )
-    except Exception as e:
-        print(f"ERROR: Quiz generation failed with exception: {str(e)}")
-        print(f"ERROR: Full traceback: {traceback.format_exc()}")
-        raise HTTPException(status_code=500, detail=f"Failed to generate quiz: {str(e)}")
+    print(f"DEBUG: Generating quiz for group_id={group_id}, subject={subject}")
+    print(f"DEBUG: Report length: {len(report)}, Syllabus length: {len(syllabus)}")
+    return report, syllabus
+
+
+def quiz_response(subject: str, data: dict) -> QuizModelResponse:
+    print(f"DEBUG: Quiz data generated: {data}")
+    return QuizModelResponse(
+        subject=subject,
+        questions=data.get("questions", []),
+        options=data.get("options", []),
+        answers=data.get("answers", []),
+        explanations=data.get("explanations", []) or data.get("expanation", []),
+    )
+
+
+def quiz_failed(e: Exception) -> Exception:
+    if isinstance(e, (CircuitOpen, KeysExhausted)):
+        # Gemini is unavailable right now; the app answers these with 503 and Retry-After
+        return e
+    print(f"ERROR: Quiz generation failed with exception: {str(e)}")
+    print(f"ERROR: Full traceback: {traceback.format_exc()}")
+    return HTTPException(status_code=500, detail=f"Failed to generate quiz: {str(e)}")
 
 
 @router.post("/grade", response_model=QuizGradeResponse)
@@ -83,7 +126,7 @@ def grade_quiz(req: QuizGradeRequest):
 
 
 @router.post("/groups/{group_id}/save")
-def save_quiz_result(group_id: int, user_id: int = Query(...), body: QuizSaveRequest = None):
+def save_quiz_result(group_id: int, user_id: int = Query(...), body: QuizSaveRequest = None, conn: SmartConn = Depends(get_conn)):
     if body is None:
         raise HTTPException(status_code=400, detail="Missing body")
     c = conn.cursor()
@@ -100,12 +143,12 @@ def save_quiz_result(group_id: int, user_id: int = Query(...), body: QuizSaveReq
         ),
     )
     conn.commit()
-    log_action(user_id, group_id, "quiz", f"Quiz on {body.subject} scored {float(sum(body.marks))}")
+    log_action(conn, user_id, group_id, "quiz", f"Quiz on {body.subject} scored {float(sum(body.marks))}")
     return {"status": "ok"}
 
 
 @router.get("/groups/{group_id}")
-def list_quiz_results(group_id: int, user_id: int = Query(...)):
+def list_quiz_results(group_id: int, user_id: int = Query(...), conn: SmartConn = Depends(get_conn)):
     c = conn.cursor()
     c.execute(
         "SELECT subject, quiz_date, total_marks, details FROM quiz_results WHERE user_id=? AND group_id=? ORDER BY quiz_date",
@@ -0,0 +1,28 @@
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from ..db import SmartConn, get_conn
+from ..schemas import SearchResult
+from ..services import search as search_service
+
+
+router = APIRouter(tags=["search"])
+
+
+@router.get("/search", response_model=List[SearchResult])
+def search(
+    q: str = Query(..., min_length=1, max_length=200),
+    user_id: int = Query(...),
+    group_id: Optional[int] = Query(None, description="Only files and chats of this group"),
+    kinds: Optional[str] = Query(None, description="Comma-separated subset of: file, chat, update"),
+    limit: int = Query(20, ge=1, le=100),
+    conn: SmartConn = Depends(get_conn),
+):
+    selected = tuple(search_service.KINDS)
+    if kinds:
+        selected = tuple(k.strip() for k in kinds.split(",") if k.strip())
+        unknown = set(selected) - set(search_service.KINDS)
+        if unknown or not selected:
+            raise HTTPException(status_code=400, detail=f"kinds must be a subset of {', '.join(search_service.KINDS)}")
+    return search_service.search(conn, q, user_id, group_id=group_id, kinds=selected, limit=limit)
@@ -1,8 +1,8 @@
 from datetime import datetime
 import json
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 
-from ..db import conn
+from ..db import SmartConn, get_conn
 from ..schemas import SyllabusContent
 
 
@@ -10,7 +10,7 @@ router = APIRouter(tags=["syllabus"])
 
 
 @router.get("/courses/{course_id}/syllabus")
-def get_course_syllabus(course_id: str):
+def get_course_syllabus(course_id: str, conn: SmartConn = Depends(get_conn)):
     c = conn.cursor()
     c.execute("SELECT syllabus_content, saved_at FROM syllabus WHERE course_id=?", (course_id,))
     row = c.fetchone()
@@ -20,7 +20,7 @@ def get_course_syllabus(course_id: str):
 
 
 @router.put("/courses/{course_id}/syllabus")
-def save_course_syllabus(course_id: str, body: SyllabusContent):
+def save_course_syllabus(course_id: str, body: SyllabusContent, conn: SmartConn = Depends(get_conn)):
     c = conn.cursor()
     saved_at = datetime.now().isoformat()
     c.execute(
@@ -37,7 +37,7 @@ def save_course_syllabus(course_id: str, body: SyllabusContent):
 
 
 @router.get("/groups/{group_id}/syllabus")
-def get_group_syllabus(group_id: int):
+def get_group_syllabus(group_id: int, conn: SmartConn = Depends(get_conn)):
     c = conn.cursor()
     c.execute("SELECT syllabus_content, topics_ratings, saved_at FROM syllabus_for_students WHERE group_id=?", (group_id,))
     row = c.fetchone()
@@ -52,7 +52,7 @@ def get_group_syllabus(group_id: int):
 
 
 @router.put("/groups/{group_id}/syllabus")
-def save_group_syllabus(group_id: int, body: SyllabusContent):
+def save_group_syllabus(group_id: int, body: SyllabusContent, conn: SmartConn = Depends(get_conn)):
     c = conn.cursor()
     saved_at = datetime.now().isoformat()
     c.execute(
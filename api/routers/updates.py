@@ -1,7 +1,19 @@
-from fastapi import APIRouter, HTTPException, Depends, Form, File, UploadFile, Response
-from typing import List, Union, Optional
+import base64
+import heapq
+from itertools import islice
+from fastapi import APIRouter, HTTPException, Depends, Form, File, UploadFile, Response, Query, Request
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from typing import AsyncIterator, Callable, Dict, List, Union, Optional, Tuple
 from datetime import datetime
-from ..db import conn
+from ..core.config import SSE_KEEPALIVE_SECONDS
+from ..db import SmartConn, get_conn, pool, run_with_conn
+from ..services.blobstore import blob_store, _as_bytes
+from ..services import jobs
+from ..services.http_cache import blob_response, bytes_response, content_version, version_matches
+from ..services.images import find_variant
+from ..services.pubsub import broker
+from ..services.search import index_document
 from ..schemas import (
     UpdateCreateRequest, 
     PollCreateRequest, 
@@ -21,41 +33,84 @@ async def create_update(
     course_id: str = Form(...),
     content: str = Form(...),
     external_url: Optional[str] = Form(None),
-    image: Optional[UploadFile] = File(None)
+    image: Optional[UploadFile] = File(None),
 ):
+    image_data = await image.read() if image else None
+    # The blob write and inserts are blocking, so they run in the threadpool
+    return await run_with_conn(save_update, course_id, content, external_url, image_data)
+
+
+def save_update(conn: SmartConn, course_id: str, content: str, external_url: Optional[str], image_data: Optional[bytes]) -> UpdateResponse:
     c = conn.cursor()
     created_at = datetime.now().isoformat()
-    image_data = await image.read() if image else None
-    
-    # Store image_data in the new BLOB column
+
+    # Store the image in the blob store and keep only its sha256 on the row
+    image_sha256 = blob_store.put(image_data) if image_data else None
     c.execute(
-        "INSERT INTO updates (course_id, content, external_url, image_data, created_at) VALUES (?, ?, ?, ?, ?)",
-        (course_id, content, external_url, image_data, created_at)
+        "INSERT INTO updates (course_id, content, external_url, image_sha256, image_size, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+        (course_id, content, external_url, image_sha256, len(image_data) if image_data else None, created_at)
     )
-    conn.commit()
     update_id = c.lastrowid
+    index_document(conn, "update", update_id, content, course_id=course_id)
+    conn.commit()
+
+    if image_sha256:
+        # Resized variants for ?w= are rendered off the request path
+        jobs.enqueue(conn, "image_variants", {"sha256": image_sha256})
     
     return UpdateResponse(
         id=update_id, 
         content=content, 
-        image_url=f"/updates/{update_id}/image" if image_data else None,
+        image_url=update_image_url(update_id, image_sha256) if image_sha256 else None,
         external_url=external_url, 
         created_at=created_at
     )
 
+def update_image_url(update_id: int, image_sha256: Optional[str]) -> str:
+    # ?v= names the content, so browsers and CDNs may cache the image forever
+    version = content_version(image_sha256)
+    return f"/updates/{update_id}/image?v={version}" if version else f"/updates/{update_id}/image"
+
+
 @router.get("/updates/{update_id}/image")
-def get_update_image(update_id: int):
+def get_update_image(
+    update_id: int,
+    request: Request,
+    w: Optional[int] = Query(None, ge=1, description="Display width in pixels; serves the smallest variant at least this wide"),
+    conn: SmartConn = Depends(get_conn),
+):
     c = conn.cursor()
+    c.execute("SELECT image_sha256, image_size FROM updates WHERE id=?", (update_id,))
+    row = c.fetchone()
+    if not row:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    digest, size = row
+    if digest and w:
+        variant = find_variant(conn, digest, w)
+        if variant:
+            variant_digest, variant_size, media_type = variant
+            return blob_response(
+                request, blob_store, variant_digest,
+                size=variant_size,
+                media_type=media_type,
+                immutable=version_matches(request, digest),
+            )
+        # Variants not rendered yet: serve the original, but don't let it be cached under this URL
+        return blob_response(request, blob_store, digest, size=size, immutable=False)
+    if digest:
+        return blob_response(request, blob_store, digest, size=size)
+
+    # Not yet moved out of the row by `python -m api.manage move-blobs`
     c.execute("SELECT image_data FROM updates WHERE id=?", (update_id,))
     row = c.fetchone()
     if not row or not row[0]:
         raise HTTPException(status_code=404, detail="Image not found")
     
-    # Return binary as image
-    return Response(content=row[0], media_type="image/jpeg")
+    return bytes_response(request, _as_bytes(row[0]))
 
 @router.post("/admin/polls", response_model=PollResponse)
-def create_poll(req: PollCreateRequest):
+def create_poll(req: PollCreateRequest, conn: SmartConn = Depends(get_conn)):
     c = conn.cursor()
     created_at = datetime.now().isoformat()
     
@@ -87,85 +142,149 @@ def create_poll(req: PollCreateRequest):
 # --- Student/Public Endpoints ---
 # Note: These don't have the /admin prefix, so we'll mount purely as a separate router or handle prefix manually
 
+# Feed order: newest first; on equal created_at updates come before polls, then higher id first
+_KIND_RANK = {"poll": 0, "update": 1}
+
+
+def encode_feed_cursor(kind: str, item_id: int, created_at: str) -> str:
+    raw = json.dumps([created_at, kind, item_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_feed_cursor(cursor: str) -> Tuple[str, str, int]:
+    try:
+        created_at, kind, item_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if kind not in _KIND_RANK:
+            raise ValueError(kind)
+        return str(created_at), kind, int(item_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _after_cursor(table_kind: str, cursor: Optional[Tuple[str, str, int]]) -> Tuple[str, tuple]:
+    """SQL condition selecting the rows of one table that sort after the cursor."""
+    if cursor is None:
+        return "", ()
+    created_at, kind, item_id = cursor
+    if kind == table_kind:
+        return " AND (created_at < ? OR (created_at = ? AND id < ?))", (created_at, created_at, item_id)
+    if _KIND_RANK[table_kind] < _KIND_RANK[kind]:
+        # Rows of this kind with the cursor's timestamp sort after it
+        return " AND created_at <= ?", (created_at,)
+    return " AND created_at < ?", (created_at,)
+
+
 @router.get("/courses/{course_id}/updates", response_model=List[Union[UpdateResponse, PollResponse]], tags=["student"])
-def get_course_updates(course_id: str, user_id: Optional[int] = None):
+def get_course_updates(
+    course_id: str,
+    response: Response,
+    user_id: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=200, description="Page size; omit for the whole feed"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor from the previous page"),
+    conn: SmartConn = Depends(get_conn),
+):
+    """
+    Updates and polls for a course, newest first, in a constant number of queries
+    (updates, polls, options with their vote counters, the user's votes) whatever
+    the number of polls.
+    With limit, the next page's cursor is returned in the X-Next-Cursor header.
+    """
     c = conn.cursor()
-    combined = []
-    
-    # 1. Fetch Updates
-    try:
-        c.execute("SELECT id, content, image_data, external_url, created_at FROM updates WHERE course_id=? ORDER BY created_at DESC", (course_id,))
-        for row in c.fetchall():
-            update_id = row[0]
-            has_image = row[2] is not None
-            combined.append(UpdateResponse(
-                id=update_id, 
-                content=row[1], 
-                image_url=f"/updates/{update_id}/image" if has_image else None,
-                external_url=row[3], 
-                created_at=row[4]
-            ))
-    except Exception as e:
-        print(f"Error fetching updates: {e}")
-        
-    # 2. Fetch Polls
-    try:
-        c.execute("SELECT id, question, created_at FROM polls WHERE course_id=? ORDER BY created_at DESC", (course_id,))
-        polls = c.fetchall()
-        
-        for p_row in polls:
-            poll_id = p_row[0]
-            question = p_row[1]
-            p_created_at = p_row[2]
-            
-            # Get Options & Vote Counts
-            c.execute("""
-                SELECT o.id, o.option_text, COALESCE(COUNT(v.id), 0) as vote_count 
-                FROM poll_options o 
-                LEFT JOIN poll_votes v ON o.id = v.option_id 
-                WHERE o.poll_id=? 
-                GROUP BY o.id
-            """, (poll_id,))
-            
-            options_data = c.fetchall()
-            options = []
-            if options_data:
-                for o_row in options_data:
-                    options.append(PollOptionResponse(id=o_row[0], text=o_row[1], votes=o_row[2]))
-            
-            # Check if user voted
-            user_voted_option_id = None
-            if user_id:
-                c.execute("SELECT option_id FROM poll_votes WHERE user_id=? AND poll_id=?", (user_id, poll_id))
-                vote_row = c.fetchone()
-                if vote_row:
-                    user_voted_option_id = vote_row[0]
-                    
-            combined.append(PollResponse(
-                id=poll_id,
-                question=question,
-                options=options,
-                user_voted_option_id=user_voted_option_id,
-                created_at=p_created_at
-            ))
-    except Exception as e:
-        print(f"Error fetching polls: {e}")
-        
-    # Sort combined list by created_at desc
-    combined.sort(key=lambda x: x.created_at, reverse=True)
-    
-    return combined
+    position = decode_feed_cursor(cursor) if cursor else None
+    # Each stream needs at most limit + 1 rows to fill the page and tell whether more exist
+    limit_sql, limit_params = (" LIMIT ?", (limit + 1,)) if limit else ("", ())
+
+    where, params = _after_cursor("update", position)
+    c.execute(
+        "SELECT id, content, CASE WHEN image_sha256 IS NOT NULL OR image_data IS NOT NULL THEN 1 ELSE 0 END, external_url, created_at, image_sha256 "
+        f"FROM updates WHERE course_id=?{where} ORDER BY created_at DESC, id DESC{limit_sql}",
+        (course_id, *params, *limit_params),
+    )
+    updates = [
+        UpdateResponse(
+            id=row[0],
+            content=row[1],
+            image_url=update_image_url(row[0], row[5]) if row[2] else None,
+            external_url=row[3],
+            created_at=row[4],
+        )
+        for row in c.fetchall()
+    ]
+
+    where, params = _after_cursor("poll", position)
+    poll_filter = f"course_id=?{where}"
+    poll_params = (course_id, *params)
+    page_polls_sql = f"SELECT id FROM polls WHERE {poll_filter} ORDER BY created_at DESC, id DESC{limit_sql}"
+    c.execute(
+        f"SELECT id, question, created_at FROM polls WHERE {poll_filter} ORDER BY created_at DESC, id DESC{limit_sql}",
+        (*poll_params, *limit_params),
+    )
+    poll_rows = c.fetchall()
+
+    options: Dict[int, List[PollOptionResponse]] = {}
+    user_votes: Dict[int, int] = {}
+    if poll_rows:
+        # One query for every poll on the page; counts come from the vote_count counter
+        c.execute(
+            f"""
+            SELECT o.poll_id, o.id, o.option_text, COALESCE(o.vote_count, 0)
+            FROM poll_options o
+            WHERE o.poll_id IN ({page_polls_sql})
+            ORDER BY o.poll_id, o.id
+            """,
+            (*poll_params, *limit_params),
+        )
+        for poll_id, option_id, text, votes in c.fetchall():
+            options.setdefault(poll_id, []).append(PollOptionResponse(id=option_id, text=text, votes=votes))
+
+        if user_id:
+            c.execute(
+                f"SELECT poll_id, option_id FROM poll_votes WHERE user_id=? AND poll_id IN ({page_polls_sql})",
+                (user_id, *poll_params, *limit_params),
+            )
+            user_votes = dict(c.fetchall())
+
+    polls = [
+        PollResponse(
+            id=row[0],
+            question=row[1],
+            options=options.get(row[0], []),
+            user_voted_option_id=user_votes.get(row[0]),
+            created_at=row[2],
+        )
+        for row in poll_rows
+    ]
+
+    # Both lists are already newest-first, so merge instead of sorting
+    merged = heapq.merge(
+        updates,
+        polls,
+        key=lambda item: (item.created_at, _KIND_RANK[item.type], item.id),
+        reverse=True,
+    )
+    if not limit:
+        return list(merged)
+
+    page = list(islice(merged, limit + 1))
+    if len(page) > limit:
+        page = page[:limit]
+        last = page[-1]
+        response.headers["X-Next-Cursor"] = encode_feed_cursor(last.type, last.id, last.created_at)
+    return page
 
 @router.post("/polls/vote", tags=["student"])
-def vote_poll(req: VoteRequest):
+def vote_poll(req: VoteRequest, conn: SmartConn = Depends(get_conn)):
     c = conn.cursor()
     
     # Verify option exists and get poll_id
-    c.execute("SELECT poll_id FROM poll_options WHERE id=?", (req.option_id,))
+    c.execute(
+        "SELECT o.poll_id, p.course_id FROM poll_options o JOIN polls p ON p.id = o.poll_id WHERE o.id=?",
+        (req.option_id,),
+    )
     row = c.fetchone()
     if not row:
         raise HTTPException(status_code=404, detail="Option not found")
-    poll_id = row[0]
+    poll_id, course_id = row
     
     # Check if user already voted in this poll
     # (Checking against poll_votes table where poll_id = X and user_id = Y)
@@ -179,9 +298,75 @@ def vote_poll(req: VoteRequest):
             "INSERT INTO poll_votes (poll_id, option_id, user_id) VALUES (?, ?, ?)",
             (poll_id, req.option_id, req.user_id)
         )
+        # Same transaction as the vote, so the counter never drifts from poll_votes
+        c.execute("UPDATE poll_options SET vote_count = vote_count + 1 WHERE id=?", (req.option_id,))
+        c.execute("SELECT vote_count FROM poll_options WHERE id=?", (req.option_id,))
+        votes = c.fetchone()[0]
         conn.commit()
-        return {"status": "ok"}
     except Exception as e:
         conn.rollback()
         print(f"Vote error: {e}")
         raise HTTPException(status_code=500, detail="Vote failed")
+
+    # Push to live subscribers only once the vote is committed
+    event = {"poll_id": poll_id, "option_id": req.option_id, "delta": 1, "votes": votes}
+    broker.publish(f"poll:{poll_id}", event)
+    broker.publish(f"course:{course_id}", event)
+    return {"status": "ok"}
+
+
+def _sse(data: dict, event: Optional[str] = None) -> str:
+    payload = f"data: {json.dumps(data)}\n\n"
+    return f"event: {event}\n{payload}" if event else payload
+
+
+async def live_votes_stream(request: Request, topic: str, snapshot: Optional[Callable[[], dict]] = None) -> StreamingResponse:
+    """
+    SSE stream of `event: vote` messages ({poll_id, option_id, delta, votes}) for one topic.
+    votes is the option's new total, so a client that missed events (dropped for a slow
+    connection) converges on the next one. Comment lines keep idle proxies from closing it.
+    """
+    # Subscribe before reading the snapshot so no vote committed in between is missed
+    sub = broker.subscribe([topic])
+    try:
+        initial = await run_in_threadpool(snapshot) if snapshot else None
+    except Exception:
+        sub.close()
+        raise
+
+    async def events() -> AsyncIterator[str]:
+        try:
+            if initial is not None:
+                yield _sse(initial, event="snapshot")
+            while not await request.is_disconnected():
+                event = await sub.get(timeout=SSE_KEEPALIVE_SECONDS)
+                yield _sse(event, event="vote") if event is not None else ": keepalive\n\n"
+        finally:
+            sub.close()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/polls/{poll_id}/stream", tags=["student"])
+async def stream_poll_votes(poll_id: int, request: Request):
+    def snapshot() -> dict:
+        # A short-lived connection: the stream itself may stay open for the whole lecture
+        with pool.connection() as conn:
+            c = conn.cursor()
+            c.execute("SELECT id, COALESCE(vote_count, 0) FROM poll_options WHERE poll_id=? ORDER BY id", (poll_id,))
+            rows = c.fetchall()
+        if not rows:
+            raise HTTPException(status_code=404, detail="Poll not found")
+        return {"poll_id": poll_id, "options": [{"id": r[0], "votes": r[1]} for r in rows]}
+
+    return await live_votes_stream(request, f"poll:{poll_id}", snapshot)
+
+
+@router.get("/courses/{course_id}/polls/stream", tags=["student"])
+async def stream_course_votes(course_id: str, request: Request):
+    """Votes on every poll of a course; pair with GET /courses/{course_id}/updates for the initial counts."""
+    return await live_votes_stream(request, f"course:{course_id}")
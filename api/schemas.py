@@ -46,6 +46,24 @@ class FileResponse(BaseModel):
     file_type: str
     course_id: Optional[str] = None
     uploaded_at: str
+    extraction_status: Optional[str] = None
+
+
+class FileStatusResponse(BaseModel):
+    id: int
+    extraction_status: str
+    extraction_error: Optional[str] = None
+
+
+class JobResponse(BaseModel):
+    id: int
+    kind: str
+    status: str  # queued | running | done | failed
+    result: Optional[Any] = None
+    error: Optional[str] = None
+    created_at: str
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
 
 
 class SyllabusContent(BaseModel):
@@ -199,3 +217,14 @@ class PollResponse(BaseModel):
     options: List[PollOptionResponse]
     user_voted_option_id: Optional[int] = None
     created_at: str
+
+class SearchResult(BaseModel):
+    kind: str  # "file", "chat" or "update"
+    id: int  # files.id, chat_history.id or updates.id
+    title: Optional[str] = None
+    snippet: str
+    score: float
+    group_id: Optional[int] = None
+    course_id: Optional[str] = None
+    session_id: Optional[str] = None
+    created_at: Optional[str] = None
@@ -0,0 +1,150 @@
+import hashlib
+import os
+import tempfile
+from abc import ABC, abstractmethod
+from typing import BinaryIO, Dict, Iterator, Optional, Type
+
+from ..core.config import BLOB_STORE_BACKEND, BLOB_STORE_DIR
+
+
+class BlobStore(ABC):
+    """Content-addressed storage: blobs are written once and referenced by their sha256."""
+
+    @abstractmethod
+    def put(self, data: bytes) -> str:
+        ...
+
+    @abstractmethod
+    def open(self, digest: str) -> BinaryIO:
+        ...
+
+    @abstractmethod
+    def exists(self, digest: str) -> bool:
+        ...
+
+    @abstractmethod
+    def size(self, digest: str) -> int:
+        ...
+
+    def iter_chunks(self, digest: str, chunk_size: int = 64 * 1024, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """Streams the blob, or only bytes start..end (inclusive) for HTTP Range requests."""
+        with self.open(digest) as f:
+            if start:
+                f.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def head(self, digest: str, length: int = 32) -> bytes:
+        with self.open(digest) as f:
+            return f.read(length)
+
+    def read(self, digest: str) -> bytes:
+        with self.open(digest) as f:
+            return f.read()
+
+
+class LocalBlobStore(BlobStore):
+    """Blobs as files under root/ab/cd/<sha256>; identical uploads share one file."""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, digest: str) -> str:
+        if len(digest) != 64 or not all(ch in "0123456789abcdef" for ch in digest):
+            raise ValueError(f"Invalid blob digest: {digest!r}")
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def put(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if os.path.exists(path):
+            return digest
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file first so readers never see a partial blob
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return digest
+
+    def open(self, digest: str) -> BinaryIO:
+        return open(self._path(digest), "rb")
+
+    def exists(self, digest: str) -> bool:
+        return os.path.exists(self._path(digest))
+
+    def size(self, digest: str) -> int:
+        return os.path.getsize(self._path(digest))
+
+
+BACKENDS: Dict[str, Type[BlobStore]] = {
+    "local": LocalBlobStore,
+}
+
+
+def create_blob_store(backend: str = BLOB_STORE_BACKEND, root: str = BLOB_STORE_DIR) -> BlobStore:
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown blob store backend: {backend}")
+    return BACKENDS[backend](root)
+
+
+blob_store = create_blob_store()
+
+
+def _as_bytes(value) -> Optional[bytes]:
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return value.encode("utf-8")
+    # PostgreSQL returns BYTEA as memoryview
+    return bytes(value)
+
+
+def move_blobs_out(conn, store: BlobStore = blob_store, batch_size: int = 50) -> Dict[str, int]:
+    """
+    One-shot migration of inline BLOBs into the blob store.
+
+    Moves files.file_content for binary uploads (rows with extracted_text; legacy rows
+    keep their text inline) and updates.image_data, clearing the inline copy.
+    Safe to re-run: rows already pointing at a blob are skipped.
+    """
+    moved = {"files": 0, "updates": 0}
+    c = conn.cursor()
+    jobs = [
+        (
+            "files",
+            "SELECT id, file_content FROM files WHERE blob_sha256 IS NULL AND extracted_text IS NOT NULL AND file_content IS NOT NULL ORDER BY id LIMIT ?",
+            "UPDATE files SET blob_sha256=?, file_size=?, file_content=NULL WHERE id=?",
+        ),
+        (
+            "updates",
+            "SELECT id, image_data FROM updates WHERE image_sha256 IS NULL AND image_data IS NOT NULL ORDER BY id LIMIT ?",
+            "UPDATE updates SET image_sha256=?, image_size=?, image_data=NULL WHERE id=?",
+        ),
+    ]
+    for table, select_sql, update_sql in jobs:
+        while True:
+            c.execute(select_sql, (batch_size,))
+            rows = c.fetchall()
+            if not rows:
+                break
+            for row_id, value in rows:
+                data = _as_bytes(value)
+                digest = store.put(data)
+                c.execute(update_sql, (digest, len(data), row_id))
+                moved[table] += 1
+            conn.commit()
+            print(f"[BLOBS] Moved {moved[table]} {table} rows so far")
+    return moved
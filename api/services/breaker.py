@@ -0,0 +1,169 @@
+"""
+Circuit breakers for external dependencies (Gemini, SerpAPI, YouTube, Resend).
+
+A breaker is closed while calls succeed. After BREAKER_FAILURE_THRESHOLD failures
+in a row it opens, and calls fail immediately with CircuitOpen instead of waiting
+on timeouts and retries. After BREAKER_RESET_TIMEOUT seconds it lets up to
+BREAKER_HALF_OPEN_CALLS trial calls through (half-open): a successful trial closes
+it, a failed one opens it again. Callers catch CircuitOpen to serve a cached or
+degraded answer where they have one.
+"""
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional
+
+from ..core.config import BREAKER_FAILURE_THRESHOLD, BREAKER_HALF_OPEN_CALLS, BREAKER_RESET_TIMEOUT
+from .metrics import Counter, registry
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+TRANSITIONS = registry.register(
+    Counter("circuit_breaker_transitions_total", "Circuit breaker state changes", ("breaker", "state"))
+)
+REJECTED = registry.register(
+    Counter("circuit_breaker_rejected_total", "Calls failed fast by an open circuit breaker", ("breaker",))
+)
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling a dependency whose breaker is open."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} is unavailable, retry in {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+def _cancelled(error: BaseException) -> bool:
+    # The caller gave up (a timeout, a closed stream); says nothing about the dependency
+    return isinstance(error, (asyncio.CancelledError, GeneratorExit))
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+        reset_timeout: float = BREAKER_RESET_TIMEOUT,
+        half_open_calls: int = BREAKER_HALF_OPEN_CALLS,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trials = 0
+        self._lock = threading.Lock()
+
+    def _set_state(self, state: str) -> None:
+        # Callers hold self._lock
+        if state == self.state:
+            return
+        self.state = state
+        TRANSITIONS.inc(breaker=self.name, state=state)
+        print(f"[BREAKER] {self.name} {state}")
+
+    def _refresh(self, now: float) -> None:
+        if self.state == OPEN and now - self.opened_at >= self.reset_timeout:
+            self.trials = 0
+            self._set_state(HALF_OPEN)
+
+    def _open(self, now: float) -> None:
+        self.opened_at = now
+        self.failures = 0
+        self._set_state(OPEN)
+
+    def is_open(self) -> bool:
+        """True while calls are being failed fast (not counting a half-open breaker with a trial in flight)."""
+        with self._lock:
+            self._refresh(time.monotonic())
+            return self.state == OPEN
+
+    def acquire(self) -> bool:
+        """
+        Admits a call or raises CircuitOpen. Returns whether the call is a half-open
+        trial; an admitted call must be followed by record() with that flag.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._refresh(now)
+            if self.state == CLOSED:
+                return False
+            if self.state == HALF_OPEN and self.trials < self.half_open_calls:
+                self.trials += 1
+                return True
+            retry_after = max(0.0, self.opened_at + self.reset_timeout - now)
+        REJECTED.inc(breaker=self.name)
+        raise CircuitOpen(self.name, retry_after)
+
+    def record(self, failed: Optional[bool], trial: bool = False) -> None:
+        """
+        Outcome of an admitted call; failed=None for a call abandoned before it finished.
+        Calls admitted while closed only count while the breaker is still closed.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if trial:
+                self.trials = max(0, self.trials - 1)
+                if failed is None or self.state != HALF_OPEN:
+                    return
+                if failed:
+                    self._open(now)
+                else:
+                    self.failures = 0
+                    self._set_state(CLOSED)
+            elif failed is not None and self.state == CLOSED:
+                self.failures = self.failures + 1 if failed else 0
+                if self.failures >= self.failure_threshold:
+                    self._open(now)
+
+    @contextmanager
+    def guard(self, is_failure: Callable[[BaseException], Optional[bool]] = lambda error: True) -> Iterator[None]:
+        """
+        Runs the block as one call: raises CircuitOpen up front when the breaker is open,
+        and records an exception from the block as is_failure(exception) says: a failure,
+        a success (the dependency answered), or None for neither.
+        """
+        trial = self.acquire()
+        try:
+            yield
+        except BaseException as e:
+            self.record(None if _cancelled(e) else is_failure(e), trial)
+            raise
+        self.record(False, trial)
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            self._refresh(time.monotonic())
+            info: Dict[str, object] = {"state": self.state, "failures": self.failures}
+            if self.state != CLOSED:
+                info["retry_after"] = round(max(0.0, self.opened_at + self.reset_timeout - time.monotonic()), 1)
+            return info
+
+
+# Created up front so /health lists them before their first call
+DEPENDENCIES = ("gemini", "serpapi", "youtube", "resend")
+
+_breakers: Dict[str, CircuitBreaker] = {name: CircuitBreaker(name) for name in DEPENDENCIES}
+_breakers_lock = threading.Lock()
+
+
+def circuit(name: str) -> CircuitBreaker:
+    """The process-wide breaker for a dependency, created on first use."""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name)
+        return breaker
+
+
+def snapshot() -> Dict[str, Dict[str, object]]:
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.snapshot() for breaker in breakers}
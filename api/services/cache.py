@@ -0,0 +1,182 @@
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from ..db import pool
+
+
+def cache_key(*parts: Any) -> str:
+    """Content-addressed key: sha256 over a canonical JSON encoding of the parts."""
+    raw = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class PersistentCache:
+    """
+    A TTL + size-bounded LRU cache stored in the response_cache table.
+
+    Entries are grouped by namespace so several caches can share the table; each
+    namespace is evicted independently once it grows past max_entries.
+
+    Reads stay reads: a hit only rewrites last_access once it is more than
+    touch_fraction of the TTL old, so LRU order is approximate to that granularity.
+    Expired and overflowing entries are swept at most every sweep_interval seconds
+    rather than counted on every write, so a namespace can briefly exceed max_entries.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        ttl: float,
+        max_entries: int,
+        enabled: bool = True,
+        touch_fraction: float = 0.05,
+        sweep_interval: float = 60.0,
+    ):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.touch_after = ttl * touch_fraction
+        self.sweep_interval = sweep_interval
+        self._next_sweep = 0.0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self._stats[name] += n
+
+    def get(self, key: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        now = time.time()
+        try:
+            with pool.connection() as conn:
+                c = conn.cursor()
+                c.execute(
+                    "SELECT value, created_at, last_access FROM response_cache WHERE namespace=? AND cache_key=?",
+                    (self.namespace, key),
+                )
+                row = c.fetchone()
+                if not row or now - row[1] > self.ttl:
+                    self._count("misses")
+                    return None
+                if now - (row[2] or 0) > self.touch_after:
+                    c.execute(
+                        "UPDATE response_cache SET last_access=? WHERE namespace=? AND cache_key=?",
+                        (now, self.namespace, key),
+                    )
+                    conn.commit()
+        except Exception as e:
+            print(f"[CACHE] Lookup failed in {self.namespace}: {e}")
+            self._count("misses")
+            return None
+        self._count("hits")
+        return row[0]
+
+    def set(self, key: str, value: str) -> None:
+        if not self.enabled:
+            return
+        now = time.time()
+        try:
+            with pool.connection() as conn:
+                c = conn.cursor()
+                c.execute(
+                    """
+                    INSERT INTO response_cache (namespace, cache_key, value, created_at, last_access)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(namespace, cache_key) DO UPDATE SET
+                    value=excluded.value,
+                    created_at=excluded.created_at,
+                    last_access=excluded.last_access
+                    """,
+                    (self.namespace, key, value, now, now),
+                )
+                self._count("stores")
+                if self._sweep_due(now):
+                    self._evict(c, now)
+                conn.commit()
+        except Exception as e:
+            print(f"[CACHE] Store failed in {self.namespace}: {e}")
+
+    def _sweep_due(self, now: float) -> bool:
+        # One writer per interval (per process) pays for the expiry and size sweep
+        with self._lock:
+            if now < self._next_sweep:
+                return False
+            self._next_sweep = now + self.sweep_interval
+            return True
+
+    def sweep(self) -> None:
+        """Deletes expired entries and the least recently used ones past max_entries now."""
+        now = time.time()
+        try:
+            with pool.connection() as conn:
+                self._evict(conn.cursor(), now)
+                conn.commit()
+        except Exception as e:
+            print(f"[CACHE] Sweep failed in {self.namespace}: {e}")
+
+    def _evict(self, c, now: float) -> None:
+        c.execute(
+            "DELETE FROM response_cache WHERE namespace=? AND created_at < ?",
+            (self.namespace, now - self.ttl),
+        )
+        expired = max(c.rowcount, 0)
+        c.execute("SELECT COUNT(*) FROM response_cache WHERE namespace=?", (self.namespace,))
+        overflow = c.fetchone()[0] - self.max_entries
+        if overflow > 0:
+            c.execute(
+                """
+                DELETE FROM response_cache WHERE id IN (
+                    SELECT id FROM response_cache WHERE namespace=? ORDER BY last_access LIMIT ?
+                )
+                """,
+                (self.namespace, overflow),
+            )
+        evicted = expired + max(overflow, 0)
+        if evicted:
+            self._count("evictions", evicted)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["enabled"] = self.enabled
+        return stats
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller runs fn, the
+    others block until it finishes and share its result (or exception).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Returns (result, shared); shared is True when another caller did the work."""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result(), True
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+        future.set_result(result)
+        return result, False
@@ -0,0 +1,157 @@
+"""
+Bounded conversation memory for text chat.
+
+Each session keeps its messages in chat_history plus a rolling summary in
+chat_session_memory. summarized_until is the last chat_history.id folded into the
+summary. The prompt gets the summary and the newest unsummarized messages verbatim,
+and the syllabus and analysis are trimmed so that all three stay within
+CHAT_CONTEXT_TOKENS. Once more than CHAT_RECENT_MESSAGES messages are waiting, a
+background job folds the older ones into the summary.
+"""
+from datetime import datetime
+from typing import List, Tuple
+
+from ..core.config import CHAT_CONTEXT_TOKENS, CHAT_RECENT_MESSAGES, CHAT_SUMMARY_WORDS
+from ..db import SmartConn, pool
+from . import jobs
+from .gemini import summarize_conversation
+
+# Fold messages into the summary in batches (two turns) rather than on every turn
+SUMMARY_BATCH = 4
+
+_ROLE_LABELS = {"user": "Student", "assistant": "Assistant"}
+
+Message = Tuple[int, str, str]  # (chat_history.id, role, message)
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English text; counting exactly would cost an API call
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text: str, tokens: int) -> str:
+    if estimate_tokens(text) <= tokens:
+        return text
+    if tokens <= 0:
+        return ""
+    return text[: tokens * 4].rstrip() + " …[truncated]"
+
+
+def load_memory(conn: SmartConn, user_id: int, group_id: int, session_id: str) -> Tuple[str, int, List[Message]]:
+    """(summary, summarized_until, messages not yet in the summary, oldest first)."""
+    c = conn.cursor()
+    c.execute("SELECT summary, summarized_until FROM chat_session_memory WHERE session_id=?", (session_id,))
+    row = c.fetchone()
+    summary, summarized_until = (row[0] or "", row[1] or 0) if row else ("", 0)
+    c.execute(
+        "SELECT id, role, message FROM chat_history WHERE user_id=? AND group_id=? AND session_id=? AND id > ? ORDER BY id",
+        (user_id, group_id, session_id, summarized_until),
+    )
+    return summary, summarized_until, [(r[0], r[1], r[2] or "") for r in c.fetchall()]
+
+
+def render_messages(messages: List[Message]) -> str:
+    return "\n".join(f"{_ROLE_LABELS.get(role, role)}: {text}" for _, role, text in messages)
+
+
+def build_chat_context(
+    conn: SmartConn, user_id: int, group_id: int, session_id: str, syllabus: str, analysis_text: str, material: str = ""
+) -> Tuple[str, str, str, str]:
+    """
+    Returns (syllabus, analysis_text, material, history) trimmed to the token budget.
+    History gets up to half the budget (summary first, then the newest messages),
+    retrieved study material up to a third of the rest, and the syllabus and
+    analysis share what is left.
+    """
+    summary, _, messages = load_memory(conn, user_id, group_id, session_id)
+    history_budget = CHAT_CONTEXT_TOKENS // 2
+
+    parts: List[str] = []
+    if summary:
+        summary = truncate_to_tokens(summary, history_budget // 2)
+        parts.append(f"Summary of the earlier conversation: {summary}")
+    used = estimate_tokens(parts[0]) if parts else 0
+
+    recent: List[Message] = []
+    for message in reversed(messages):
+        cost = estimate_tokens(render_messages([message]))
+        if used + cost > history_budget:
+            break
+        recent.append(message)
+        used += cost
+    if recent:
+        parts.append("Recent messages:\n" + render_messages(list(reversed(recent))))
+    history = "\n".join(parts)
+
+    remaining = CHAT_CONTEXT_TOKENS - estimate_tokens(history)
+    material = truncate_to_tokens(material, remaining // 3)
+    remaining -= estimate_tokens(material)
+    # Split the rest evenly; whichever needs less hands its share to the other
+    half = remaining // 2
+    if estimate_tokens(syllabus) < half:
+        analysis_text = truncate_to_tokens(analysis_text, remaining - estimate_tokens(syllabus))
+    elif estimate_tokens(analysis_text) < half:
+        syllabus = truncate_to_tokens(syllabus, remaining - estimate_tokens(analysis_text))
+    else:
+        syllabus = truncate_to_tokens(syllabus, half)
+        analysis_text = truncate_to_tokens(analysis_text, remaining - half)
+    return syllabus, analysis_text, material, history
+
+
+def schedule_summary(conn: SmartConn, user_id: int, group_id: int, session_id: str) -> None:
+    """
+    Enqueues a summary refresh once enough messages have moved out of the recent window.
+    Call after the turn is committed; failures are logged, never raised into the chat reply.
+    """
+    try:
+        c = conn.cursor()
+        c.execute("SELECT summarized_until FROM chat_session_memory WHERE session_id=?", (session_id,))
+        row = c.fetchone()
+        c.execute(
+            "SELECT COUNT(*) FROM chat_history WHERE user_id=? AND group_id=? AND session_id=? AND id > ?",
+            (user_id, group_id, session_id, (row[0] or 0) if row else 0),
+        )
+        if c.fetchone()[0] >= CHAT_RECENT_MESSAGES + SUMMARY_BATCH:
+            jobs.enqueue(conn, "chat_summary", {"user_id": user_id, "group_id": group_id, "session_id": session_id})
+    except Exception as e:
+        conn.rollback()
+        print(f"[CHAT MEMORY] Could not schedule summary for session {session_id}: {e}")
+
+
+def summarize_session(user_id: int, group_id: int, session_id: str) -> int:
+    """
+    Folds everything but the recent window into the rolling summary. Returns messages folded.
+    Borrows a pooled connection for the read and the write, not for the Gemini call.
+    """
+    with pool.connection() as conn:
+        summary, _, messages = load_memory(conn, user_id, group_id, session_id)
+    overflow = messages[:-CHAT_RECENT_MESSAGES] if CHAT_RECENT_MESSAGES else messages
+    if not overflow:
+        return 0
+    # Keep the summarization prompt bounded too, even after a long offline stretch
+    transcript = truncate_to_tokens(render_messages(overflow), CHAT_CONTEXT_TOKENS)
+    updated = summarize_conversation(summary, transcript, CHAT_SUMMARY_WORDS)
+    if not updated:
+        raise RuntimeError("Gemini returned no summary")
+
+    with pool.connection() as conn:
+        c = conn.cursor()
+        c.execute(
+            """
+            INSERT INTO chat_session_memory (session_id, summary, summarized_until, updated_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(session_id) DO UPDATE SET
+            summary=excluded.summary,
+            summarized_until=excluded.summarized_until,
+            updated_at=excluded.updated_at
+            """,
+            (session_id, updated, overflow[-1][0], datetime.now().isoformat()),
+        )
+        conn.commit()
+    return len(overflow)
+
+
+@jobs.register("chat_summary")
+def run_chat_summary_job(params: dict) -> dict:
+    folded = summarize_session(params["user_id"], params["group_id"], params["session_id"])
+    return {"folded": folded}
@@ -0,0 +1,76 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Tuple
+
+from ..core.config import PDF_EXTRACT_WORKERS, PDF_MAX_PAGES
+
+
+def decode_text(data: bytes) -> str:
+    try:
+        return data.decode("utf-8")
+    except Exception:
+        return data.decode("latin-1", errors="ignore")
+
+
+def extract_pdf_pages(data: bytes, max_pages: int = PDF_MAX_PAGES) -> Tuple[str, int, bool]:
+    """
+    Runs in a worker process. Extracts up to max_pages pages and joins them once.
+    Returns (text, pages_read, truncated).
+    """
+    import fitz  # PyMuPDF; imported here so the API process never has to load it
+
+    pages = []
+    truncated = False
+    doc = fitz.open(stream=data, filetype="pdf")
+    try:
+        for index, page in enumerate(doc):
+            if index >= max_pages:
+                truncated = True
+                break
+            pages.append(page.get_text())
+    finally:
+        doc.close()
+    return "".join(pages), len(pages), truncated
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+# Job worker threads extract concurrently; without it two pools could be started and one leaked
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn, not fork: the API process holds DB and gRPC threads that must not be forked
+            _executor = ProcessPoolExecutor(
+                max_workers=PDF_EXTRACT_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _executor
+
+
+def extract_pdf_text(data: bytes) -> str:
+    """Parses a PDF in the process pool and waits for its text (called from the extraction job)."""
+    executor = get_executor()
+    try:
+        text, pages, truncated = executor.submit(extract_pdf_pages, data).result()
+    except BrokenProcessPool:
+        # A worker died (e.g. a malformed PDF crashed MuPDF); start a fresh pool for the next upload
+        shutdown(executor)
+        raise
+    if truncated:
+        print(f"[EXTRACT] PDF truncated to its first {pages} pages")
+    return text
+
+
+def shutdown(broken: Optional[ProcessPoolExecutor] = None) -> None:
+    """Stops the pool. With broken, only if that is still the current pool (another thread may have replaced it)."""
+    global _executor
+    with _executor_lock:
+        if _executor is None or (broken is not None and _executor is not broken):
+            return
+        executor, _executor = _executor, None
+    executor.shutdown(wait=False, cancel_futures=True)
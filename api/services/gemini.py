@@ -1,7 +1,11 @@
+import asyncio
+import contextvars
 import json
 import re
-from typing import Any, Dict, List, Optional
-from functools import wraps
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from functools import partial, wraps
 
 # --- Centralized Configuration ---
 GEMINI_MODEL = "gemini-2.0-flash"
@@ -9,10 +13,15 @@ GEMINI_MODEL = "gemini-2.0-flash"
 # --- Conditional Imports ---
 try:
     import google.generativeai as genai
-    from google.generativeai.types import GenerationConfig
+    from google.generativeai import client as genai_client
 except ImportError:
     genai = None
 
+try:
+    from google.api_core import exceptions as google_exceptions
+except ImportError:
+    google_exceptions = None
+
 try:
     from phi.agent import Agent
     from phi.tools.duckduckgo import DuckDuckGo
@@ -22,40 +31,136 @@ except ImportError:
     Agent = None
     Gemini = None
 
-from ..core.config import API_KEYS, SERP_API_KEY
+from ..core.config import API_KEYS, SERP_API_KEY, GEMINI_CACHE_ENABLED, GEMINI_CACHE_TTL, GEMINI_CACHE_MAX_ENTRIES
+from .breaker import CircuitOpen, circuit
+from .cache import PersistentCache, cache_key
+from .gemini_keys import KeysExhausted, record_usage, response_tokens, scheduler as key_scheduler
+from .metrics import gemini_timer
+
+gemini_breaker = circuit("gemini")
+
+gemini_cache = PersistentCache(
+    "gemini",
+    ttl=GEMINI_CACHE_TTL,
+    max_entries=GEMINI_CACHE_MAX_ENTRIES,
+    enabled=GEMINI_CACHE_ENABLED,
+)
+
+
+# --- Per-key clients ---
+# genai.configure() swaps the key for the whole process, so concurrent calls would race
+# on it. Instead every key gets its own client manager and models are bound to it.
+_key_clients: Dict[str, Any] = {}
+_key_clients_lock = threading.Lock()
+
+
+def _client_manager(api_key: str):
+    # Callers hold _key_clients_lock
+    manager = _key_clients.get(api_key)
+    if manager is None:
+        manager = genai_client._ClientManager()
+        manager.configure(api_key=api_key)
+        _key_clients[api_key] = manager
+    return manager
+
+
+def _generative_client(api_key: str):
+    with _key_clients_lock:
+        return _client_manager(api_key).get_default_client("generative")
+
+
+def _model(api_key: Optional[str] = None, **model_kwargs):
+    """Builds a GenerativeModel that uses api_key for its calls instead of the global configuration."""
+    mod = genai.GenerativeModel(**model_kwargs)
+    if api_key:
+        mod._client = _generative_client(api_key)
+    return mod
+
+
+def _model_kwargs(system_instruction: Optional[str] = None, generation_config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    model_kwargs: Dict[str, Any] = {"model_name": GEMINI_MODEL}
+    if system_instruction:
+        model_kwargs["system_instruction"] = system_instruction
+    if generation_config:
+        model_kwargs["generation_config"] = generation_config
+    return model_kwargs
+
+
+def _is_outage(error: BaseException) -> Optional[bool]:
+    """How a failed call counts for the Gemini breaker: only server-side failures open it."""
+    if isinstance(error, KeysExhausted):
+        return None  # the key scheduler's limits, not Gemini's health
+    if google_exceptions is not None and isinstance(error, google_exceptions.ClientError):
+        return False  # Gemini answered, refusing this request or key (400/403/429)
+    return True
+
+
+# Async endpoints await the blocking Gemini calls (and the phi Agent) here rather than in
+# the server's threadpool, so a burst of AI requests cannot starve ordinary sync endpoints.
+# There is one implementation of each call and of its retry: the synchronous one.
+_blocking_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="gemini-blocking")
+
+
+async def run_blocking(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """Awaits a blocking call on the Gemini executor, keeping the caller's context for /metrics."""
+    call = partial(contextvars.copy_context().run, fn, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(_blocking_executor, call)
+
+
+# Returned by with_gemini_retry when the library is missing or every attempt failed
+GEMINI_UNAVAILABLE = "[Gemini not installed]"
+
+
+class _CacheMiss(Exception):
+    """Raised by _generate(cache_only=True) when the response cache has no answer."""
+
+
+def _no_key(f) -> KeysExhausted:
+    print(f"[GEMINI KEYS] No key available for {f.__name__}")
+    return KeysExhausted("No Gemini API key available right now, try again shortly")
 
 
 # --- Decorator for Retry and API Key Rotation Logic (Corrected Version) ---
-def with_gemini_retry(func=None, *, default_return="[Gemini not installed]"):
+def with_gemini_retry(func=None, *, default_return=GEMINI_UNAVAILABLE):
     """
     A decorator that handles Gemini API calls with retries and API key rotation.
     It can be used as @with_gemini_retry or @with_gemini_retry(default_return=...)
+    The response cache is checked before a key is requested, so cached answers are
+    served even while every key is resting. On a miss each attempt gets the healthiest
+    key not tried yet from the key scheduler, passed to the wrapped function as the
+    `api_key` kwarg; KeysExhausted is raised when no key is available.
     """
     def decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
             if not genai:
                 return default_return
+            if kwargs.get("use_cache", True):
+                try:
+                    return f(*args, **{**kwargs, "api_key": None, "cache_only": True})
+                except _CacheMiss:
+                    kwargs["use_cache"] = False  # already looked
+            if gemini_breaker.is_open():
+                # Fail fast without waiting for a key: _generate's breaker guard raises CircuitOpen
+                kwargs["api_key"] = None
+                return f(*args, **kwargs)
 
-            retries = kwargs.get('retries', 3)
-
-            for attempt in range(min(retries, len(API_KEYS))):
+            attempts = min(kwargs.get('retries', 3), len(API_KEYS))
+            tried: List[int] = []
+            for attempt in range(attempts):
+                lease = key_scheduler.acquire(exclude=tried)
+                if lease is None:
+                    raise _no_key(f)
+                tried.append(lease.index)
                 try:
-                    api_key = API_KEYS[attempt]
-                    genai.configure(api_key=api_key)
-                    return f(*args, **kwargs)
-                except Exception as e:
-                    error_str = str(e)
-                    # Retry on rate limit (429) or invalid key (400/expired)
-                    if ("429" in error_str or "400" in error_str or "API key expired" in error_str) and attempt < len(API_KEYS) - 1:
-                        print(f"API key {attempt} failed: {error_str}. Trying next key.")
-                        continue
-                    
-                    print(f"An unrecoverable error occurred: {e}")
-                    if attempt == min(retries, len(API_KEYS)) - 1:
-                        break # Exit loop to fall through to default return
+                    kwargs["api_key"] = lease.key
+                    with lease:
+                        return f(*args, **kwargs)
+                except CircuitOpen:
                     raise
-            
+                except Exception as e:
+                    if _should_raise(e, attempt, attempts):
+                        raise
             return default_return
         return wrapper
 
@@ -63,94 +168,217 @@ def with_gemini_retry(func=None, *, default_return="[Gemini not installed]"):
         return decorator(func)
     return decorator
 
-@with_gemini_retry
-def analyze_report(report: str, **kwargs) -> str:
-    mod = genai.GenerativeModel(
-        model_name=GEMINI_MODEL,
-        system_instruction=(
-            "You are a very professional academic report analyzer. "
-            "Analyze the student's report and provide detailed strengths, weaknesses, and achievements."
-        ),
+def _should_raise(e: Exception, attempt: int, attempts: int) -> bool:
+    """After a failed attempt: False moves on to the next key (or the default return after the last one)."""
+    error_str = str(e)
+    # Retry on rate limit (429) or invalid key (400/expired)
+    if ("429" in error_str or "400" in error_str or "API key expired" in error_str) and attempt < len(API_KEYS) - 1:
+        print(f"API key {attempt} failed: {error_str}. Trying next key.")
+        return False
+
+    print(f"An unrecoverable error occurred: {e}")
+    return attempt != attempts - 1
+
+def _generate(
+    prompt: str,
+    *,
+    system_instruction: Optional[str] = None,
+    generation_config: Optional[Dict[str, Any]] = None,
+    api_key: Optional[str] = None,
+    use_cache: bool = True,
+    cache_only: bool = False,
+    validate: Optional[Callable[[str], Any]] = None,
+    **kwargs,
+) -> str:
+    """
+    Single Gemini text generation, served from the response cache when the same
+    model, system instruction, prompt and generation config were seen before.
+    If validate is given it must accept the fresh text before it is cached. With
+    cache_only a miss raises _CacheMiss instead of calling Gemini.
+    """
+    key = cache_key(GEMINI_MODEL, system_instruction, prompt, generation_config)
+    if use_cache:
+        cached = gemini_cache.get(key)
+        if cached is not None:
+            return cached
+    if cache_only:
+        raise _CacheMiss(key)
+
+    mod = _model(api_key, **_model_kwargs(system_instruction, generation_config))
+    with gemini_breaker.guard(_is_outage), gemini_timer("generate"):
+        resp = mod.generate_content(prompt)
+    record_usage(resp)
+    text = getattr(resp, "text", "") or ""
+
+    if text:
+        if validate:
+            validate(text)
+        gemini_cache.set(key, text)
+    return text
+
+@with_gemini_retry(default_return=None)
+def _generate_uncached(contents: Any, *, system_instruction: Optional[str] = None, api_key: Optional[str] = None, cache_only: bool = False, **kwargs) -> str:
+    if cache_only:
+        raise _CacheMiss()
+    mod = _model(api_key, **_model_kwargs(system_instruction))
+    with gemini_breaker.guard(_is_outage), gemini_timer("generate"):
+        resp = mod.generate_content(contents)
+    record_usage(resp)
+    return getattr(resp, "text", "") or ""
+
+def generate(contents: Any, *, system_instruction: Optional[str] = None) -> str:
+    """
+    One uncached generation (e.g. a chat turn, which may include an image), moving on
+    to the next key on a 429 like the cached calls. Raises KeysExhausted when every
+    key it tried failed.
+    """
+    text = _generate_uncached(contents, system_instruction=system_instruction)
+    if text is None:
+        raise KeysExhausted("Every Gemini API key failed for this request, try again shortly")
+    return text
+
+def stream_generate(contents: Any, *, system_instruction: Optional[str] = None) -> Iterator[str]:
+    """Yields text chunks as Gemini produces them (uncached, no retry once streaming has started)."""
+    with gemini_breaker.guard(_is_outage):
+        yield from _stream_with_key(contents, system_instruction)
+
+def _stream_with_key(contents: Any, system_instruction: Optional[str]) -> Iterator[str]:
+    lease = key_scheduler.acquire()
+    if lease is None:
+        raise KeysExhausted("No Gemini API key available right now, try again shortly")
+    # Not `with lease`: the chunks may be pulled from different threads, so usage is charged directly
+    error: Optional[BaseException] = None
+    try:
+        mod = _model(lease.key, **_model_kwargs(system_instruction))
+        chunk = None
+        with gemini_timer("stream"):
+            for chunk in mod.generate_content(contents, stream=True):
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Chunks carrying only finish/safety metadata have no text parts
+                    continue
+                if text:
+                    yield text
+        # The last chunk carries the usage for the whole response
+        lease.charge(response_tokens(chunk))
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        lease.release(error)
+
+def _analysis_prompt(report: str) -> Tuple[str, str]:
+    system_instruction = (
+        "You are a very professional academic report analyzer. "
+        "Analyze the student's report and provide detailed strengths, weaknesses, and achievements."
     )
     prompt = f"Analyze the given student report:\n{report}\n\nNote: Do not include prefatory phrases; answer directly."
-    resp = mod.generate_content(prompt)
-    return getattr(resp, "text", "")
+    return system_instruction, prompt
 
-@with_gemini_retry
-def generate_timetable(report: str, syllabus: str, quiz_results: Optional[Dict[str, Any]] = None, **kwargs) -> str:
-    mod = genai.GenerativeModel(
-        model_name=GEMINI_MODEL,
-        system_instruction=(
-            "You are a professional education developer. Provide a tabular timetable for 7 days "
-            "(8-10 hours per day in 1-hour periods) based on the provided report and syllabus."
-        ),
+def _timetable_prompt(report: str, syllabus: str, quiz_results: Optional[Dict[str, Any]] = None) -> Tuple[str, str]:
+    system_instruction = (
+        "You are a professional education developer. Provide a tabular timetable for 7 days "
+        "(8-10 hours per day in 1-hour periods) based on the provided report and syllabus."
     )
     prompt = f"Generate a weekly timetable to cover the provided topics for each subject based on the student's performance.\nReport:\n{report}\nSyllabus:\n{syllabus}"
     if quiz_results:
         prompt += f"\nQuiz Results Context: {json.dumps(quiz_results)[:3000]}"
-    resp = mod.generate_content(prompt)
-    return getattr(resp, "text", "")
+    return system_instruction, prompt
 
-@with_gemini_retry
-def generate_roadmap(report: str, syllabus: str, quiz_results: Optional[Dict[str, Any]] = None, **kwargs) -> str:
-    mod = genai.GenerativeModel(
-        model_name=GEMINI_MODEL,
-        system_instruction=(
-            "You are a proficient educational roadmap generator. Provide a step-by-step roadmap for the student "
-            "to excel based on the given report and syllabus."
-        ),
+def _roadmap_prompt(report: str, syllabus: str, quiz_results: Optional[Dict[str, Any]] = None) -> Tuple[str, str]:
+    system_instruction = (
+        "You are a proficient educational roadmap generator. Provide a step-by-step roadmap for the student "
+        "to excel based on the given report and syllabus."
     )
     prompt = f"Generate a step-by-step roadmap from the report and syllabus.\nReport:\n{report}\nSyllabus:\n{syllabus}"
     if quiz_results:
         prompt += f"\nQuiz Results Context: {json.dumps(quiz_results)[:3000]}"
-    resp = mod.generate_content(prompt)
-    return getattr(resp, "text", "")
+    return system_instruction, prompt
+
+@with_gemini_retry
+def analyze_report(report: str, **kwargs) -> str:
+    system_instruction, prompt = _analysis_prompt(report)
+    return _generate(prompt, system_instruction=system_instruction, **kwargs)
+
+@with_gemini_retry
+def generate_timetable(report: str, syllabus: str, quiz_results: Optional[Dict[str, Any]] = None, **kwargs) -> str:
+    system_instruction, prompt = _timetable_prompt(report, syllabus, quiz_results)
+    return _generate(prompt, system_instruction=system_instruction, **kwargs)
+
+@with_gemini_retry
+def generate_roadmap(report: str, syllabus: str, quiz_results: Optional[Dict[str, Any]] = None, **kwargs) -> str:
+    system_instruction, prompt = _roadmap_prompt(report, syllabus, quiz_results)
+    return _generate(prompt, system_instruction=system_instruction, **kwargs)
 
 @with_gemini_retry
 def extract_topic(question: str, **kwargs) -> Optional[str]:
-    mod = genai.GenerativeModel(
-        model_name=GEMINI_MODEL,
-        system_instruction="You are an educational assistant. Extract the concise topic that the question relates to.",
-    )
+    system_instruction = "You are an educational assistant. Extract the concise topic that the question relates to."
     prompt = f"Question: {question}\nReturn only the topic phrase."
-    resp = mod.generate_content(prompt)
-    text = getattr(resp, "text", "").strip()
+    text = _generate(prompt, system_instruction=system_instruction, **kwargs).strip()
     return text.split("\n")[0] if text else None
 
-def generate_quiz_json(report: str, syllabus: str, subject: str) -> Dict[str, Any]:
-    # Try phi Agent + tools first
-    if Agent and Gemini and SERP_API_KEY:
-        try:
-            genai.configure(api_key=API_KEYS[0])
+@with_gemini_retry(default_return=None)
+def summarize_conversation(previous_summary: str, transcript: str, max_words: int = 250, **kwargs) -> Optional[str]:
+    system_instruction = (
+        "You maintain a running summary of a tutoring conversation between a student and an assistant. "
+        "Keep what the student told you about themselves, the topics covered, conclusions reached and open questions. "
+        "Drop greetings and repetition."
+    )
+    prompt = (
+        f"Current summary:\n{previous_summary or '(none yet)'}\n\n"
+        f"New turns to fold in:\n{transcript}\n\n"
+        f"Return the updated summary as plain text in at most {max_words} words."
+    )
+    text = _generate(prompt, system_instruction=system_instruction, **kwargs).strip()
+    return text or None
+
+_agent_lock = threading.Lock()
+
+def _agent_quiz(report: str, syllabus: str, subject: str, use_cache: bool = True) -> Optional[Dict[str, Any]]:
+    """The phi Agent + tools quiz, or None when it failed and plain Gemini should be used."""
+    instructions = [
+        "Based on the given subject, report, and syllabus, generate a quiz of 10 MCQs. "
+        "Analyze weaknesses from the report when designing questions. "
+        "Return a valid JSON object with keys: 'questions', 'options', 'answers', and 'explanations'."
+    ]
+    prompt = f"Generate the quiz for {subject} based on the syllabus and report.\nSyllabus:\n{syllabus}\nReport:\n{report}"
+    agent_key = cache_key("phi-agent", GEMINI_MODEL, instructions, prompt)
+    if use_cache:
+        cached = gemini_cache.get(agent_key)
+        if cached is not None:
+            return json.loads(cached)
+    # phi's Gemini model only reads the process-wide genai.configure() key, so agent runs
+    # are serialized; while one is running, other quizzes go straight to plain Gemini
+    if not _agent_lock.acquire(blocking=False):
+        return None
+    try:
+        lease = key_scheduler.acquire()
+        if lease is None:
+            return None
+        with lease:
+            genai.configure(api_key=lease.key)
             quiz_agent = Agent(
                 model=Gemini(model=GEMINI_MODEL),
                 tools=[DuckDuckGo(), SerpApiTools(api_key=SERP_API_KEY)],
-                instructions=[
-                    "Based on the given subject, report, and syllabus, generate a quiz of 10 MCQs. "
-                    "Analyze weaknesses from the report when designing questions. "
-                    "Return a valid JSON object with keys: 'questions', 'options', 'answers', and 'explanations'."
-                ],
+                instructions=instructions,
                 json_output=True,
             )
-            prompt = f"Generate the quiz for {subject} based on the syllabus and report.\nSyllabus:\n{syllabus}\nReport:\n{report}"
-            response_json = quiz_agent.run(prompt)
-            if isinstance(response_json, dict):
-                return response_json
-        except Exception as e:
-            print(f"Phi-agent quiz generation failed: {e}. Falling back to standard Gemini.")
-
-    # Fallback to Gemini only with enforced JSON mode
-    if not genai:
-        return {}
-
-    @with_gemini_retry(default_return={})
-    def generate_with_fallback(**kwargs):
-        json_generation_config = GenerationConfig(response_mime_type="application/json")
-        mod = genai.GenerativeModel(
-            model_name=GEMINI_MODEL, 
-            generation_config=json_generation_config
-        )
-        prompt = f"""
+            with gemini_timer("agent"):
+                response_json = quiz_agent.run(prompt)
+            # The agent doesn't expose token usage; the call still counts against the key's requests
+            lease.charge(0)
+        if isinstance(response_json, dict):
+            gemini_cache.set(agent_key, json.dumps(response_json))
+            return response_json
+    except Exception as e:
+        print(f"Phi-agent quiz generation failed: {e}. Falling back to standard Gemini.")
+    finally:
+        _agent_lock.release()
+    return None
+
+def _quiz_prompt(report: str, syllabus: str, subject: str) -> str:
+    return f"""
         Create 10 Multiple Choice Questions for the subject '{subject}' using the provided syllabus and student report.
         Focus on areas of weakness identified in the report.
 
@@ -165,10 +393,19 @@ def generate_quiz_json(report: str, syllabus: str, subject: str) -> Dict[str, An
         Report:
         {report}
         """
-        # --- END OF REPLACEMENT ---
 
-        resp = mod.generate_content(prompt)
-        return json.loads(resp.text)
+_QUIZ_JSON_CONFIG = {"response_mime_type": "application/json"}
+
+# Gemini only, with enforced JSON mode
+@with_gemini_retry(default_return={})
+def _quiz_json(report: str, syllabus: str, subject: str, **kwargs) -> Dict[str, Any]:
+    text = _generate(_quiz_prompt(report, syllabus, subject), generation_config=_QUIZ_JSON_CONFIG, validate=json.loads, **kwargs)
+    return json.loads(text)
 
-    # Call the now-decorated function
-    return generate_with_fallback()
+def generate_quiz_json(report: str, syllabus: str, subject: str, use_cache: bool = True) -> Dict[str, Any]:
+    # Try phi Agent + tools first, unless Gemini is known to be down
+    if Agent and Gemini and SERP_API_KEY and not gemini_breaker.is_open():
+        quiz = _agent_quiz(report, syllabus, subject, use_cache)
+        if quiz is not None:
+            return quiz
+    return _quiz_json(report, syllabus, subject, use_cache=use_cache)
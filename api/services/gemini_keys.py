@@ -0,0 +1,273 @@
+"""
+Scheduling of Gemini calls across the API_KEYS pool.
+
+Every key has two token buckets refilled over a minute: requests (GEMINI_KEY_RPM)
+and tokens (GEMINI_KEY_TPM). A call takes one request when it is given a key and
+pays for the tokens the response reports (usage_metadata) once it arrives, so the
+token bucket can dip below zero and the key then rests until it refills.
+
+A 429 puts the key on a cooldown of GEMINI_KEY_COOLDOWN seconds, doubled for each
+consecutive 429 up to GEMINI_KEY_MAX_COOLDOWN; a key the API rejects (invalid or
+expired) is set aside for the maximum. Other failures raise the key's error rate,
+an exponentially weighted average of recent outcomes.
+
+Calls get the ready key with the best health score: (1 - error rate) times the
+fraction of its budget left, divided among the calls it already has in flight.
+"""
+import asyncio
+import contextvars
+import math
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from ..core.config import (
+    API_KEYS,
+    GEMINI_KEY_COOLDOWN,
+    GEMINI_KEY_MAX_COOLDOWN,
+    GEMINI_KEY_MAX_WAIT,
+    GEMINI_KEY_RPM,
+    GEMINI_KEY_TPM,
+)
+from .metrics import Counter, registry
+
+# Weight of the latest outcome in a key's error rate
+ERROR_RATE_ALPHA = 0.2
+
+KEY_CALLS = registry.register(
+    Counter("gemini_key_calls_total", "Gemini calls by API key (position in API_KEYS) and outcome", ("key", "outcome"))
+)
+KEY_TOKENS = registry.register(Counter("gemini_key_tokens_total", "Gemini tokens used by API key", ("key",)))
+
+
+class KeysExhausted(RuntimeError):
+    """No API key had budget left within GEMINI_KEY_MAX_WAIT."""
+
+
+class TokenBucket:
+    """capacity units, refilled continuously over `period` seconds."""
+
+    def __init__(self, capacity: float, period: float = 60.0):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.level = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, amount: float, now: float) -> None:
+        self._refill(now)
+        self.level -= amount
+
+    def give_back(self, amount: float, now: float) -> None:
+        self._refill(now)
+        self.level = min(self.capacity, self.level + amount)
+
+    def available(self, now: float) -> float:
+        self._refill(now)
+        return self.level
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` units are available."""
+        missing = amount - self.available(now)
+        return max(0.0, missing / self.rate)
+
+
+def _classify(error: BaseException) -> str:
+    # The caller stopped waiting (a timeout, a closed stream); says nothing about the key
+    if isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+        return "cancelled"
+    text = str(error)
+    if "429" in text or "Resource has been exhausted" in text or "quota" in text.lower():
+        return "rate_limited"
+    if "API key" in text or "API_KEY_INVALID" in text:
+        return "invalid"
+    return "error"
+
+
+class KeyState:
+    def __init__(self, index: int, key: str, rpm: int, tpm: int):
+        self.index = index
+        self.key = key
+        self.label = f"key{index}"
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.cooldown_until = 0.0
+        self.rate_limited_streak = 0
+        self.error_rate = 0.0
+        self.in_flight = 0
+
+    def ready_in(self, now: float) -> float:
+        """Seconds until this key may take another call."""
+        wait = max(0.0, self.cooldown_until - now)
+        if self.requests:
+            wait = max(wait, self.requests.wait_time(1, now))
+        if self.tokens:
+            wait = max(wait, self.tokens.wait_time(1, now))
+        return wait
+
+    def headroom(self, now: float) -> float:
+        """Fraction of the tighter of the two budgets still available."""
+        fractions = [bucket.available(now) / bucket.capacity for bucket in (self.requests, self.tokens) if bucket]
+        return max(0.0, min(fractions, default=1.0))
+
+    def score(self, now: float) -> float:
+        return (1.0 - self.error_rate) * self.headroom(now) / (1 + self.in_flight)
+
+    def snapshot(self, now: float) -> Dict[str, Any]:
+        return {
+            "key": self.label,
+            "score": round(self.score(now), 3),
+            "error_rate": round(self.error_rate, 3),
+            "requests_available": round(self.requests.available(now), 1) if self.requests else None,
+            "tokens_available": round(self.tokens.available(now)) if self.tokens else None,
+            "cooldown_seconds": round(max(0.0, self.cooldown_until - now), 1),
+            "in_flight": self.in_flight,
+        }
+
+
+_current: "contextvars.ContextVar[Optional[KeyLease]]" = contextvars.ContextVar("gemini_key_lease", default=None)
+
+
+class KeyLease:
+    """
+    One call's claim on a key. Used as a context manager it records the call's outcome
+    on exit and makes itself the target of record_usage() inside the block. A lease
+    released without an error or a recorded response (e.g. a response cache hit)
+    gives its request back.
+    """
+
+    def __init__(self, scheduler: "KeyScheduler", state: KeyState):
+        self.scheduler = scheduler
+        self.state = state
+        self.used = False
+        self._token = None
+
+    @property
+    def key(self) -> str:
+        return self.state.key
+
+    @property
+    def index(self) -> int:
+        return self.state.index
+
+    def charge(self, tokens: int) -> None:
+        self.used = True
+        self.scheduler._charge(self.state, tokens)
+
+    def release(self, error: Optional[BaseException] = None) -> None:
+        self.scheduler._release(self.state, self.used, error)
+
+    def __enter__(self) -> "KeyLease":
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        _current.reset(self._token)
+        self.release(exc)
+
+
+class KeyScheduler:
+    def __init__(
+        self,
+        keys: Sequence[str],
+        rpm: int = GEMINI_KEY_RPM,
+        tpm: int = GEMINI_KEY_TPM,
+        cooldown: float = GEMINI_KEY_COOLDOWN,
+        max_cooldown: float = GEMINI_KEY_MAX_COOLDOWN,
+    ):
+        self.keys = [KeyState(index, key, rpm, tpm) for index, key in enumerate(keys)]
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._lock = threading.Lock()
+
+    def try_acquire(self, exclude: Sequence[int] = ()) -> Tuple[Optional[KeyLease], float]:
+        """(lease on the healthiest ready key, 0) or (None, seconds until a key is ready; inf if none is left)."""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [state for state in self.keys if state.index not in exclude]
+            if not candidates:
+                return None, math.inf
+            ready = [state for state in candidates if state.ready_in(now) <= 0]
+            if not ready:
+                return None, min(state.ready_in(now) for state in candidates)
+            best = max(ready, key=lambda state: (state.score(now), -state.index))
+            if best.requests:
+                best.requests.take(1, now)
+            best.in_flight += 1
+        return KeyLease(self, best), 0.0
+
+    def acquire(self, exclude: Sequence[int] = (), max_wait: float = GEMINI_KEY_MAX_WAIT) -> Optional[KeyLease]:
+        """A lease, waiting up to max_wait seconds for a key to become ready; None if none does."""
+        deadline = time.monotonic() + max_wait
+        while True:
+            lease, wait = self.try_acquire(exclude)
+            if lease is not None or time.monotonic() + wait > deadline:
+                return lease
+            time.sleep(wait)
+
+    def _charge(self, state: KeyState, tokens: int) -> None:
+        if tokens <= 0:
+            return
+        KEY_TOKENS.inc(tokens, key=state.label)
+        if state.tokens:
+            with self._lock:
+                state.tokens.take(tokens, time.monotonic())
+
+    def _release(self, state: KeyState, used: bool, error: Optional[BaseException]) -> None:
+        now = time.monotonic()
+        outcome = "ok" if error is None else _classify(error)
+        with self._lock:
+            state.in_flight -= 1
+            if error is None and not used:
+                if state.requests:
+                    state.requests.give_back(1, now)
+                return
+            if outcome == "cancelled":
+                KEY_CALLS.inc(key=state.label, outcome=outcome)
+                return
+            state.error_rate += ERROR_RATE_ALPHA * ((outcome != "ok") - state.error_rate)
+            if outcome == "ok":
+                state.rate_limited_streak = 0
+            elif outcome == "rate_limited":
+                state.rate_limited_streak += 1
+                pause = min(self.max_cooldown, self.cooldown * 2 ** (state.rate_limited_streak - 1))
+                state.cooldown_until = max(state.cooldown_until, now + pause)
+            elif outcome == "invalid":
+                state.cooldown_until = now + self.max_cooldown
+        KEY_CALLS.inc(key=state.label, outcome=outcome)
+        if outcome in ("rate_limited", "invalid"):
+            print(f"[GEMINI KEYS] {state.label} {outcome}, resting {state.cooldown_until - now:.0f}s")
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            return [state.snapshot(now) for state in self.keys]
+
+    def utilization(self, budget: str) -> Dict[str, float]:
+        """Fraction of each key's requests or tokens budget in use, for /metrics."""
+        now = time.monotonic()
+        with self._lock:
+            values = {}
+            for state in self.keys:
+                bucket = state.requests if budget == "requests" else state.tokens
+                if bucket:
+                    values[state.label] = 1.0 - max(0.0, bucket.available(now)) / bucket.capacity
+            return values
+
+
+def response_tokens(response: Any) -> int:
+    usage = getattr(response, "usage_metadata", None)
+    return int(getattr(usage, "total_token_count", 0) or 0)
+
+
+def record_usage(response: Any) -> None:
+    """Charges the tokens a response reports to the key of the surrounding lease, if any."""
+    lease = _current.get()
+    if lease is not None:
+        lease.charge(response_tokens(response))
+
+
+scheduler = KeyScheduler(API_KEYS)
@@ -0,0 +1,190 @@
+"""
+Conditional and partial responses for stored bytes.
+
+Responses carry a strong ETag (the content's sha256) and Accept-Ranges. A matching
+If-None-Match gets a 304, and a single `Range: bytes=...` gets a 206, or a 416 if
+it cannot be satisfied. Multi-range requests get the whole body, which RFC 9110
+allows. Content-addressed URLs (carrying ?v=<sha256 prefix>) can be cached
+indefinitely; everything else must be revalidated.
+"""
+import hashlib
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+
+from .blobstore import BlobStore
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+# Length of the sha256 prefix used in ?v= cache-busting query strings
+VERSION_LENGTH = 16
+
+_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+    (b"%PDF-", "application/pdf"),
+]
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def sniff_media_type(head: bytes, default: str = "application/octet-stream") -> str:
+    """Media type from the leading magic bytes."""
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, media_type in _SIGNATURES:
+        if head.startswith(signature):
+            return media_type
+    return default
+
+
+def content_version(digest: Optional[str]) -> Optional[str]:
+    return digest[:VERSION_LENGTH] if digest else None
+
+
+def version_matches(request: Request, digest: str) -> bool:
+    version = request.query_params.get("v")
+    return bool(version) and digest.startswith(version)
+
+
+def etag_for(digest: str) -> str:
+    return f'"{digest}"'
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """If-None-Match comparison (weak, as RFC 9110 requires for this header)."""
+    if header.strip() == "*":
+        return True
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parses a single `bytes=` range into inclusive (start, end). Returns None when the
+    header should be ignored (other units, several ranges, malformed) and raises
+    RangeNotSatisfiable when it starts past the end.
+    """
+    if not header.startswith("bytes="):
+        return None
+    spec = header[len("bytes="):].strip()
+    if "," in spec:
+        return None
+    first, sep, last = spec.partition("-")
+    if not sep:
+        return None
+    try:
+        if first == "":
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length <= 0:
+                raise RangeNotSatisfiable(header)
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable(header)
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def cached_response(
+    request: Request,
+    *,
+    etag: str,
+    size: int,
+    read: Callable[[int, int], Iterator[bytes]],
+    media_type: str,
+    cache_control: str = REVALIDATE,
+    headers: Optional[Dict[str, str]] = None,
+) -> Response:
+    """read(start, end) yields the bytes start..end inclusive."""
+    base = {"ETag": etag, "Cache-Control": cache_control, "Accept-Ranges": "bytes"}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=base)
+
+    base.update(headers or {})
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    # If-Range: only honour the range when the client's copy is still current
+    if range_header and size > 0 and (not if_range or if_range.strip() == etag):
+        try:
+            byte_range = parse_range(range_header, size)
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={**base, "Content-Range": f"bytes */{size}"})
+        if byte_range:
+            start, end = byte_range
+            return StreamingResponse(
+                read(start, end),
+                status_code=206,
+                media_type=media_type,
+                headers={**base, "Content-Range": f"bytes {start}-{end}/{size}", "Content-Length": str(end - start + 1)},
+            )
+
+    return StreamingResponse(
+        read(0, size - 1) if size else iter(()),
+        media_type=media_type,
+        headers={**base, "Content-Length": str(size)},
+    )
+
+
+def blob_response(
+    request: Request,
+    store: BlobStore,
+    digest: str,
+    *,
+    size: Optional[int] = None,
+    media_type: Optional[str] = None,
+    headers: Optional[Dict[str, str]] = None,
+    immutable: Optional[bool] = None,
+) -> Response:
+    """
+    Serves a blob. Unless immutable is given, the response is immutable when the
+    request's ?v= names this content; media_type is sniffed when not given.
+    """
+    if immutable is None:
+        immutable = version_matches(request, digest)
+    return cached_response(
+        request,
+        etag=etag_for(digest),
+        size=size if size is not None else store.size(digest),
+        read=lambda start, end: store.iter_chunks(digest, start=start, end=end),
+        media_type=media_type or sniff_media_type(store.head(digest)),
+        cache_control=IMMUTABLE if immutable else REVALIDATE,
+        headers=headers,
+    )
+
+
+def bytes_response(
+    request: Request,
+    data: bytes,
+    *,
+    media_type: Optional[str] = None,
+    headers: Optional[Dict[str, str]] = None,
+) -> Response:
+    """Same as blob_response for bytes held in memory (rows not moved to the blob store)."""
+    return cached_response(
+        request,
+        etag=etag_for(hashlib.sha256(data).hexdigest()),
+        size=len(data),
+        read=lambda start, end: iter((data[start:end + 1],)),
+        media_type=media_type or sniff_media_type(data[:32]),
+        headers=headers,
+    )
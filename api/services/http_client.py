@@ -0,0 +1,149 @@
+"""
+Shared client for outbound HTTP calls (SerpAPI, YouTube, DuckDuckGo, Resend, image URLs).
+
+One requests.Session keeps connections alive per host, so repeated calls skip the
+TCP/TLS handshake. Every call gets the same default timeouts. Idempotent requests
+are retried with exponential backoff on connection errors and 429/5xx; POSTs are
+retried only when the connection could not be made, since the request never left.
+Callers with their own deadline pass retries=False for a single attempt.
+Concurrent calls to one host are capped so a slow upstream cannot tie up every
+worker thread, and each call is timed per host in outbound_http_request_seconds.
+Calls to a named dependency (circuit="serpapi") also go through its circuit breaker.
+"""
+import threading
+import time
+from typing import Dict, Optional, Set
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from ..core.config import (
+    HTTP_BACKOFF,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_MAX_PER_HOST,
+    HTTP_POOL_SIZE,
+    HTTP_READ_TIMEOUT,
+    HTTP_RETRIES,
+)
+from .breaker import circuit as circuit_breaker
+from .metrics import Gauge, Histogram, registry
+
+DEFAULT_TIMEOUT = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+# Hosts come from user input too (chat image URLs); past this many, they share one
+# metric label and one concurrency limit
+_MAX_HOSTS = 50
+
+OUTBOUND_SECONDS = registry.register(
+    Histogram("outbound_http_request_seconds", "Outbound HTTP request duration, retries included", ("host", "method", "status"))
+)
+OUTBOUND_IN_FLIGHT = registry.register(Gauge("outbound_http_in_flight", "Outbound HTTP requests in progress", ("host",)))
+
+
+class HostBusy(requests.exceptions.ConnectionError):
+    """Raised when a host already has HTTP_MAX_PER_HOST calls in flight for longer than the connect timeout."""
+
+
+def new_session(retries: int = HTTP_RETRIES) -> requests.Session:
+    """A session with the shared pooling and retry policy, for libraries that need their own."""
+    retry = Retry(
+        total=retries,
+        backoff_factor=HTTP_BACKOFF,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"GET", "HEAD", "OPTIONS"}),
+        # Return the last response instead of raising once retries run out; callers check status codes
+        raise_on_status=False,
+        # A long Retry-After would hold a request thread; back off on our own schedule instead
+        respect_retry_after_header=False,
+    )
+    adapter = HTTPAdapter(pool_connections=20, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+session = new_session()
+# One attempt and no backoff sleeps, so a call ends within the timeout it was given
+single_attempt_session = new_session(retries=0)
+
+_lock = threading.Lock()
+_host_limits: Dict[str, threading.BoundedSemaphore] = {}
+_other_hosts_limit = threading.BoundedSemaphore(HTTP_MAX_PER_HOST)
+_metric_hosts: Set[str] = set()
+
+
+def _host_limit(host: str) -> threading.BoundedSemaphore:
+    with _lock:
+        limit = _host_limits.get(host)
+        if limit is None:
+            if len(_host_limits) >= _MAX_HOSTS:
+                return _other_hosts_limit
+            limit = _host_limits[host] = threading.BoundedSemaphore(HTTP_MAX_PER_HOST)
+        return limit
+
+
+def _metric_host(host: str) -> str:
+    with _lock:
+        if host in _metric_hosts:
+            return host
+        if len(_metric_hosts) < _MAX_HOSTS:
+            _metric_hosts.add(host)
+            return host
+    return "other"
+
+
+def request(
+    method: str, url: str, *, timeout=None, circuit: Optional[str] = None, retries: bool = True, **kwargs
+) -> requests.Response:
+    """
+    requests.request() through the shared session, with the default timeout, retries and
+    per-host limit; with retries=False the call is made once. With circuit, raises
+    CircuitOpen while that dependency's breaker is open; errors, 429 and 5xx responses
+    count as its failures. HostBusy does not, since the call never reached the host.
+    """
+    breaker = circuit_breaker(circuit) if circuit else None
+    trial = breaker.acquire() if breaker else False
+    failed: Optional[bool] = True
+    try:
+        response = _send(method, url, timeout, retries, **kwargs)
+        failed = response.status_code == 429 or response.status_code >= 500
+        return response
+    except HostBusy:
+        failed = None
+        raise
+    finally:
+        if breaker:
+            breaker.record(failed, trial)
+
+
+def _send(method: str, url: str, timeout, retries: bool, **kwargs) -> requests.Response:
+    host = urlsplit(url).hostname or "unknown"
+    label = _metric_host(host)
+    limit = _host_limit(host)
+    if not limit.acquire(timeout=HTTP_CONNECT_TIMEOUT):
+        OUTBOUND_SECONDS.observe(0.0, host=label, method=method, status="busy")
+        raise HostBusy(f"{HTTP_MAX_PER_HOST} requests to {host} already in flight")
+
+    OUTBOUND_IN_FLIGHT.inc(host=label)
+    status = "error"
+    started = time.perf_counter()
+    try:
+        sender = session if retries else single_attempt_session
+        response = sender.request(method, url, timeout=timeout or DEFAULT_TIMEOUT, **kwargs)
+        status = str(response.status_code)
+        return response
+    finally:
+        OUTBOUND_SECONDS.observe(time.perf_counter() - started, host=label, method=method, status=status)
+        OUTBOUND_IN_FLIGHT.dec(host=label)
+        limit.release()
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
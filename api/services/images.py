@@ -0,0 +1,109 @@
+import io
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from ..core.config import IMAGE_VARIANT_FORMAT, IMAGE_VARIANT_QUALITY
+from ..db import SmartConn, pool
+from . import jobs
+from .blobstore import BlobStore, blob_store
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# Variant name -> maximum width in pixels, smallest first
+VARIANTS: Dict[str, int] = {
+    "thumb": 320,
+    "feed": 800,
+    "full": 1600,
+}
+
+_MEDIA_TYPES = {"WEBP": "image/webp", "JPEG": "image/jpeg"}
+
+
+def variant_for_width(width: int) -> str:
+    """Smallest variant at least `width` wide, or the largest one."""
+    for name, max_width in VARIANTS.items():
+        if width <= max_width:
+            return name
+    return list(VARIANTS)[-1]
+
+
+def render_variant(data: bytes, max_width: int, fmt: str = IMAGE_VARIANT_FORMAT, quality: int = IMAGE_VARIANT_QUALITY) -> Tuple[bytes, int, int]:
+    """Downscales (never upscales) to max_width and re-encodes. Returns (bytes, width, height)."""
+    with Image.open(io.BytesIO(data)) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.width > max_width:
+            height = max(1, round(img.height * max_width / img.width))
+            img = img.resize((max_width, height), Image.LANCZOS)
+        if fmt == "JPEG":
+            if img.mode in ("RGBA", "LA", "P"):
+                # JPEG has no alpha channel: flatten onto white
+                rgba = img.convert("RGBA")
+                background = Image.new("RGB", rgba.size, (255, 255, 255))
+                background.paste(rgba, mask=rgba.split()[-1])
+                img = background
+            elif img.mode != "RGB":
+                img = img.convert("RGB")
+        elif img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if img.mode in ("LA", "PA", "P") else "RGB")
+        options = {"quality": quality, "optimize": True, "progressive": True} if fmt == "JPEG" else {"quality": quality, "method": 4}
+        out = io.BytesIO()
+        img.save(out, fmt, **options)
+        return out.getvalue(), img.width, img.height
+
+
+def generate_variants(source_sha256: str, store: BlobStore = blob_store) -> List[str]:
+    """
+    Creates the missing variants of one stored image. Returns the names created.
+    Borrows a pooled connection to read and to write, not while Pillow renders. Two
+    runs for the same image (it is on two updates, or the backfill command overlaps
+    an upload's job) both render, and the later inserts are skipped.
+    """
+    if Image is None:
+        raise RuntimeError("Pillow is not installed")
+    with pool.connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT variant FROM image_variants WHERE source_sha256=?", (source_sha256,))
+        existing = {row[0] for row in c.fetchall()}
+    missing = [name for name in VARIANTS if name not in existing]
+    if not missing:
+        return []
+
+    data = store.read(source_sha256)
+    media_type = _MEDIA_TYPES.get(IMAGE_VARIANT_FORMAT, "image/webp")
+    rendered = []
+    for name in missing:
+        body, width, height = render_variant(data, VARIANTS[name])
+        rendered.append((name, store.put(body), width, height, len(body)))
+
+    created = []
+    with pool.connection() as conn:
+        c = conn.cursor()
+        for name, digest, width, height, size in rendered:
+            c.execute(
+                "INSERT INTO image_variants (source_sha256, variant, blob_sha256, media_type, width, height, size, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(source_sha256, variant) DO NOTHING",
+                (source_sha256, name, digest, media_type, width, height, size, datetime.now().isoformat()),
+            )
+            if c.rowcount == 1:
+                created.append(name)
+        conn.commit()
+    return created
+
+
+def find_variant(conn: SmartConn, source_sha256: str, width: int) -> Optional[Tuple[str, int, str]]:
+    """(blob_sha256, size, media_type) of the variant serving `width`, if it has been generated."""
+    c = conn.cursor()
+    c.execute(
+        "SELECT blob_sha256, size, media_type FROM image_variants WHERE source_sha256=? AND variant=?",
+        (source_sha256, variant_for_width(width)),
+    )
+    row = c.fetchone()
+    return (row[0], row[1], row[2]) if row else None
+
+
+@jobs.register("image_variants")
+def run_image_variants_job(params: dict) -> dict:
+    return {"created": generate_variants(params["sha256"])}
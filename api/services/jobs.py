@@ -0,0 +1,281 @@
+import json
+import queue
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from ..core.config import JOB_MAX_ATTEMPTS, JOB_STALE_AFTER, JOB_WORKERS
+from ..db import SmartConn, pool
+
+# kind -> handler(params) returning a JSON-serialisable result. Handlers borrow pooled
+# connections only around their reads and writes, never across a Gemini call.
+HANDLERS: Dict[str, Callable[[dict], Any]] = {}
+
+
+def register(kind: str):
+    """Decorator that makes a function runnable as a job of the given kind."""
+    def decorator(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return decorator
+
+
+def _now() -> str:
+    return datetime.now().isoformat()
+
+
+def _error_text(e: Exception) -> str:
+    # HTTPException raised by shared endpoint code carries its message in .detail
+    detail = getattr(e, "detail", None)
+    return str(detail) if detail else str(e) or e.__class__.__name__
+
+
+class IdempotencyConflict(ValueError):
+    """An idempotency key was reused for a job with different params."""
+
+
+def enqueue(conn: SmartConn, kind: str, params: dict, idempotency_key: Optional[str] = None) -> Tuple[int, bool]:
+    """
+    Records a job and hands it to the worker pool. Returns (job_id, created).
+
+    A repeated idempotency key returns the job it first created, provided the params
+    are the same; otherwise IdempotencyConflict is raised. Without a key, an
+    identical job (same kind and params) that is still queued or running is reused,
+    so a double-click does not enqueue twice.
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    params_json = json.dumps(params, sort_keys=True)
+    key = f"{kind}:{idempotency_key}" if idempotency_key else None
+
+    existing = _find_existing(conn, kind, params_json, key)
+    if existing is not None:
+        return existing, False
+
+    c = conn.cursor()
+    try:
+        c.execute(
+            "INSERT INTO jobs (kind, params, status, idempotency_key, attempts, created_at) VALUES (?, ?, 'queued', ?, 0, ?)",
+            (kind, params_json, key, _now()),
+        )
+        conn.commit()
+    except Exception:
+        # Another request inserted the same idempotency key first
+        conn.rollback()
+        existing = _find_existing(conn, kind, params_json, key)
+        if existing is None:
+            raise
+        return existing, False
+
+    job_id = c.lastrowid
+    job_queue.submit(job_id)
+    return job_id, True
+
+
+def _find_existing(conn: SmartConn, kind: str, params_json: str, key: Optional[str]) -> Optional[int]:
+    c = conn.cursor()
+    if key:
+        c.execute("SELECT id, params FROM jobs WHERE idempotency_key=?", (key,))
+        row = c.fetchone()
+        if row and row[1] != params_json:
+            # The key belongs to another request (e.g. another group's analysis); never hand out its job
+            raise IdempotencyConflict("Idempotency-Key was already used for a different request")
+        return row[0] if row else None
+    c.execute(
+        "SELECT id FROM jobs WHERE kind=? AND params=? AND status IN ('queued', 'running') ORDER BY id LIMIT 1",
+        (kind, params_json),
+    )
+    row = c.fetchone()
+    return row[0] if row else None
+
+
+def get_job(conn: SmartConn, job_id: int) -> Optional[dict]:
+    c = conn.cursor()
+    c.execute(
+        "SELECT id, kind, status, result, error, created_at, started_at, finished_at FROM jobs WHERE id=?",
+        (job_id,),
+    )
+    row = c.fetchone()
+    if not row:
+        return None
+    return {
+        "id": row[0],
+        "kind": row[1],
+        "status": row[2],
+        "result": json.loads(row[3]) if row[3] else None,
+        "error": row[4],
+        "created_at": row[5],
+        "started_at": row[6],
+        "finished_at": row[7],
+    }
+
+
+class JobQueue:
+    """
+    In-process worker threads fed from a queue of job ids.
+
+    The jobs table is the source of truth: a worker claims a job with a conditional
+    UPDATE (queued -> running), so the same id submitted twice, or by two processes
+    after a restart, only runs once. While a job runs, a sweeper thread refreshes its
+    heartbeat_at; the same thread re-queues jobs whose heartbeat went stale because
+    the process running them died.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, stale_after: float = JOB_STALE_AFTER):
+        self.workers = workers
+        self.stale_after = stale_after
+        self._queue: "queue.Queue[Optional[int]]" = queue.Queue()
+        self._threads: List[threading.Thread] = []
+        self._running: Set[int] = set()
+        self._running_lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def submit(self, job_id: int) -> None:
+        self._queue.put(job_id)
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        self._stopped.clear()
+        self.resume()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        sweeper = threading.Thread(target=self._sweeper, name="job-sweeper", daemon=True)
+        sweeper.start()
+        self._threads.append(sweeper)
+        print(f"[JOBS] Started {self.workers} worker(s)")
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stopped.set()
+        for _ in range(self.workers):
+            self._queue.put(None)
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def resume(self) -> None:
+        """Re-queues jobs left behind by a previous process."""
+        self.sweep()
+        with pool.connection() as conn:
+            c = conn.cursor()
+            c.execute("SELECT id FROM jobs WHERE status='queued' ORDER BY id")
+            pending = [row[0] for row in c.fetchall()]
+        for job_id in pending:
+            self.submit(job_id)
+        if pending:
+            print(f"[JOBS] Resumed {len(pending)} pending job(s)")
+
+    def sweep(self) -> List[int]:
+        """Re-queues running jobs whose heartbeat is older than stale_after and returns their ids."""
+        stale_before = (datetime.now() - timedelta(seconds=self.stale_after)).isoformat()
+        with pool.connection() as conn:
+            c = conn.cursor()
+            # A job that keeps dying mid-run (e.g. takes the process down) is given up on
+            c.execute(
+                "UPDATE jobs SET status='failed', error=?, finished_at=? "
+                "WHERE status='running' AND COALESCE(heartbeat_at, started_at) < ? AND attempts >= ?",
+                (f"Abandoned after {JOB_MAX_ATTEMPTS} attempts", _now(), stale_before, JOB_MAX_ATTEMPTS),
+            )
+            c.execute(
+                "SELECT id FROM jobs WHERE status='running' AND COALESCE(heartbeat_at, started_at) < ?",
+                (stale_before,),
+            )
+            requeued = []
+            for (job_id,) in c.fetchall():
+                # Conditional, so two processes sweeping at once re-queue a job only once
+                c.execute(
+                    "UPDATE jobs SET status='queued' WHERE id=? AND status='running' AND COALESCE(heartbeat_at, started_at) < ?",
+                    (job_id, stale_before),
+                )
+                if c.rowcount == 1:
+                    requeued.append(job_id)
+            conn.commit()
+        for job_id in requeued:
+            self.submit(job_id)
+        if requeued:
+            print(f"[JOBS] Re-queued {len(requeued)} orphaned job(s): {requeued}")
+        return requeued
+
+    def heartbeat(self) -> None:
+        """Marks the jobs this process is running as alive."""
+        with self._running_lock:
+            running = list(self._running)
+        if not running:
+            return
+        with pool.connection() as conn:
+            c = conn.cursor()
+            placeholders = ", ".join("?" for _ in running)
+            c.execute(
+                f"UPDATE jobs SET heartbeat_at=? WHERE status='running' AND id IN ({placeholders})",
+                (_now(), *running),
+            )
+            conn.commit()
+
+    def _sweeper(self) -> None:
+        while not self._stopped.wait(self.stale_after / 4):
+            try:
+                self.heartbeat()
+                self.sweep()
+            except Exception as e:
+                print(f"[JOBS] Heartbeat/sweep failed: {e}")
+
+    def _worker(self) -> None:
+        while True:
+            job_id = self._queue.get()
+            if job_id is None:
+                break
+            try:
+                self._run(job_id)
+            except Exception as e:
+                print(f"[JOBS] Job {job_id} could not be run: {e}")
+
+    def _claim(self, conn: SmartConn, job_id: int) -> Optional[Tuple[str, dict]]:
+        c = conn.cursor()
+        now = _now()
+        c.execute(
+            "UPDATE jobs SET status='running', started_at=?, heartbeat_at=?, attempts=attempts+1 WHERE id=? AND status='queued'",
+            (now, now, job_id),
+        )
+        if c.rowcount != 1:
+            conn.rollback()
+            return None
+        c.execute("SELECT kind, params FROM jobs WHERE id=?", (job_id,))
+        kind, params = c.fetchone()
+        conn.commit()
+        return kind, json.loads(params) if params else {}
+
+    def _run(self, job_id: int) -> None:
+        with pool.connection() as conn:
+            claimed = self._claim(conn, job_id)
+        if claimed is None:
+            return
+        kind, params = claimed
+        handler = HANDLERS.get(kind)
+        with self._running_lock:
+            self._running.add(job_id)
+        try:
+            if handler is None:
+                raise ValueError(f"No handler registered for job kind {kind!r}")
+            result = json.dumps(handler(params))
+        except Exception as e:
+            print(f"[JOBS] Job {job_id} ({kind}) failed: {_error_text(e)}")
+            self._finish(job_id, "failed", error=_error_text(e))
+            return
+        finally:
+            with self._running_lock:
+                self._running.discard(job_id)
+        self._finish(job_id, "done", result=result)
+
+    def _finish(self, job_id: int, status: str, result: Optional[str] = None, error: Optional[str] = None) -> None:
+        with pool.connection() as conn:
+            c = conn.cursor()
+            c.execute(
+                "UPDATE jobs SET status=?, result=?, error=?, finished_at=? WHERE id=?",
+                (status, result, error, _now(), job_id),
+            )
+            conn.commit()
+
+
+job_queue = JobQueue()
@@ -0,0 +1,252 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+
+MetricsMiddleware times every HTTP request by route template. DB and Gemini time
+are charged to the request that caused them through a RequestTimings object held
+in a contextvar; the object is mutable so threadpool workers (which run with a copy
+of the request's context) add to the same totals.
+"""
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric(ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        ...
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # label values -> [per-bucket counts..., sum, count]
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        lines = []
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {state[-2]!r}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {state[-1]}")
+        return lines
+
+
+class Callback(_Metric):
+    """Values read at scrape time, e.g. pool or cache stats: fn returns {label value: number}."""
+
+    def __init__(self, name: str, help_text: str, label: str, fn: Callable[[], Dict[str, float]], kind: str = "gauge"):
+        super().__init__(name, help_text, (label,))
+        self.kind = kind
+        self.fn = fn
+
+    def _samples(self) -> List[str]:
+        try:
+            values = self.fn()
+        except Exception as e:
+            print(f"[METRICS] {self.name} collector failed: {e}")
+            return []
+        return [f"{self.name}{_format_labels(self.labelnames, (k,))} {_format_value(v)}" for k, v in values.items()]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUESTS = registry.register(Counter("http_requests_total", "HTTP requests by route and status", ("method", "route", "status")))
+REQUEST_SECONDS = registry.register(Histogram("http_request_duration_seconds", "HTTP request latency, including streamed bodies", ("method", "route")))
+IN_PROGRESS = registry.register(Gauge("http_requests_in_progress", "HTTP requests currently being served", ("method",)))
+REQUEST_DB_SECONDS = registry.register(Histogram("http_request_db_seconds", "DB query time spent per request", ("route",)))
+REQUEST_GEMINI_SECONDS = registry.register(Histogram("http_request_gemini_seconds", "Gemini call time spent per request", ("route",)))
+DB_QUERIES = registry.register(Counter("db_queries_total", "SQL statements executed, by originating route", ("route",)))
+GEMINI_SECONDS = registry.register(Histogram("gemini_call_duration_seconds", "Duration of individual Gemini calls", ("mode",)))
+CHAT_TTFT_SECONDS = registry.register(Histogram("chat_stream_ttft_seconds", "Time to first streamed chat token", ("kind",)))
+
+
+class RequestTimings:
+    __slots__ = ("db_seconds", "db_queries", "gemini_seconds", "_lock")
+
+    def __init__(self):
+        self.db_seconds = 0.0
+        self.db_queries = 0
+        self.gemini_seconds = 0.0
+        # Analysis fans Gemini calls out to several threads that share this object
+        self._lock = threading.Lock()
+
+    def add_db(self, seconds: float) -> None:
+        with self._lock:
+            self.db_seconds += seconds
+            self.db_queries += 1
+
+    def add_gemini(self, seconds: float) -> None:
+        with self._lock:
+            self.gemini_seconds += seconds
+
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+def record_db_query(seconds: float) -> None:
+    timings = _current.get()
+    if timings is not None:
+        timings.add_db(seconds)
+
+
+@contextmanager
+def gemini_timer(mode: str = "generate") -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        GEMINI_SECONDS.observe(elapsed, mode=mode)
+        timings = _current.get()
+        if timings is not None:
+            timings.add_gemini(elapsed)
+
+
+def route_template(scope) -> str:
+    # Starlette stores the matched route in the scope; templates keep label cardinality bounded
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware so streamed responses are timed until their last byte."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = 500
+        timings = RequestTimings()
+        token = _current.set(timings)
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        IN_PROGRESS.inc(method=method)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            IN_PROGRESS.dec(method=method)
+            route = route_template(scope)
+            REQUESTS.inc(method=method, route=route, status=str(status))
+            REQUEST_SECONDS.observe(elapsed, method=method, route=route)
+            REQUEST_DB_SECONDS.observe(timings.db_seconds, route=route)
+            DB_QUERIES.inc(timings.db_queries, route=route)
+            if timings.gemini_seconds:
+                REQUEST_GEMINI_SECONDS.observe(timings.gemini_seconds, route=route)
+            _current.reset(token)
@@ -0,0 +1,29 @@
+from typing import List, Tuple
+
+from ..db import SmartConn
+
+
+def reconcile_vote_counts(conn: SmartConn) -> List[Tuple[int, int, int]]:
+    """
+    Rebuilds poll_options.vote_count from poll_votes wherever the two disagree.
+    Returns (option_id, stored, actual) for every option that was corrected.
+    """
+    c = conn.cursor()
+    c.execute(
+        """
+        SELECT o.id, COALESCE(o.vote_count, 0), COUNT(v.id)
+        FROM poll_options o
+        LEFT JOIN poll_votes v ON o.id = v.option_id
+        GROUP BY o.id, o.vote_count
+        HAVING COALESCE(o.vote_count, 0) <> COUNT(v.id)
+        """
+    )
+    drifted = [(row[0], row[1], row[2]) for row in c.fetchall()]
+    for option_id, _, actual in drifted:
+        # Recount inside the UPDATE so votes cast since the SELECT are included
+        c.execute(
+            "UPDATE poll_options SET vote_count = (SELECT COUNT(*) FROM poll_votes v WHERE v.option_id = ?) WHERE id=?",
+            (option_id, option_id),
+        )
+    conn.commit()
+    return drifted
@@ -0,0 +1,103 @@
+"""
+In-process publish/subscribe for live updates (e.g. poll vote counts).
+
+Publishers are request handlers running in the threadpool; subscribers are SSE
+generators on the event loop, each with its own bounded asyncio.Queue. publish()
+hands the event to every subscriber's loop and never blocks: when a slow client's
+queue is full its oldest event is dropped, so events should carry absolute state
+(the new count) rather than rely on every delta arriving.
+
+Only subscribers in the same process see an event; with several gunicorn workers
+a client connected to another worker misses it until its next full refresh.
+"""
+import asyncio
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from ..core.config import PUBSUB_QUEUE_SIZE
+from .metrics import Callback, Counter, registry
+
+DROPPED = registry.register(Counter("pubsub_dropped_events_total", "Events dropped for slow subscribers", ("topic_kind",)))
+
+
+def _topic_kind(topic: str) -> str:
+    return topic.split(":", 1)[0]
+
+
+class Subscription:
+    def __init__(self, broker: "Broker", topics: List[str], maxsize: int):
+        self.broker = broker
+        self.topics = topics
+        self.loop = asyncio.get_running_loop()
+        self.queue: "asyncio.Queue[Any]" = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def _offer(self, topic: str, event: Any) -> None:
+        # Runs on the subscriber's event loop
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+            DROPPED.inc(topic_kind=_topic_kind(topic))
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[Any]:
+        """Next event, or None if nothing arrived within timeout."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self) -> None:
+        self.broker.unsubscribe(self)
+
+
+class Broker:
+    def __init__(self, queue_size: int = PUBSUB_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._topics: Dict[str, Set[Subscription]] = {}
+
+    def subscribe(self, topics: Iterable[str]) -> Subscription:
+        """Must be called from the event loop that will consume the subscription."""
+        sub = Subscription(self, list(topics), self.queue_size)
+        with self._lock:
+            for topic in sub.topics:
+                self._topics.setdefault(topic, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            for topic in sub.topics:
+                subs = self._topics.get(topic)
+                if subs is None:
+                    continue
+                subs.discard(sub)
+                if not subs:
+                    del self._topics[topic]
+
+    def publish(self, topic: str, event: Any) -> int:
+        """Thread-safe; returns the number of subscribers the event was handed to."""
+        with self._lock:
+            subs = list(self._topics.get(topic, ()))
+        delivered = 0
+        for sub in subs:
+            try:
+                sub.loop.call_soon_threadsafe(sub._offer, topic, event)
+                delivered += 1
+            except RuntimeError:
+                # The subscriber's loop has shut down
+                self.unsubscribe(sub)
+        return delivered
+
+    def stats(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        with self._lock:
+            for topic, subs in self._topics.items():
+                kind = _topic_kind(topic)
+                counts[kind] = counts.get(kind, 0) + len(subs)
+        return counts
+
+
+broker = Broker()
+
+registry.register(Callback("pubsub_subscribers", "Live subscribers by topic kind", "topic_kind", broker.stats))
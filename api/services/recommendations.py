@@ -1,164 +1,264 @@
+"""
+YouTube and website recommendations.
+
+Results are cached by normalized query in the shared response_cache table
+(namespace "recommendations", TTL + LRU), so repeated topics skip the network.
+On a miss the backends are raced instead of tried one after another: the
+preferred one starts first, and each following one starts RECOMMENDATION_HEDGE_DELAY
+seconds later (or immediately once everything running has failed). The first
+non-empty result wins; after RECOMMENDATION_BUDGET seconds the caller gets the
+fallback instead of waiting for every timeout in turn. Each backend makes a single
+attempt with the budget left when it starts as its timeout, so a losing backend
+stops soon after the race instead of holding an executor thread through retries.
+"""
+import json
 import re
-from typing import List, Dict
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import unquote
 
-import requests
+from .gemini import analyze_report , generate_timetable , generate_roadmap , extract_topic , generate_quiz_json
+from . import http_client
+from .breaker import circuit
+from .cache import PersistentCache, SingleFlight, cache_key
+from .metrics import Counter, registry
+from ..core.config import (
+    RECOMMENDATION_BUDGET,
+    RECOMMENDATION_CACHE_MAX_ENTRIES,
+    RECOMMENDATION_CACHE_TTL,
+    RECOMMENDATION_HEDGE_DELAY,
+    SERP_API_KEY,
+)
 
-from .gemini import analyze_report , generate_timetable , generate_roadmap , extract_topic , generate_quiz_json 
-from ..core.config import SERP_API_KEY
+BROWSER_UA = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
 
+recommendation_cache = PersistentCache(
+    "recommendations",
+    ttl=RECOMMENDATION_CACHE_TTL,
+    max_entries=RECOMMENDATION_CACHE_MAX_ENTRIES,
+)
 
-def youtube_recommendations(search_keyword: str, min_duration_sec: int = 30) -> List[Dict[str, str]]:
-    q = search_keyword
-    
-    # 1. Try SerpAPI (Professional & Stable)
-    if SERP_API_KEY:
+BACKEND_RESULTS = registry.register(
+    Counter("recommendation_backend_results_total", "Recommendation backend outcomes", ("backend", "outcome"))
+)
+
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="recs")
+_flight = SingleFlight()
+
+# (name, fn(query, timeout))
+Backend = Tuple[str, Callable[[str, float], list]]
+
+
+def normalize_query(q: str) -> str:
+    """Case, punctuation and spacing don't change the results, so they don't change the cache key."""
+    return " ".join(re.findall(r"\w+", q.lower()))
+
+
+# --- YouTube backends ---
+
+def _serpapi_youtube(q: str, timeout: float) -> List[Dict[str, str]]:
+    params = {"engine": "youtube", "search_query": q, "api_key": SERP_API_KEY}
+    response = http_client.get(
+        "https://serpapi.com/search", params=params, circuit="serpapi", timeout=timeout, retries=False
+    )
+    response.raise_for_status()
+    data = response.json()
+    # Check for alternative key if video_results is empty
+    results = data.get("video_results", []) or data.get("results", [])
+    videos = []
+    for v in results:
+        v_id = v.get("video_id") or v.get("id")
+        v_title = v.get("title")
+        if v_id and v_title:
+            videos.append({"id": v_id, "title": v_title})
+    return videos[:10]
+
+
+def _serpapi_google_videos(q: str, timeout: float) -> List[Dict[str, str]]:
+    # Google Video search, often more reliable than the youtube engine
+    params = {"engine": "google", "q": q, "tbm": "vid", "api_key": SERP_API_KEY}
+    response = http_client.get(
+        "https://serpapi.com/search", params=params, circuit="serpapi", timeout=timeout, retries=False
+    )
+    response.raise_for_status()
+    data = response.json()
+    results = data.get("video_results", []) or data.get("organic_results", [])
+    videos = []
+    for v in results:
+        # Parse YouTube links from Google search results
+        link = v.get("link", "")
+        if "youtube.com/watch?v=" in link:
+            v_id = link.split("v=")[1].split("&")[0]
+            v_title = v.get("title")
+            if v_id and v_title:
+                videos.append({"id": v_id, "title": v_title})
+    return videos[:10]
+
+
+def _scrape_youtube(q: str, timeout: float) -> List[Dict[str, str]]:
+    # Fails on some cloud tiers like Hugging Face
+    url = f"https://www.youtube.com/results?search_query={q.replace(' ', '+')}"
+    html = http_client.get(url, headers={"User-Agent": BROWSER_UA}, circuit="youtube", timeout=timeout, retries=False).text
+
+    videos = []
+    match = re.search(r"ytInitialData = (\{.*?\});", html)
+    if match:
         try:
-            print(f"[DEBUG] Fetching YouTube results via SerpAPI for: {q}")
-            params = {
-                "engine": "youtube",
-                "search_query": q,
-                "api_key": SERP_API_KEY
-            }
-            response = requests.get("https://serpapi.com/search", params=params, timeout=10)
-            if response.status_code == 200:
-                data = response.json()
-                results = data.get("video_results", [])
-                
-                # Check for alternative key if video_results is empty
-                if not results:
-                    results = data.get("results", [])
-                
-                videos = []
-                for v in results:
-                    v_id = v.get("video_id") or v.get("id")
-                    v_title = v.get("title")
-                    if v_id and v_title:
-                        videos.append({"id": v_id, "title": v_title})
-                
-                if videos:
-                    print(f"[SUCCESS] Found {len(videos)} YouTube videos via SerpAPI (youtube engine)")
-                    return videos[:10]
-                else:
-                    print(f"[WARNING] SerpAPI YouTube engine returned no results. Keys present: {list(data.keys())}")
-                    # Try Fallback: Google Video search (Often more reliable)
-                    print(f"[DEBUG] Attempting Fallback: Google Video engine for: {q}")
-                    params["engine"] = "google"
-                    params["q"] = q
-                    params["tbm"] = "vid"
-                    # Remove search_query if switching to google engine
-                    params.pop("search_query", None)
-                    
-                    fb_res = requests.get("https://serpapi.com/search", params=params, timeout=10)
-                    if fb_res.status_code == 200:
-                        fb_data = fb_res.json()
-                        fb_results = fb_data.get("video_results", [])
-                        if not fb_results: fb_results = fb_data.get("organic_results", [])
-                        
-                        for v in fb_results:
-                            # Parse YouTube links from Google search results
-                            link = v.get("link", "")
-                            if "youtube.com/watch?v=" in link:
-                                v_id = link.split("v=")[1].split("&")[0]
-                                v_title = v.get("title")
-                                if v_id and v_title:
-                                    videos.append({"id": v_id, "title": v_title})
-                        
-                        if videos:
-                            print(f"[SUCCESS] Found {len(videos)} YouTube videos via SerpAPI (google fallback)")
-                            return videos[:10]
-                    else:
-                        print(f"[ERROR] SerpAPI Google Videos fallback failed: {fb_res.text}")
-            else:
-                print(f"[ERROR] SerpAPI YouTube failed with status {response.status_code}: {response.text}")
-        except Exception as e:
-            print(f"SerpAPI YouTube error: {e}")
-
-    # 2. Fallback to Scraping (Fails on some cloud tiers like Hugging Face)
-    try:
-        q_clean = q.replace(" ", "+")
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-        }
-        url = f"https://www.youtube.com/results?search_query={q_clean}"
-        response = requests.get(url, timeout=10, headers=headers)
-        html = response.text
-        
-        import json
-        pattern = r"ytInitialData = (\{.*?\});"
-        match = re.search(pattern, html)
-        
-        videos = []
-        if match:
-            try:
-                data = json.loads(match.group(1))
-                contents = data.get("contents", {}).get("twoColumnSearchResultsRenderer", {}).get("primaryContents", {}).get("sectionListRenderer", {}).get("contents", [])
-                for item in contents:
-                    video_list = item.get("itemSectionRenderer", {}).get("contents", [])
-                    for entry in video_list:
-                        video_data = entry.get("videoRenderer")
-                        if video_data:
-                            v_id = video_data.get("videoId")
-                            title_runs = video_data.get("title", {}).get("runs", [])
-                            v_title = title_runs[0].get("text", "") if title_runs else ""
-                            if v_id and v_title:
-                                videos.append({"id": v_id, "title": v_title})
-                if videos: return videos[:10]
-            except Exception: pass
-        
-        if not videos:
-            video_ids = re.findall(r"watch\?v=(\S{11})", html)[:20]
-            seen = set()
-            for vid in video_ids:
-                if vid not in seen:
-                    seen.add(vid)
-                    videos.append({"id": vid, "title": f"Video {vid}"})
-        return videos[:10]
-    except Exception as e:
-        print(f"YouTube scraping fallback error: {e}")
+            data = json.loads(match.group(1))
+            contents = data.get("contents", {}).get("twoColumnSearchResultsRenderer", {}).get("primaryContents", {}).get("sectionListRenderer", {}).get("contents", [])
+            for item in contents:
+                for entry in item.get("itemSectionRenderer", {}).get("contents", []):
+                    video_data = entry.get("videoRenderer")
+                    if video_data:
+                        v_id = video_data.get("videoId")
+                        title_runs = video_data.get("title", {}).get("runs", [])
+                        v_title = title_runs[0].get("text", "") if title_runs else ""
+                        if v_id and v_title:
+                            videos.append({"id": v_id, "title": v_title})
+            if videos:
+                return videos[:10]
+        except Exception:
+            pass
+
+    seen = set()
+    for vid in re.findall(r"watch\?v=(\S{11})", html)[:20]:
+        if vid not in seen:
+            seen.add(vid)
+            videos.append({"id": vid, "title": f"Video {vid}"})
+    return videos[:10]
+
+
+# --- Website backends ---
+
+def _serpapi_web(q: str, timeout: float) -> List[str]:
+    params = {"engine": "google", "q": q, "api_key": SERP_API_KEY}
+    response = http_client.get(
+        "https://serpapi.com/search", params=params, circuit="serpapi", timeout=timeout, retries=False
+    )
+    response.raise_for_status()
+    results = response.json().get("organic_results", [])
+    return [r.get("link") for r in results if r.get("link")][:8]
+
+
+def _duckduckgo(q: str, timeout: float) -> List[str]:
+    headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"}
+    html = http_client.get(
+        f"https://duckduckgo.com/html/?q={q.replace(' ', '+')}", headers=headers, timeout=timeout, retries=False
+    ).text
+    urls: List[str] = []
+    for match in re.findall(r'href="([^"]*)" class="result__url"', html):
+        url = unquote(match)
+        if url.startswith(("http://", "https://")) and "duckduckgo.com" not in url and url not in urls:
+            urls.append(url)
+    return urls[:8]
+
+
+def educational_links(query: str) -> List[str]:
+    return [
+        "https://www.coursera.org/search?query=" + query.replace(" ", "%20"),
+        "https://www.edx.org/search?q=" + query.replace(" ", "+"),
+        "https://www.khanacademy.org/search?page_search_query=" + query.replace(" ", "+"),
+    ]
+
+
+def _serpapi_available() -> bool:
+    # While its breaker is open SerpAPI is left out of the race rather than failing in it
+    return bool(SERP_API_KEY) and not circuit("serpapi").is_open()
+
+
+def youtube_backends() -> List[Backend]:
+    backends: List[Backend] = []
+    if _serpapi_available():
+        backends += [("serpapi_youtube", _serpapi_youtube), ("serpapi_google_videos", _serpapi_google_videos)]
+    return backends + [("youtube_scrape", _scrape_youtube)]
+
+
+def website_backends() -> List[Backend]:
+    backends: List[Backend] = []
+    if _serpapi_available():
+        backends.append(("serpapi_web", _serpapi_web))
+    return backends + [("duckduckgo", _duckduckgo)]
+
+
+# --- Racing and caching ---
+
+def _call(fn: Callable[[str, float], list], q: str, deadline: float) -> list:
+    # Measured when the backend starts, not when it was queued behind a busy executor
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
         return []
+    return fn(q, remaining)
+
+
+def race(
+    backends: Sequence[Backend],
+    q: str,
+    budget: float = RECOMMENDATION_BUDGET,
+    hedge_delay: float = RECOMMENDATION_HEDGE_DELAY,
+) -> Tuple[Optional[str], list]:
+    """
+    (backend name, result) of the first backend to return a non-empty result within
+    budget seconds, or (None, []). Each backend is called with the budget left when it
+    starts as its timeout; those still running afterwards finish in the background
+    and their results are dropped.
+    """
+    started = time.monotonic()
+    deadline = started + budget
+    pending: Dict[Future, str] = {}
+    launched = 0
+    next_launch = started
+    while True:
+        now = time.monotonic()
+        while launched < len(backends) and (now >= next_launch or not pending):
+            name, fn = backends[launched]
+            pending[_executor.submit(_call, fn, q, deadline)] = name
+            launched += 1
+            next_launch = now + hedge_delay
+        if not pending or now >= deadline:
+            for name in pending.values():
+                BACKEND_RESULTS.inc(backend=name, outcome="abandoned")
+            return None, []
+        wake = min(deadline, next_launch) if launched < len(backends) else deadline
+        done, _ = wait(list(pending), timeout=max(0.0, wake - now), return_when=FIRST_COMPLETED)
+        for future in done:
+            name = pending.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"[RECS] {name} failed for '{q}': {e}")
+                BACKEND_RESULTS.inc(backend=name, outcome="error")
+                continue
+            if result:
+                BACKEND_RESULTS.inc(backend=name, outcome="won")
+                for other in pending.values():
+                    BACKEND_RESULTS.inc(backend=other, outcome="abandoned")
+                print(f"[RECS] {name} answered '{q}' in {time.monotonic() - started:.2f}s")
+                return name, result
+            BACKEND_RESULTS.inc(backend=name, outcome="empty")
+
+
+def cached_recommendations(kind: str, query: str, backends: Sequence[Backend]) -> list:
+    """Cached result for (kind, normalized query), racing the backends on a miss. Empty results are not cached."""
+    key = cache_key(kind, normalize_query(query))
+    cached = recommendation_cache.get(key)
+    if cached is not None:
+        return json.loads(cached)
+
+    def fetch() -> list:
+        _, result = race(backends, query)
+        if result:
+            recommendation_cache.set(key, json.dumps(result))
+        return result
+
+    result, _ = _flight.do(key, fetch)
+    return result
+
+
+def youtube_recommendations(search_keyword: str, min_duration_sec: int = 30) -> List[Dict[str, str]]:
+    return cached_recommendations("youtube", search_keyword, youtube_backends())
 
 
 def website_recommendations(query: str) -> List[str]:
-    # 1. Try SerpAPI (Reliable)
-    if SERP_API_KEY:
-        try:
-            print(f"[DEBUG] Fetching Web results via SerpAPI for: {query}")
-            params = {
-                "engine": "google",
-                "q": query,
-                "api_key": SERP_API_KEY
-            }
-            response = requests.get("https://serpapi.com/search", params=params, timeout=10)
-            if response.status_code == 200:
-                results = response.json().get("organic_results", [])
-                urls = [r.get("link") for r in results if r.get("link")]
-                if urls:
-                    return urls[:8]
-        except Exception as e:
-            print(f"SerpAPI Web error: {e}")
-
-    # 2. Try Scraping Approach (Fallback)
-    urls = []
-    
-    # Method 1: DuckDuckGo HTML scrape
-    try:
-        q = query.replace(" ", "+")
-        headers = { "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36" }
-        response = requests.get(f"https://duckduckgo.com/html/?q={q}", timeout=10, headers=headers)
-        html = response.text
-        matches = re.findall(r'href="([^"]*)" class="result__url"', html)
-        for match in matches:
-            url = requests.utils.unquote(match)
-            if url.startswith(('http://', 'https://')) and 'duckduckgo.com' not in url:
-                if url not in urls: urls.append(url)
-    except Exception: pass
-    
-    # Method 2: Fallback to Educational links
-    if not urls:
-        urls = [
-            "https://www.coursera.org/search?query=" + query.replace(" ", "%20"),
-            "https://www.edx.org/search?q=" + query.replace(" ", "+"),
-            "https://www.khanacademy.org/search?page_search_query=" + query.replace(" ", "+")
-        ]
-    
-    return urls[:8]
+    # Fallback to educational search links when every backend comes back empty
+    return cached_recommendations("web", query, website_backends()) or educational_links(query)
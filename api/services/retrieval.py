@@ -0,0 +1,199 @@
+"""
+Per-group retrieval over uploaded study files.
+
+When a file's text is known (on upload for text files, after extraction for PDFs)
+it is split into overlapping word windows and stored in file_chunks. Chat and quiz
+prompts then include only the top-k chunks ranked by BM25 against the question or
+quiz subject instead of every file in the group.
+
+The BM25 statistics are built in memory from file_chunks on first use and cached
+per group until the group's chunks change, so no search service is needed and
+the same code runs on SQLite and PostgreSQL.
+"""
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from ..core.config import RETRIEVAL_CHUNK_OVERLAP, RETRIEVAL_CHUNK_WORDS, RETRIEVAL_INDEX_CACHE_GROUPS
+from ..db import SmartConn
+from .extraction import decode_text
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+# Short, high-frequency English words that only add noise to BM25 scores
+STOPWORDS = frozenset(
+    "a an and are as at be but by can do does for from had has have how i if in into is it its "
+    "me my no not of on or our so that the their them then there these they this to was we were "
+    "what when where which who why will with you your".split()
+)
+
+K1 = 1.5
+B = 0.75
+
+
+class Chunk(NamedTuple):
+    file_id: int
+    file_name: str
+    chunk_index: int
+    content: str
+    score: float
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN.findall(text.lower()) if t not in STOPWORDS]
+
+
+def chunk_text(text: str, words: int = RETRIEVAL_CHUNK_WORDS, overlap: int = RETRIEVAL_CHUNK_OVERLAP) -> List[str]:
+    """Overlapping windows of `words` words, so a passage split at a boundary still appears whole once."""
+    tokens = text.split()
+    if not tokens:
+        return []
+    step = max(1, words - overlap)
+    chunks = []
+    for start in range(0, len(tokens), step):
+        chunks.append(" ".join(tokens[start:start + words]))
+        if start + words >= len(tokens):
+            break
+    return chunks
+
+
+def index_file(conn: SmartConn, file_id: int, group_id: Optional[int], text: Optional[str]) -> int:
+    """(Re)writes the chunks of one file. The caller commits. Returns the number of chunks."""
+    c = conn.cursor()
+    c.execute("DELETE FROM file_chunks WHERE file_id=?", (file_id,))
+    chunks = chunk_text(text or "")
+    created_at = datetime.now().isoformat()
+    for index, content in enumerate(chunks):
+        c.execute(
+            "INSERT INTO file_chunks (file_id, group_id, chunk_index, content, created_at) VALUES (?, ?, ?, ?, ?)",
+            (file_id, group_id, index, content, created_at),
+        )
+    return len(chunks)
+
+
+def delete_file_chunks(conn: SmartConn, file_id: int) -> None:
+    conn.cursor().execute("DELETE FROM file_chunks WHERE file_id=?", (file_id,))
+
+
+def ensure_group_index(conn: SmartConn, group_id: int) -> int:
+    """Chunks files uploaded before the index existed. Returns the number of files indexed."""
+    c = conn.cursor()
+    c.execute(
+        "SELECT id, COALESCE(extracted_text, file_content) FROM files f "
+        "WHERE group_id=? AND COALESCE(extracted_text, file_content) IS NOT NULL "
+        "AND NOT EXISTS (SELECT 1 FROM file_chunks k WHERE k.file_id = f.id)",
+        (group_id,),
+    )
+    rows = c.fetchall()
+    indexed = 0
+    for file_id, content in rows:
+        if not isinstance(content, str):
+            content = decode_text(bytes(content))
+        if index_file(conn, file_id, group_id, content):
+            indexed += 1
+    if rows:
+        conn.commit()
+    return indexed
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed list of chunks."""
+
+    def __init__(self, chunks: List[Tuple[int, str, int, str]]):
+        # chunks: (file_id, file_name, chunk_index, content)
+        self.chunks = chunks
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.lengths: List[int] = []
+        for position, (_, _, _, content) in enumerate(chunks):
+            terms = tokenize(content)
+            self.lengths.append(len(terms))
+            for term, tf in Counter(terms).items():
+                self.postings.setdefault(term, []).append((position, tf))
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+
+    def idf(self, term: str) -> float:
+        df = len(self.postings.get(term, ()))
+        n = len(self.chunks)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, k: int) -> List[Chunk]:
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf(term)
+            for position, tf in postings:
+                norm = K1 * (1 - B + B * self.lengths[position] / (self.avg_length or 1))
+                scores[position] = scores.get(position, 0.0) + idf * tf * (K1 + 1) / (tf + norm)
+        best = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+        return [Chunk(*self.chunks[position], score) for position, score in best]
+
+
+_cache: "OrderedDict[int, Tuple[tuple, BM25Index]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def group_index(conn: SmartConn, group_id: int) -> BM25Index:
+    """The group's BM25 index, rebuilt only when its chunks have changed."""
+    ensure_group_index(conn, group_id)
+    c = conn.cursor()
+    c.execute("SELECT COUNT(*), MAX(id) FROM file_chunks WHERE group_id=?", (group_id,))
+    version = tuple(c.fetchone())
+    with _cache_lock:
+        cached = _cache.get(group_id)
+        if cached and cached[0] == version:
+            _cache.move_to_end(group_id)
+            return cached[1]
+
+    c.execute(
+        "SELECT k.file_id, f.file_name, k.chunk_index, k.content FROM file_chunks k "
+        "JOIN files f ON f.id = k.file_id WHERE k.group_id=? ORDER BY k.file_id, k.chunk_index",
+        (group_id,),
+    )
+    index = BM25Index([tuple(row) for row in c.fetchall()])
+    with _cache_lock:
+        _cache[group_id] = (version, index)
+        _cache.move_to_end(group_id)
+        while len(_cache) > RETRIEVAL_INDEX_CACHE_GROUPS:
+            _cache.popitem(last=False)
+    return index
+
+
+def search_group(conn: SmartConn, group_id: int, query: str, k: int, fill: bool = False) -> List[Chunk]:
+    """
+    Top-k chunks of the group's files for `query`, best first. With fill, chunks in
+    file order make up the difference when fewer than k match (a quiz still needs material).
+    """
+    index = group_index(conn, group_id)
+    results = index.search(query, k)
+    if fill and len(results) < k:
+        seen = {(r.file_id, r.chunk_index) for r in results}
+        for chunk in index.chunks:
+            if len(results) >= k:
+                break
+            if (chunk[0], chunk[2]) not in seen:
+                results.append(Chunk(*chunk, 0.0))
+    return results
+
+
+def relevant_passages(text: str, query: str, k: int) -> str:
+    """
+    The k windows of `text` that best match `query`, in their original order. Text
+    short enough to fit in k windows is returned unchanged.
+    """
+    windows = chunk_text(text)
+    if len(windows) <= k:
+        return text
+    index = BM25Index([(0, "", position, window) for position, window in enumerate(windows)])
+    best = index.search(query, k)
+    if not best:
+        return "\n…\n".join(windows[:k])
+    return "\n…\n".join(windows[i] for i in sorted(chunk.chunk_index for chunk in best))
+
+
+def render_chunks(chunks: List[Chunk]) -> str:
+    return "\n\n".join(f"[{chunk.file_name}, part {chunk.chunk_index + 1}]\n{chunk.content}" for chunk in chunks)
@@ -0,0 +1,182 @@
+"""
+Full-text search over uploaded files, text chat history and course updates.
+
+Searchable text is copied into search_documents, one row per (kind, ref_id), by
+write hooks next to the inserts that create it. On SQLite an external-content FTS5
+table (search_fts) is kept in sync with it by triggers; on PostgreSQL the table has
+a generated tsvector column with a GIN index. Queries are ranked with bm25() /
+ts_rank_cd() and return a highlighted snippet.
+"""
+import re
+from datetime import datetime
+from typing import List, Optional, Sequence
+
+from ..core.config import SEARCH_MAX_BODY_CHARS
+from ..db import SmartConn
+from ..schemas import SearchResult
+
+KINDS = ("file", "chat", "update")
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def index_document(
+    conn: SmartConn,
+    kind: str,
+    ref_id: int,
+    body: Optional[str],
+    *,
+    title: Optional[str] = None,
+    user_id: Optional[int] = None,
+    group_id: Optional[int] = None,
+    course_id: Optional[str] = None,
+    session_id: Optional[str] = None,
+) -> None:
+    """Adds or replaces the searchable copy of one row. The caller commits."""
+    c = conn.cursor()
+    c.execute("DELETE FROM search_documents WHERE kind=? AND ref_id=?", (kind, ref_id))
+    if not body and not title:
+        return
+    c.execute(
+        "INSERT INTO search_documents (kind, ref_id, user_id, group_id, course_id, session_id, title, body, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (kind, ref_id, user_id, group_id, course_id, session_id, title, (body or "")[:SEARCH_MAX_BODY_CHARS], datetime.now().isoformat()),
+    )
+
+
+def remove_document(conn: SmartConn, kind: str, ref_id: int) -> None:
+    conn.cursor().execute("DELETE FROM search_documents WHERE kind=? AND ref_id=?", (kind, ref_id))
+
+
+def _text(value) -> Optional[str]:
+    if value is None or isinstance(value, str):
+        return value
+    data = bytes(value)
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        return None  # a binary original (e.g. a legacy PDF row), nothing searchable
+
+
+def backfill(c, is_postgres: bool) -> int:
+    """Copies every existing file, text chat message and update into search_documents."""
+    insert = (
+        "INSERT INTO search_documents (kind, ref_id, user_id, group_id, course_id, session_id, title, body, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+    )
+    now = datetime.now().isoformat()
+    rows = []
+    c.execute(
+        "SELECT id, group_id, course_id, file_name, COALESCE(extracted_text, file_content) FROM files "
+        "WHERE COALESCE(extracted_text, file_content) IS NOT NULL"
+    )
+    for file_id, group_id, course_id, file_name, content in c.fetchall():
+        text = _text(content)
+        if text:
+            rows.append(("file", file_id, None, group_id, course_id, None, file_name, text[:SEARCH_MAX_BODY_CHARS], now))
+    c.execute("SELECT id, user_id, group_id, session_id, message FROM chat_history WHERE message IS NOT NULL")
+    for row_id, user_id, group_id, session_id, message in c.fetchall():
+        rows.append(("chat", row_id, user_id, group_id, None, session_id, None, message[:SEARCH_MAX_BODY_CHARS], now))
+    c.execute("SELECT id, course_id, content FROM updates WHERE content IS NOT NULL")
+    for row_id, course_id, content in c.fetchall():
+        rows.append(("update", row_id, None, None, course_id, None, None, content, now))
+    for row in rows:
+        c.execute(insert, row)
+    return len(rows)
+
+
+def reindex(conn: SmartConn) -> int:
+    """Rebuilds search_documents (and the SQLite FTS index) from the source tables."""
+    c = conn.cursor()
+    c.execute("DELETE FROM search_documents")
+    count = backfill(c, conn.is_postgres)
+    if not conn.is_postgres:
+        c.execute("INSERT INTO search_fts(search_fts) VALUES ('optimize')")
+    conn.commit()
+    return count
+
+
+def fts5_query(q: str) -> str:
+    """
+    Turns free text into an FTS5 query: every word must match, the last one as a
+    prefix (search-as-you-type). Words are quoted so operators and punctuation in
+    user input cannot cause syntax errors.
+    """
+    words = _WORD.findall(q)
+    if not words:
+        return ""
+    terms = [f'"{w}"' for w in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+def search(
+    conn: SmartConn,
+    q: str,
+    user_id: int,
+    group_id: Optional[int] = None,
+    kinds: Sequence[str] = KINDS,
+    limit: int = 20,
+) -> List[SearchResult]:
+    """
+    Best matches visible to a student: their own chat messages, files in their
+    groups, and files and updates of their course. group_id narrows to one group.
+    """
+    c = conn.cursor()
+    c.execute("SELECT course_id FROM users WHERE id=?", (user_id,))
+    row = c.fetchone()
+    course_id = row[0] if row else None
+
+    scope = (
+        "((d.kind='chat' AND d.user_id=?) "
+        "OR (d.kind='file' AND d.group_id IN (SELECT id FROM file_groups WHERE user_id=?)) "
+        "OR (d.course_id IS NOT NULL AND d.course_id=?))"
+    )
+    params: list = [user_id, user_id, course_id]
+    if group_id is not None:
+        scope += " AND d.group_id=?"
+        params.append(group_id)
+    scope += f" AND d.kind IN ({', '.join('?' for _ in kinds)})"
+    params.extend(kinds)
+
+    if conn.is_postgres:
+        c.execute(
+            f"""
+            SELECT kind, ref_id, title, ts_headline('english', COALESCE(body, ''), query,
+                       'StartSel=<mark>, StopSel=</mark>, MaxFragments=1, MaxWords=24, MinWords=8'),
+                   score, group_id, course_id, session_id, created_at
+            FROM (
+                SELECT d.*, query, ts_rank_cd(d.document, query) AS score
+                FROM search_documents d, websearch_to_tsquery('english', ?) query
+                WHERE d.document @@ query AND {scope}
+                ORDER BY score DESC
+                LIMIT ?
+            ) ranked
+            ORDER BY score DESC
+            """,
+            [q, *params, limit],
+        )
+    else:
+        match = fts5_query(q)
+        if not match:
+            return []
+        # bm25() is lower-is-better; titles (file names) weigh twice as much as body text
+        c.execute(
+            f"""
+            SELECT d.kind, d.ref_id, d.title, snippet(search_fts, 1, '<mark>', '</mark>', '…', 16),
+                   -bm25(search_fts, 2.0, 1.0) AS score, d.group_id, d.course_id, d.session_id, d.created_at
+            FROM search_fts
+            JOIN search_documents d ON d.id = search_fts.rowid
+            WHERE search_fts MATCH ? AND {scope}
+            ORDER BY score DESC
+            LIMIT ?
+            """,
+            [match, *params, limit],
+        )
+    return [
+        SearchResult(
+            kind=r[0], id=r[1], title=r[2], snippet=r[3] or "", score=float(r[4]),
+            group_id=r[5], course_id=r[6], session_id=r[7], created_at=r[8],
+        )
+        for r in c.fetchall()
+    ]
@@ -0,0 +1,246 @@
+"""
+YouTube transcripts and titles for video chat, cached in video_transcripts.
+
+A video's transcript segments and title are fetched once and reused for
+YOUTUBE_TRANSCRIPT_TTL. Videos without a usable transcript (captions disabled,
+none in the requested language, video removed) are cached as "unavailable" for
+YOUTUBE_UNAVAILABLE_TTL so follow-up questions don't retry. Transient failures
+(network errors, YouTube blocking the server) are not cached; they count against
+the "youtube" circuit breaker, and while it is open an expired transcript is served
+if there is one. Concurrent misses for the same video in one process share a single fetch.
+
+Prompts don't get the whole transcript: it is cut into overlapping windows of
+VIDEO_WINDOW_SECONDS and only the windows most relevant to the question (BM25)
+are sent, labelled with their timestamps so answers can cite them.
+"""
+import json
+import re
+import time
+from typing import List, NamedTuple, Optional
+
+from ..core.config import (
+    VIDEO_WINDOW_OVERLAP,
+    VIDEO_WINDOW_SECONDS,
+    YOUTUBE_TRANSCRIPT_LANGUAGES,
+    YOUTUBE_TRANSCRIPT_TTL,
+    YOUTUBE_UNAVAILABLE_TTL,
+)
+from ..db import pool
+from . import http_client
+from .breaker import circuit
+from .cache import SingleFlight
+from .metrics import Counter, registry
+from .retrieval import BM25Index
+
+try:
+    import youtube_transcript_api as _yta
+    from youtube_transcript_api import YouTubeTranscriptApi
+except ImportError:
+    _yta = None
+    YouTubeTranscriptApi = None
+
+# Exceptions that mean "this video has no transcript for us", as opposed to a failed request
+_UNAVAILABLE = tuple(
+    getattr(_yta, name)
+    for name in ("TranscriptsDisabled", "NoTranscriptFound", "VideoUnavailable", "VideoUnplayable", "InvalidVideoId", "AgeRestricted")
+    if _yta is not None and hasattr(_yta, name)
+)
+
+TRANSCRIPT_LOOKUPS = registry.register(
+    Counter("youtube_transcript_lookups_total", "Transcript lookups by outcome", ("result",))
+)
+
+_flight = SingleFlight()
+
+# youtube-transcript-api keeps consent cookies and headers on its session, so it gets
+# its own (with the shared pooling and retry policy) rather than the shared one
+_transcript_session = http_client.new_session()
+
+
+class VideoInfo(NamedTuple):
+    video_id: str
+    title: str
+    segments: List[dict]  # [{"text", "start", "duration"}], seconds
+    available: bool
+    error: Optional[str] = None
+
+    @property
+    def text(self) -> str:
+        return " ".join(segment["text"] for segment in self.segments)
+
+
+def watch_url(video_id: str) -> str:
+    return f"https://www.youtube.com/watch?v={video_id}"
+
+
+def fetch_video_title(video_id: str) -> str:
+    """Fetches the title of a YouTube video from its watch page."""
+    try:
+        resp = http_client.get(watch_url(video_id), circuit="youtube")
+        if resp.status_code == 200:
+            title_search = re.search(r"<title>(.*?)</title>", resp.text)
+            if title_search:
+                return title_search.group(1).replace(" - YouTube", "").strip()
+    except Exception as e:
+        print(f"[YOUTUBE] Could not fetch video title for {video_id}: {e}")
+    return "Unknown Title"
+
+
+def fetch_transcript(video_id: str) -> List[dict]:
+    """
+    Transcript segments as plain dicts. youtube-transcript-api 1.x replaced the
+    get_transcript() classmethod with YouTubeTranscriptApi().fetch(); both are supported.
+    """
+    if YouTubeTranscriptApi is None:
+        raise RuntimeError("youtube-transcript-api is not installed")
+    # A video without a transcript is an answer, not a failure of YouTube
+    with circuit("youtube").guard(is_failure=lambda e: not isinstance(e, _UNAVAILABLE)):
+        if hasattr(YouTubeTranscriptApi, "get_transcript"):
+            raw = YouTubeTranscriptApi.get_transcript(video_id, languages=YOUTUBE_TRANSCRIPT_LANGUAGES)
+        else:
+            raw = YouTubeTranscriptApi(http_client=_transcript_session).fetch(video_id, languages=YOUTUBE_TRANSCRIPT_LANGUAGES).to_raw_data()
+    return [
+        {"text": item["text"], "start": float(item.get("start", 0.0)), "duration": float(item.get("duration", 0.0))}
+        for item in raw
+    ]
+
+
+def _load(video_id: str, stale: bool = False) -> Optional[VideoInfo]:
+    """The cached entry, if present and not expired (or, with stale, an expired transcript)."""
+    try:
+        return _read(video_id, stale)
+    except Exception as e:
+        print(f"[YOUTUBE] Cache lookup failed for {video_id}: {e}")
+        return None
+
+
+def _read(video_id: str, stale: bool = False) -> Optional[VideoInfo]:
+    with pool.connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT title, segments, status, error, fetched_at FROM video_transcripts WHERE video_id=?", (video_id,))
+        row = c.fetchone()
+    if not row:
+        return None
+    title, segments, status, error, fetched_at = row
+    available = status == "ok"
+    if stale:
+        if not available:
+            return None
+    elif time.time() - fetched_at > (YOUTUBE_TRANSCRIPT_TTL if available else YOUTUBE_UNAVAILABLE_TTL):
+        return None
+    return VideoInfo(video_id, title or "Unknown Title", json.loads(segments) if segments else [], available, error)
+
+
+def _store(info: VideoInfo) -> None:
+    try:
+        _write(info)
+    except Exception as e:
+        print(f"[YOUTUBE] Could not cache video {info.video_id}: {e}")
+
+
+def _write(info: VideoInfo) -> None:
+    with pool.connection() as conn:
+        c = conn.cursor()
+        c.execute(
+            """
+            INSERT INTO video_transcripts (video_id, title, segments, status, error, fetched_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(video_id) DO UPDATE SET
+            title=excluded.title,
+            segments=excluded.segments,
+            status=excluded.status,
+            error=excluded.error,
+            fetched_at=excluded.fetched_at
+            """,
+            (
+                info.video_id, info.title, json.dumps(info.segments) if info.available else None,
+                "ok" if info.available else "unavailable", info.error, time.time(),
+            ),
+        )
+        conn.commit()
+
+
+def _fetch(video_id: str) -> VideoInfo:
+    # Another process (or a flight that just finished) may have filled the cache meanwhile
+    cached = _load(video_id)
+    if cached:
+        return cached
+    title = fetch_video_title(video_id)
+    try:
+        segments = fetch_transcript(video_id)
+    except _UNAVAILABLE as e:
+        info = VideoInfo(video_id, title, [], False, type(e).__name__)
+        _store(info)
+        return info
+    except Exception as e:
+        print(f"[YOUTUBE] Could not fetch transcript for video {video_id}: {e}")
+        stale = _load(video_id, stale=True)
+        if stale:
+            return stale
+        return VideoInfo(video_id, title, [], False, type(e).__name__)
+    info = VideoInfo(video_id, title, segments, bool(segments), None if segments else "EmptyTranscript")
+    _store(info)
+    return info
+
+
+def get_video_info(video_id: str) -> VideoInfo:
+    """Transcript and title of a video, from the cache when possible."""
+    cached = _load(video_id)
+    if cached:
+        TRANSCRIPT_LOOKUPS.inc(result="hit" if cached.available else "negative_hit")
+        return cached
+    info, shared = _flight.do(video_id, lambda: _fetch(video_id))
+    TRANSCRIPT_LOOKUPS.inc(result="coalesced" if shared else "miss")
+    return info
+
+
+class Window(NamedTuple):
+    start: float
+    end: float
+    text: str
+
+
+def format_timestamp(seconds: float) -> str:
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{secs:02d}" if hours else f"{minutes}:{secs:02d}"
+
+
+def transcript_windows(segments: List[dict], seconds: float = VIDEO_WINDOW_SECONDS, overlap: float = VIDEO_WINDOW_OVERLAP) -> List[Window]:
+    """Groups consecutive segments into windows of ~`seconds`, each starting `overlap` seconds before the previous one ends."""
+    windows: List[Window] = []
+    i, n = 0, len(segments)
+    while i < n:
+        start = segments[i]["start"]
+        j = i
+        while j < n and (j == i or segments[j]["start"] < start + seconds):
+            j += 1
+        last = segments[j - 1]
+        windows.append(Window(start, last["start"] + last["duration"], " ".join(s["text"] for s in segments[i:j])))
+        if j >= n:
+            break
+        following = i + 1
+        while following < j and segments[following]["start"] < start + seconds - overlap:
+            following += 1
+        i = following
+    return windows
+
+
+def relevant_windows(segments: List[dict], query: str, k: int) -> List[Window]:
+    """
+    The k windows best matching `query`, in playback order. When nothing matches
+    (e.g. "summarize this video") windows spread evenly over the video are used instead.
+    """
+    windows = transcript_windows(segments)
+    if len(windows) <= k:
+        return windows
+    index = BM25Index([(0, "", position, window.text) for position, window in enumerate(windows)])
+    positions = sorted(chunk.chunk_index for chunk in index.search(query, k))
+    if not positions:
+        positions = sorted({round(i * (len(windows) - 1) / max(k - 1, 1)) for i in range(k)})
+    return [windows[p] for p in positions]
+
+
+def render_windows(windows: List[Window]) -> str:
+    return "\n".join(f"[{format_timestamp(w.start)}–{format_timestamp(w.end)}] {w.text}" for w in windows)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Concurrent throughput of GET /chat/sessions and GET /groups/{id}/files.
+
+Runs the API twice against a throwaway SQLite database (or --database-url):
+  - DB_POOL_MAX_SIZE=1 reproduces the old single shared connection
+  - DB_POOL_MAX_SIZE=<--pool-size> uses the connection pool
+
+Usage:
+    python benchmarks/bench_db_pool.py --threads 16 --seconds 10
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def run_worker(threads: int, seconds: float) -> dict:
+    import requests
+    import uvicorn
+    from api.app import app
+    from api.db import pool
+
+    # Seed one user/group with some sessions and files
+    with pool.connection() as conn:
+        c = conn.cursor()
+        c.execute("INSERT INTO file_groups (user_id, group_name, created_at) VALUES (?, ?, ?)", (1, "bench", "2024-01-01"))
+        group_id = c.lastrowid
+        for i in range(50):
+            c.execute(
+                "INSERT INTO chat_sessions (id, user_id, group_id, title, created_at) VALUES (?, ?, ?, ?, ?)",
+                (f"s{i}", 1, group_id, f"Session {i}", f"2024-01-01T00:00:{i:02d}"),
+            )
+            c.execute(
+                "INSERT INTO files (group_id, file_name, file_type, file_content, uploaded_at) VALUES (?, ?, ?, ?, ?)",
+                (group_id, f"f{i}.txt", "text/plain", "x" * 2000, "2024-01-01"),
+            )
+        conn.commit()
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+    base = f"http://127.0.0.1:{port}"
+    urls = [f"{base}/chat/sessions?user_id=1&group_id={group_id}", f"{base}/groups/{group_id}/files"]
+    counts = [0] * threads
+    errors = [0] * threads
+    stop = time.monotonic() + seconds
+
+    def load(idx: int):
+        session = requests.Session()
+        i = 0
+        while time.monotonic() < stop:
+            r = session.get(urls[i % 2], timeout=30)
+            if r.status_code == 200:
+                counts[idx] += 1
+            else:
+                errors[idx] += 1
+            i += 1
+
+    workers = [threading.Thread(target=load, args=(i,)) for i in range(threads)]
+    started = time.monotonic()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.monotonic() - started
+    server.should_exit = True
+
+    return {"requests": sum(counts), "errors": sum(errors), "rps": sum(counts) / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--pool-size", type=int, default=10)
+    parser.add_argument("--database-url", default="", help="Benchmark against PostgreSQL instead of SQLite")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.threads, args.seconds)))
+        return
+
+    results = {}
+    for label, size in [("single connection", 1), (f"pool (max {args.pool_size})", args.pool_size)]:
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, DB_PATH=os.path.join(tmp, "bench.db"), DB_POOL_MAX_SIZE=str(size), DATABASE_URL=args.database_url)
+            out = subprocess.run(
+                [sys.executable, __file__, "--worker", "--threads", str(args.threads), "--seconds", str(args.seconds)],
+                env=env, cwd=ROOT, capture_output=True, text=True, check=True,
+            ).stdout
+            results[label] = json.loads(out.strip().splitlines()[-1])
+
+    print(f"{'mode':<22}{'requests':>10}{'errors':>8}{'req/s':>10}")
+    for label, r in results.items():
+        print(f"{label:<22}{r['requests']:>10}{r['errors']:>8}{r['rps']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+GET /courses/{course_id}/updates: per-poll queries vs the set-based feed.
+
+Seeds a throwaway SQLite database (or --database-url) with one course holding
+thousands of polls, options and votes, then times:
+  - legacy: the old loop (one options query + one "did this user vote" query per poll)
+  - feed:   the current endpoint returning the whole feed
+  - paged:  the current endpoint walking the feed with ?limit= and X-Next-Cursor
+
+The outputs are compared so the rewrite is checked for equivalence as well as speed.
+
+Usage:
+    python benchmarks/bench_feed.py --polls 2000 --votes 50000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+
+def seed(conn, course_id: str, polls: int, updates: int, options: int, votes: int, users: int) -> None:
+    from api.services.polls import reconcile_vote_counts
+
+    rng = random.Random(42)
+    c = conn.cursor()
+    for i in range(updates):
+        c.execute(
+            "INSERT INTO updates (course_id, content, created_at) VALUES (?, ?, ?)",
+            (course_id, f"Update {i}", f"2024-01-{1 + i % 28:02d}T{i % 24:02d}:00:{i % 60:02d}"),
+        )
+    option_ids = {}
+    for i in range(polls):
+        c.execute(
+            "INSERT INTO polls (course_id, question, created_at) VALUES (?, ?, ?)",
+            (course_id, f"Poll {i}?", f"2024-01-{1 + i % 28:02d}T{i % 24:02d}:{i % 60:02d}:00"),
+        )
+        poll_id = c.lastrowid
+        option_ids[poll_id] = []
+        for j in range(options):
+            c.execute("INSERT INTO poll_options (poll_id, option_text) VALUES (?, ?)", (poll_id, f"Option {j}"))
+            option_ids[poll_id].append(c.lastrowid)
+    poll_ids = list(option_ids)
+    seen = set()
+    for _ in range(votes):
+        poll_id, user_id = rng.choice(poll_ids), rng.randint(1, users)
+        if (poll_id, user_id) in seen:
+            continue
+        seen.add((poll_id, user_id))
+        c.execute(
+            "INSERT INTO poll_votes (poll_id, option_id, user_id) VALUES (?, ?, ?)",
+            (poll_id, rng.choice(option_ids[poll_id]), user_id),
+        )
+    conn.commit()
+    # Votes were inserted directly, so fill in the poll_options.vote_count counters
+    reconcile_vote_counts(conn)
+
+
+def legacy_feed(conn, course_id: str, user_id: int) -> list:
+    """The feed as it was built before: 2 queries per poll and a Python sort."""
+    from api.schemas import PollOptionResponse, PollResponse, UpdateResponse
+
+    c = conn.cursor()
+    combined = []
+    c.execute(
+        "SELECT id, content, CASE WHEN image_sha256 IS NOT NULL OR image_data IS NOT NULL THEN 1 ELSE 0 END, external_url, created_at "
+        "FROM updates WHERE course_id=? ORDER BY created_at DESC",
+        (course_id,),
+    )
+    for row in c.fetchall():
+        combined.append(UpdateResponse(
+            id=row[0], content=row[1], image_url=f"/updates/{row[0]}/image" if row[2] else None,
+            external_url=row[3], created_at=row[4],
+        ))
+    c.execute("SELECT id, question, created_at FROM polls WHERE course_id=? ORDER BY created_at DESC", (course_id,))
+    for poll_id, question, created_at in c.fetchall():
+        c.execute(
+            """
+            SELECT o.id, o.option_text, COALESCE(COUNT(v.id), 0) as vote_count
+            FROM poll_options o
+            LEFT JOIN poll_votes v ON o.id = v.option_id
+            WHERE o.poll_id=?
+            GROUP BY o.id
+            """,
+            (poll_id,),
+        )
+        options = [PollOptionResponse(id=r[0], text=r[1], votes=r[2]) for r in c.fetchall()]
+        c.execute("SELECT option_id FROM poll_votes WHERE user_id=? AND poll_id=?", (user_id, poll_id))
+        vote = c.fetchone()
+        combined.append(PollResponse(
+            id=poll_id, question=question, options=options,
+            user_voted_option_id=vote[0] if vote else None, created_at=created_at,
+        ))
+    combined.sort(key=lambda x: x.created_at, reverse=True)
+    return combined
+
+
+def summarize(item) -> dict:
+    if item.type == "update":
+        return {"type": "update", "id": item.id, "created_at": item.created_at}
+    return {
+        "type": "poll", "id": item.id, "created_at": item.created_at,
+        "options": [(o.id, o.votes) for o in item.options], "voted": item.user_voted_option_id,
+    }
+
+
+def timed(fn, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--polls", type=int, default=2000)
+    parser.add_argument("--updates", type=int, default=500)
+    parser.add_argument("--options", type=int, default=4)
+    parser.add_argument("--votes", type=int, default=50000)
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--database-url", default="", help="Benchmark against PostgreSQL instead of SQLite")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ["DB_PATH"] = os.path.join(tmp, "bench.db")
+    os.environ["DATABASE_URL"] = args.database_url
+
+    from fastapi import Response
+    from api.db import init_db, pool
+    from api.routers.updates import get_course_updates
+
+    init_db()
+    course_id, user_id = "bench-course", 1
+    with pool.connection() as conn:
+        seed(conn, course_id, args.polls, args.updates, args.options, args.votes, args.users)
+
+        legacy, legacy_s = timed(lambda: legacy_feed(conn, course_id, user_id), args.repeat)
+        feed, feed_s = timed(lambda: get_course_updates(course_id, Response(), user_id=user_id, limit=None, cursor=None, conn=conn), args.repeat)
+
+        def walk():
+            items, cursor, pages = [], None, 0
+            while True:
+                response = Response()
+                items += get_course_updates(course_id, response, user_id=user_id, limit=args.page_size, cursor=cursor, conn=conn)
+                pages += 1
+                cursor = response.headers.get("X-Next-Cursor")
+                if not cursor:
+                    return items, pages
+
+        (paged, pages), paged_s = timed(walk, args.repeat)
+        (_, first_page_s) = timed(
+            lambda: get_course_updates(course_id, Response(), user_id=user_id, limit=args.page_size, cursor=None, conn=conn), args.repeat
+        )
+
+    # The legacy sort is by created_at only, so compare as sets keyed by (type, id)
+    key = lambda d: (d["type"], d["id"])
+    assert sorted(map(summarize, feed), key=key) == sorted(map(summarize, legacy), key=key), "feed differs from legacy output"
+    assert [summarize(i) for i in paged] == [summarize(i) for i in feed], "paged walk differs from full feed"
+
+    items = args.polls + args.updates
+    print(f"{items} feed items ({args.polls} polls, {args.updates} updates), best of {args.repeat}")
+    print(f"{'mode':<34}{'queries':>10}{'ms':>10}")
+    print(f"{'legacy (per-poll queries)':<34}{2 + 2 * args.polls:>10}{legacy_s * 1000:>10.1f}")
+    print(f"{'feed (set-based)':<34}{4:>10}{feed_s * 1000:>10.1f}")
+    print(f"{f'first page (limit={args.page_size})':<34}{4:>10}{first_page_s * 1000:>10.1f}")
+    print(f"{f'all {pages} pages':<34}{4 * pages:>10}{paged_s * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+GET /search: FTS5 (or tsvector with --database-url) vs a naive LIKE scan.
+
+Seeds a throwaway database with a corpus of --docs documents split between files,
+text chat messages and course updates (Zipf-distributed synthetic vocabulary),
+indexing them through the same write hooks the API uses, then times:
+  - like:   SELECT ... WHERE file_content LIKE '%word%' (AND per word) over files, chat and updates
+  - search: api.services.search.search() for the same queries, ranked with snippets
+
+Usage:
+    python benchmarks/bench_search.py --docs 10000 --queries 200
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+
+def make_vocabulary(size: int, rng: random.Random) -> list:
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(letters) for _ in range(rng.randint(4, 10))))
+    return sorted(words)
+
+
+def seed(conn, docs: int, file_words: int, vocab: list, rng: random.Random) -> float:
+    """Inserts the corpus through the write hooks. Returns the seconds spent indexing."""
+    from api.services.search import index_document
+
+    weights = [1 / (rank + 1) for rank in range(len(vocab))]
+    text = lambda n: " ".join(rng.choices(vocab, weights, k=n))
+
+    c = conn.cursor()
+    for user_id in range(1, 11):
+        c.execute("INSERT INTO users (username, password, course_id) VALUES (?, 'x', 'bench-course')", (f"user{user_id}",))
+        c.execute("INSERT INTO file_groups (user_id, group_name) VALUES (?, ?)", (user_id, f"group{user_id}"))
+    indexing = 0.0
+    for i in range(docs):
+        user_id = 1 + i % 10
+        kind = ("file", "chat", "chat", "chat", "update")[i % 5]
+        if kind == "file":
+            body = text(file_words)
+            c.execute(
+                "INSERT INTO files (group_id, file_name, file_type, file_content, extraction_status) VALUES (?, ?, 'text/plain', ?, 'done')",
+                (user_id, f"notes-{i}.txt", body),
+            )
+            started = time.perf_counter()
+            index_document(conn, "file", c.lastrowid, body, title=f"notes-{i}.txt", group_id=user_id)
+        elif kind == "chat":
+            body = text(rng.randint(10, 80))
+            c.execute(
+                "INSERT INTO chat_history (user_id, group_id, session_id, role, message) VALUES (?, ?, ?, 'user', ?)",
+                (user_id, user_id, f"s{i // 50}", body),
+            )
+            started = time.perf_counter()
+            index_document(conn, "chat", c.lastrowid, body, user_id=user_id, group_id=user_id, session_id=f"s{i // 50}")
+        else:
+            body = text(rng.randint(20, 60))
+            c.execute("INSERT INTO updates (course_id, content) VALUES ('bench-course', ?)", (body,))
+            started = time.perf_counter()
+            index_document(conn, "update", c.lastrowid, body, course_id="bench-course")
+        indexing += time.perf_counter() - started
+        if i % 500 == 499:
+            conn.commit()
+    conn.commit()
+    return indexing
+
+
+def like_search(conn, words: list, user_id: int, limit: int) -> list:
+    """What a search without an index would have to do: scan every row's text."""
+    c = conn.cursor()
+    pattern = lambda column: " AND ".join(f"{column} LIKE ?" for _ in words)
+    args = [f"%{w}%" for w in words]
+    results = []
+    c.execute(
+        f"SELECT id FROM files WHERE group_id IN (SELECT id FROM file_groups WHERE user_id=?) AND {pattern('file_content')} LIMIT ?",
+        (user_id, *args, limit),
+    )
+    results += c.fetchall()
+    c.execute(f"SELECT id FROM chat_history WHERE user_id=? AND {pattern('message')} LIMIT ?", (user_id, *args, limit))
+    results += c.fetchall()
+    c.execute(f"SELECT id FROM updates WHERE course_id='bench-course' AND {pattern('content')} LIMIT ?", (*args, limit))
+    results += c.fetchall()
+    return results[:limit]
+
+
+def percentiles(samples: list) -> str:
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    return f"{statistics.median(samples) * 1000:>10.2f}{p95 * 1000:>10.2f}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=10000)
+    parser.add_argument("--file-words", type=int, default=1500, help="Words per file document")
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--database-url", default="", help="Benchmark against PostgreSQL instead of SQLite")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ["DB_PATH"] = os.path.join(tmp, "bench.db")
+    os.environ["DATABASE_URL"] = args.database_url
+
+    from api.db import init_db, pool
+    from api.services.search import search
+
+    init_db()
+    rng = random.Random(7)
+    vocab = make_vocabulary(args.vocabulary, rng)
+    # Common words match thousands of documents (LIKE stops early at the limit, the index
+    # has to rank them all); rare words match a few, so LIKE has to scan everything
+    query_sets = {
+        "common": [rng.sample(vocab[20:300], rng.choice((1, 1, 2))) for _ in range(args.queries)],
+        "rare": [rng.sample(vocab[3000:15000], 1) for _ in range(args.queries)],
+    }
+
+    with pool.connection() as conn:
+        started = time.perf_counter()
+        indexing = seed(conn, args.docs, args.file_words, vocab, rng)
+        seeded = time.perf_counter() - started
+
+        timings = {}
+        for name, queries in query_sets.items():
+            like_times, search_times, hits = [], [], 0
+            for words in queries:
+                user_id = rng.randint(1, 10)
+                t0 = time.perf_counter()
+                like_search(conn, words, user_id, args.limit)
+                like_times.append(time.perf_counter() - t0)
+                t0 = time.perf_counter()
+                results = search(conn, " ".join(words), user_id, limit=args.limit)
+                search_times.append(time.perf_counter() - t0)
+                hits += bool(results)
+            timings[name] = (like_times, search_times, hits)
+
+    print(f"{args.docs} documents seeded in {seeded:.1f}s ({indexing / args.docs * 1000:.2f} ms/doc in search hooks)")
+    print(f"{'queries':<24}{'mode':<20}{'p50 ms':>10}{'p95 ms':>10}")
+    for name, (like_times, search_times, hits) in timings.items():
+        label = f"{name} ({hits}/{len(like_times)} hit)"
+        print(f"{label:<24}{'like (unindexed scan)':<20}{percentiles(like_times)}")
+        print(f"{'':<24}{'search (ranked)':<20}{percentiles(search_times)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+"""
+Test setup shared by every module: one throwaway SQLite database (with the blob
+store beside it) for the whole run. api.core.config reads DB_PATH once, on first
+import, so the environment is set here before any test module imports api.
+"""
+import os
+import tempfile
+
+_tmp = tempfile.mkdtemp()
+os.environ["DB_PATH"] = os.path.join(_tmp, "test.db")
+os.environ["DATABASE_URL"] = ""
+os.environ.pop("BLOB_STORE_DIR", None)
+
+from api.db import init_db  # noqa: E402
+
+init_db()
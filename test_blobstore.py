@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+Checks the blob store: identical uploads share one digest, reads round-trip, and
+a backend that leaves out part of the interface can't be constructed.
+"""
+import hashlib
+
+import pytest
+
+from api.services.blobstore import BlobStore, LocalBlobStore
+
+
+def test_local_store_round_trips_by_digest(tmp_path):
+    store = LocalBlobStore(str(tmp_path))
+    data = b"%PDF-1.4 lecture notes"
+    digest = store.put(data)
+    assert digest == hashlib.sha256(data).hexdigest()
+    assert store.put(data) == digest
+    assert store.exists(digest) and store.size(digest) == len(data)
+    assert store.read(digest) == data
+    assert b"".join(store.iter_chunks(digest, 4, start=5, end=12)) == data[5:13]
+    with pytest.raises(ValueError):
+        store.exists("../etc/passwd")
+
+
+def test_incomplete_backend_cannot_be_constructed():
+    class WriteOnly(BlobStore):
+        def put(self, data):
+            return hashlib.sha256(data).hexdigest()
+
+    with pytest.raises(TypeError):
+        WriteOnly()
+    with pytest.raises(TypeError):
+        BlobStore()
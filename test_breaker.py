@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Checks circuit breaker transitions on a fake clock: closed to open after the failure
+threshold, failing fast while open, half-open trials after the reset timeout, and
+outcomes that count as neither success nor failure.
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from api.services import breaker as breaker_module
+from api.services.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(breaker_module, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+def fail(breaker, times=1):
+    for _ in range(times):
+        breaker.record(True, breaker.acquire())
+
+
+def test_opens_after_consecutive_failures_and_fails_fast(clock):
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=30)
+    fail(breaker, 2)
+    breaker.record(False, breaker.acquire())  # a success resets the count
+    fail(breaker, 2)
+    assert breaker.state == CLOSED
+    fail(breaker)
+    assert breaker.state == OPEN and breaker.is_open()
+
+    clock[0] += 10
+    with pytest.raises(CircuitOpen) as raised:
+        breaker.acquire()
+    assert raised.value.retry_after == 20
+    assert breaker.snapshot() == {"state": OPEN, "failures": 0, "retry_after": 20.0}
+
+
+def test_half_open_trial_success_closes(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30, half_open_calls=1)
+    fail(breaker)
+    clock[0] += 30
+    assert not breaker.is_open()
+    assert breaker.state == HALF_OPEN
+    trial = breaker.acquire()
+    assert trial is True
+    # Only half_open_calls trials at a time
+    with pytest.raises(CircuitOpen):
+        breaker.acquire()
+    breaker.record(False, trial)
+    assert breaker.state == CLOSED
+    assert breaker.acquire() is False
+
+
+def test_half_open_trial_failure_reopens(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30)
+    fail(breaker)
+    clock[0] += 30
+    breaker.record(True, breaker.acquire())
+    assert breaker.state == OPEN
+    assert breaker.snapshot()["retry_after"] == 30.0
+
+
+def test_neutral_outcomes_change_nothing(clock):
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=30)
+    fail(breaker)
+    for _ in range(5):
+        breaker.record(None, breaker.acquire())
+    assert breaker.snapshot() == {"state": CLOSED, "failures": 1}
+
+    fail(breaker)
+    clock[0] += 30
+    # An abandoned trial frees its slot without deciding the state
+    breaker.record(None, breaker.acquire())
+    assert breaker.state == HALF_OPEN
+    assert breaker.acquire() is True
+
+
+def test_guard_classifies_exceptions(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30)
+    with pytest.raises(ValueError):
+        with breaker.guard(lambda error: None if isinstance(error, ValueError) else True):
+            raise ValueError("not the dependency's fault")
+    with pytest.raises(asyncio.CancelledError):
+        with breaker.guard():
+            raise asyncio.CancelledError()
+    assert breaker.state == CLOSED
+
+    with pytest.raises(RuntimeError):
+        with breaker.guard():
+            raise RuntimeError("503")
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpen):
+        with breaker.guard():
+            pass
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Checks the response cache (TTL, LRU eviction, throttled last-access writes and
+sweeps) and SingleFlight call coalescing.
+"""
+import threading
+import time
+import uuid
+
+import pytest
+
+from api.db import pool
+from api.services.cache import PersistentCache, SingleFlight
+
+
+def new_cache(**kwargs):
+    kwargs.setdefault("ttl", 3600)
+    kwargs.setdefault("max_entries", 100)
+    return PersistentCache(f"test-{uuid.uuid4().hex}", **kwargs)
+
+
+def row(cache, key):
+    with pool.connection() as conn:
+        c = conn.cursor()
+        c.execute(
+            "SELECT created_at, last_access FROM response_cache WHERE namespace=? AND cache_key=?",
+            (cache.namespace, key),
+        )
+        return c.fetchone()
+
+
+def age(cache, key, seconds):
+    with pool.connection() as conn:
+        c = conn.cursor()
+        c.execute(
+            "UPDATE response_cache SET created_at=created_at-?, last_access=last_access-? WHERE namespace=? AND cache_key=?",
+            (seconds, seconds, cache.namespace, key),
+        )
+        conn.commit()
+
+
+def count(cache):
+    with pool.connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT COUNT(*) FROM response_cache WHERE namespace=?", (cache.namespace,))
+        return c.fetchone()[0]
+
+
+def test_hit_and_expiry():
+    cache = new_cache(ttl=60)
+    cache.set("a", "1")
+    assert cache.get("a") == "1"
+    age(cache, "a", 61)
+    assert cache.get("a") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = new_cache(max_entries=2, sweep_interval=0)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    age(cache, "a", 600)
+    age(cache, "b", 300)
+    assert cache.get("a") == "1"  # old enough to be touched, so "b" is now the oldest
+    cache.set("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
+
+
+def test_recent_hits_do_not_rewrite_last_access():
+    cache = new_cache(ttl=3600, touch_fraction=0.1)
+    cache.set("a", "1")
+    before = row(cache, "a")[1]
+    time.sleep(0.01)
+    assert cache.get("a") == "1"
+    assert row(cache, "a")[1] == before
+    age(cache, "a", 400)
+    assert cache.get("a") == "1"
+    assert row(cache, "a")[1] >= before
+
+
+def test_size_is_enforced_by_periodic_sweeps():
+    cache = new_cache(max_entries=2, sweep_interval=3600)
+    for key in "abcd":
+        cache.set(key, key)
+    # Only the first write swept; the rest wait for the interval
+    assert count(cache) == 4
+    cache.sweep()
+    assert count(cache) == 2
+
+
+def test_single_flight_shares_one_call():
+    flight = SingleFlight()
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(2)
+        return "value"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("k", slow)))
+    leader.start()
+    assert started.wait(2)
+    follower = threading.Thread(target=lambda: results.append(flight.do("k", slow)))
+    follower.start()
+    time.sleep(0.05)
+    release.set()
+    leader.join(2)
+    follower.join(2)
+    assert len(calls) == 1
+    assert sorted(results) == [("value", False), ("value", True)]
+    # Finished flights are forgotten, so the next call runs again
+    assert flight.do("k", lambda: "again") == ("again", False)
+
+
+def test_single_flight_raises_and_forgets_failures():
+    flight = SingleFlight()
+    with pytest.raises(ValueError):
+        flight.do("k", lambda: (_ for _ in ()).throw(ValueError("boom")))
+    assert flight.do("k", lambda: 1) == (1, False)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Checks the image and video chat endpoints with Gemini faked: the uploaded image is
+saved, opened and decoded in the threadpool rather than on the event loop, and while
+Gemini is unavailable the retrieved material is served instead, or a 503 when there
+is none.
+"""
+import asyncio
+import io
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from api.app import app
+from api.db import pool
+from api.routers import chat
+from api.services.breaker import CircuitOpen
+from api.services.gemini_keys import KeysExhausted
+from api.services.youtube import VideoInfo
+
+
+client = TestClient(app)
+
+
+def png_bytes():
+    out = io.BytesIO()
+    Image.new("RGB", (40, 20), (0, 90, 200)).save(out, "PNG")
+    return out.getvalue()
+
+
+def off_the_event_loop():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return True
+    return False
+
+
+@pytest.fixture
+def image_io(monkeypatch, tmp_path):
+    """Records, for each blocking image step, whether it ran off the event loop."""
+    monkeypatch.chdir(tmp_path)
+    steps = []
+    open_image, write_file = Image.open, chat.write_file
+
+    def opening(*args, **kwargs):
+        steps.append(("open", off_the_event_loop()))
+        return open_image(*args, **kwargs)
+
+    def writing(*args, **kwargs):
+        steps.append(("write", off_the_event_loop()))
+        return write_file(*args, **kwargs)
+
+    monkeypatch.setattr(chat.Image, "open", opening)
+    monkeypatch.setattr(chat, "write_file", writing)
+    return steps
+
+
+def post_image(path, session_id):
+    return client.post(
+        f"/chat/groups/1/{path}",
+        data={"session_id": session_id, "user_id": "7", "message": "what is this?"},
+        files={"image": ("diagram.png", png_bytes(), "image/png")},
+    )
+
+
+def test_image_chat_decodes_the_image_off_the_event_loop(monkeypatch, image_io):
+    def generate(contents, system_instruction=None):
+        # Already decoded: Gemini's client gets pixels, not a lazily read file
+        assert contents[1].size == (40, 20) and contents[1].im is not None
+        return "a blue rectangle"
+
+    monkeypatch.setattr(chat, "generate", generate)
+    response = post_image("image", "image-session")
+    assert response.status_code == 200, response.text
+    assert response.json()["response"] == "a blue rectangle"
+    assert image_io == [("write", True), ("open", True)]
+
+
+def test_image_stream_decodes_the_image_off_the_event_loop(monkeypatch, image_io):
+    def stream_generate(contents, system_instruction=None):
+        assert contents[1].size == (40, 20)
+        yield "blue"
+
+    monkeypatch.setattr(chat, "stream_generate", stream_generate)
+    response = post_image("image/stream", "image-stream-session")
+    assert response.status_code == 200
+    assert "event: done" in response.text
+    assert image_io == [("write", True), ("open", True)]
+
+
+def gemini_down(error):
+    def generate(contents, system_instruction=None):
+        raise error
+    return generate
+
+
+def saved_turns(table, session_id):
+    with pool.connection() as conn:
+        c = conn.cursor()
+        c.execute(f"SELECT COUNT(*) FROM {table} WHERE session_id=?", (session_id,))
+        return c.fetchone()[0]
+
+
+def test_image_chat_serves_study_passages_while_gemini_is_down(monkeypatch, image_io):
+    with pool.connection() as conn:
+        c = conn.cursor()
+        c.execute(
+            "INSERT INTO files (group_id, file_name, file_type, file_content, uploaded_at) VALUES (1, 'cells.txt', 'text/plain', ?, '2024-01-01')",
+            ("A diagram of the cell shows the nucleus and the mitochondria",),
+        )
+        conn.commit()
+    monkeypatch.setattr(chat, "generate", gemini_down(KeysExhausted("busy")))
+
+    response = client.post(
+        "/chat/groups/1/image",
+        data={"session_id": "degraded-image", "user_id": "7", "message": "which part is the nucleus?"},
+        files={"image": ("cell.png", png_bytes(), "image/png")},
+    )
+    assert response.status_code == 200, response.text
+    answer = response.json()["response"]
+    assert answer.startswith(chat.DEGRADED_TEXT_RESPONSE)
+    assert "nucleus and the mitochondria" in answer
+    assert saved_turns("chat_history_image", "degraded-image") == 0
+
+    # Nothing in the group's files matches: there is no degraded answer to give
+    response = post_image("image", "degraded-image-empty")
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
+
+
+def test_video_chat_serves_transcript_windows_while_gemini_is_down(monkeypatch):
+    segments = [{"text": "mitochondria make the cell's energy", "start": 62.0, "duration": 4.0}]
+    transcripts = {"abcdefghijk": VideoInfo("abcdefghijk", "Cells", segments, True)}
+    monkeypatch.setattr(chat, "get_video_info", lambda vid: transcripts.get(vid, VideoInfo(vid, "Unknown Title", [], False)))
+    monkeypatch.setattr(chat, "generate", gemini_down(CircuitOpen("gemini", 20)))
+
+    def ask(video_id, session_id):
+        return client.post(
+            "/chat/groups/1/video",
+            json={"user_id": 7, "message": "what do mitochondria do?", "session_id": session_id, "video_url": f"https://youtu.be/{video_id}"},
+        )
+
+    response = ask("abcdefghijk", "degraded-video")
+    assert response.status_code == 200, response.text
+    answer = response.json()["response"]
+    assert answer.startswith(chat.DEGRADED_VIDEO_RESPONSE)
+    assert "[1:02" in answer and "mitochondria make the cell's energy" in answer
+    assert saved_turns("chat_history_video", "degraded-video") == 0
+
+    # No transcript to fall back on
+    response = ask("zyxwvutsrqp", "degraded-video-none")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "21"
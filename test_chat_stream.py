@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Checks that the SSE chat endpoints hold no pooled connection while the answer
+streams: with a one-connection pool the answer must still be saved.
+"""
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from api import db
+from api.app import app
+from api.routers import chat
+
+
+@pytest.fixture
+def one_connection(monkeypatch):
+    single = db.ConnectionPool(db._connect_sqlite, min_size=0, max_size=1, timeout=1)
+    monkeypatch.setattr(db, "pool", single)
+    monkeypatch.setattr(chat, "pool", single)
+    yield single
+    single.close_all()
+
+
+def events(body):
+    parsed = []
+    for block in body.strip().split("\n\n"):
+        name, data = "message", None
+        for line in block.splitlines():
+            if line.startswith("event: "):
+                name = line[len("event: "):]
+            elif line.startswith("data: "):
+                data = json.loads(line[len("data: "):])
+        parsed.append((name, data))
+    return parsed
+
+
+def test_text_stream_saves_the_answer_with_a_single_connection(monkeypatch, one_connection):
+    def stream_generate(prompt, system_instruction=None):
+        # The request must not be holding the only connection while chunks arrive
+        assert one_connection.stats()["in_use"] == 0
+        yield "Hel"
+        yield "lo"
+
+    monkeypatch.setattr(chat, "stream_generate", stream_generate)
+    client = TestClient(app)
+    response = client.post(
+        "/chat/groups/1/text/stream",
+        json={"user_id": 7, "message": "hi", "session_id": "stream-session"},
+    )
+    assert response.status_code == 200
+    parsed = events(response.text)
+    assert parsed[-1][0] == "done", parsed
+    assert parsed[-1][1]["response"] == "Hello"
+
+    with one_connection.connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT role, message FROM chat_history WHERE session_id=? ORDER BY id", ("stream-session",))
+        rows = c.fetchall()
+    assert [tuple(r) for r in rows][-1] == ("assistant", "Hello")
+    assert one_connection.stats()["in_use"] == 0
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Checks the connection pool: checkout timeout, waking waiters on release, rollback
+of unfinished transactions and replacement of connections the server dropped.
+"""
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from api.db import ConnectionPool, PoolTimeout, SmartConn
+
+
+def make_pool(max_size=1, timeout=0.2):
+    created = []
+
+    def connect():
+        conn = SmartConn(sqlite3.connect(":memory:", check_same_thread=False), False)
+        created.append(conn)
+        return conn
+
+    return ConnectionPool(connect, min_size=0, max_size=max_size, timeout=timeout), created
+
+
+def test_acquire_times_out_when_pool_is_exhausted():
+    pool, _ = make_pool(max_size=1, timeout=0.1)
+    held = pool.acquire()
+    started = time.monotonic()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    assert time.monotonic() - started >= 0.1
+    pool.release(held)
+    assert pool.stats()["in_use"] == 0
+
+
+def test_release_wakes_a_waiting_borrower():
+    pool, created = make_pool(max_size=1, timeout=5)
+    held = pool.acquire()
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(pool.acquire()))
+    waiter.start()
+    time.sleep(0.05)
+    pool.release(held)
+    waiter.join(2)
+    assert got == [held]
+    assert len(created) == 1
+
+
+def test_release_rolls_back_unfinished_transactions():
+    pool, _ = make_pool()
+    with pool.connection() as conn:
+        c = conn.cursor()
+        c.execute("CREATE TABLE t (x INTEGER)")
+        conn.commit()
+        c.execute("INSERT INTO t VALUES (1)")
+    with pool.connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT COUNT(*) FROM t")
+        assert c.fetchone()[0] == 0
+
+
+def test_broken_connection_is_replaced_on_checkout():
+    pool, created = make_pool(max_size=1)
+    with pool.connection() as conn:
+        pass
+    conn.conn.close()  # the server dropped it while idle
+    with pool.connection() as fresh:
+        assert fresh is not conn
+        c = fresh.cursor()
+        c.execute("SELECT 1")
+        assert c.fetchone()[0] == 1
+    assert len(created) == 2
+    assert pool.stats()["size"] == 1
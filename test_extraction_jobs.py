@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Checks that PDF uploads are extracted by a job that reads the PDF back from the
+blob store, so an upload cut off by a restart is picked up again, and that
+concurrent jobs share one worker process pool.
+"""
+import threading
+import time
+
+from fastapi.testclient import TestClient
+
+from api.app import app
+from api.db import pool
+from api.routers import groups_files
+from api.services import extraction
+from api.services.jobs import job_queue
+
+PDF = b"%PDF-1.4 fake"
+
+
+def upload(client, name="notes.pdf"):
+    response = client.post("/groups/5/files", files={"file": (name, PDF, "application/pdf")})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def file_row(file_id):
+    with pool.connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT extraction_status, extracted_text, extraction_error, blob_sha256 FROM files WHERE id=?", (file_id,))
+        return c.fetchone()
+
+
+def extract_job(file_id):
+    with pool.connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT id, status FROM jobs WHERE kind='extract' AND params=?", (f'{{"file_id": {file_id}}}',))
+        return c.fetchone()
+
+
+def test_pdf_upload_is_extracted_by_a_job(monkeypatch):
+    seen = []
+    monkeypatch.setattr(groups_files, "extract_pdf_text", lambda data: seen.append(data) or "photosynthesis notes")
+    body = upload(TestClient(app))
+    assert body["extraction_status"] == "pending"
+
+    status, text, error, digest = file_row(body["id"])
+    assert status == "pending" and digest
+    job_id, job_status = extract_job(body["id"])
+    assert job_status == "queued"
+
+    client = TestClient(app)
+    # Until the job runs the text download is not ready, rather than an empty file
+    pending = client.get(f"/files/{body['id']}/download")
+    assert pending.status_code == 409
+    assert pending.headers["retry-after"] == "5"
+
+    job_queue._run(job_id)
+    assert seen == [PDF]
+    status, text, error, _ = file_row(body["id"])
+    assert (status, text, error) == ("done", "photosynthesis notes", None)
+    assert extract_job(body["id"])[1] == "done"
+    assert client.get(f"/files/{body['id']}/download").text == "photosynthesis notes"
+
+
+def test_failed_extraction_is_recorded(monkeypatch):
+    def broken(data):
+        raise RuntimeError("not a PDF")
+
+    monkeypatch.setattr(groups_files, "extract_pdf_text", broken)
+    body = upload(TestClient(app), "broken.pdf")
+    job_id, _ = extract_job(body["id"])
+    job_queue._run(job_id)
+    status, text, error, _ = file_row(body["id"])
+    assert (status, text, error) == ("failed", None, "not a PDF")
+    assert extract_job(body["id"])[1] == "failed"
+    response = TestClient(app).get(f"/files/{body['id']}/download")
+    assert response.status_code == 422
+    assert "not a PDF" in response.json()["detail"]
+
+
+def test_concurrent_jobs_share_one_process_pool(monkeypatch):
+    created = []
+
+    class FakePool:
+        def __init__(self, **kwargs):
+            time.sleep(0.05)  # widen the window between the check and the assignment
+            created.append(self)
+
+        def shutdown(self, **kwargs):
+            pass
+
+    monkeypatch.setattr(extraction, "ProcessPoolExecutor", FakePool)
+    monkeypatch.setattr(extraction, "_executor", None)
+    seen = []
+    threads = [threading.Thread(target=lambda: seen.append(extraction.get_executor())) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    assert len(created) == 1
+    assert all(executor is created[0] for executor in seen)
+
+    # A pool reported broken after another thread replaced it is left alone
+    extraction.shutdown(FakePool())
+    assert extraction._executor is created[0]
+    extraction.shutdown(created[0])
+    assert extraction._executor is None
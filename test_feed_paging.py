@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Checks cursor paging of the course feed: pages concatenate to the whole feed in
+order, with no item repeated or skipped when updates and polls share timestamps.
+"""
+
+from fastapi.testclient import TestClient
+
+from api.app import app
+from api.db import pool
+
+
+COURSE = "paging-course"
+client = TestClient(app)
+
+
+def setup_module(module):
+    with pool.connection() as conn:
+        c = conn.cursor()
+        # Several items share a timestamp so ties are broken by kind and id
+        for i, created_at in enumerate(["2024-01-01", "2024-01-02", "2024-01-02", "2024-01-03", "2024-01-05"]):
+            c.execute(
+                "INSERT INTO updates (course_id, content, created_at) VALUES (?, ?, ?)",
+                (COURSE, f"update {i}", created_at),
+            )
+        for i, created_at in enumerate(["2024-01-02", "2024-01-02", "2024-01-04", "2024-01-05"]):
+            c.execute("INSERT INTO polls (course_id, question, created_at) VALUES (?, ?, ?)", (COURSE, f"poll {i}", created_at))
+            poll_id = c.lastrowid
+            c.execute("INSERT INTO poll_options (poll_id, option_text, vote_count) VALUES (?, 'yes', ?)", (poll_id, i))
+        conn.commit()
+
+
+def key(item):
+    return item["type"], item["id"]
+
+
+def test_pages_concatenate_to_the_whole_feed():
+    full = client.get(f"/courses/{COURSE}/updates").json()
+    assert len(full) == 9
+    ordering = [(item["created_at"], item["type"] == "update", item["id"]) for item in full]
+    assert ordering == sorted(ordering, reverse=True)
+
+    for limit in (1, 2, 4):
+        paged, cursor = [], None
+        while True:
+            params = {"limit": limit}
+            if cursor:
+                params["cursor"] = cursor
+            response = client.get(f"/courses/{COURSE}/updates", params=params)
+            assert response.status_code == 200
+            page = response.json()
+            assert len(page) <= limit
+            paged.extend(page)
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                break
+        assert [key(item) for item in paged] == [key(item) for item in full], limit
+
+
+def test_polls_carry_their_vote_counters():
+    polls = [item for item in client.get(f"/courses/{COURSE}/updates").json() if item["type"] == "poll"]
+    assert sorted(poll["options"][0]["votes"] for poll in polls) == [0, 1, 2, 3]
+
+
+def test_invalid_cursor_is_rejected():
+    response = client.get(f"/courses/{COURSE}/updates", params={"limit": 2, "cursor": "not-a-cursor"})
+    assert response.status_code == 400
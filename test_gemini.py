@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Checks the Gemini service wrappers with the network calls faked: how the phi agent
+path shares the process-wide key, how calls are leased keys and cached, that async
+endpoints get the same answers, errors and key rotation as the sync path, and how
+the key scheduler spends each key's budget and rests keys after 429s.
+"""
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from fastapi.testclient import TestClient
+
+from api.app import app
+from api.db import pool
+from api.routers import analysis
+from api.services import gemini as gem
+from api.services.gemini_keys import KeyScheduler, KeysExhausted
+
+
+@pytest.fixture
+def keys(monkeypatch):
+    scheduler = KeyScheduler(["k1", "k2"], rpm=0, tpm=0, cooldown=30, max_cooldown=120)
+    monkeypatch.setattr(gem, "key_scheduler", scheduler)
+    monkeypatch.setattr(gem, "API_KEYS", ["k1", "k2"])
+    return scheduler
+
+
+@pytest.fixture
+def model(monkeypatch):
+    """Fakes Gemini; returns the keys each call was made with. Calls on keys in calls.rate_limited get a 429."""
+    calls = Calls()
+
+    class FakeModel:
+        def __init__(self, api_key):
+            self.api_key = api_key
+
+        def generate_content(self, prompt):
+            calls.append(self.api_key)
+            if self.api_key in calls.rate_limited:
+                raise RuntimeError("429 Resource has been exhausted")
+            return SimpleNamespace(text=f"answer to {str(prompt)[-12:]}", usage_metadata=None)
+
+    monkeypatch.setattr(gem, "_model", lambda api_key=None, **kwargs: FakeModel(api_key))
+    return calls
+
+
+class Calls(list):
+    rate_limited = ()
+
+
+def rest_all(scheduler):
+    for _ in scheduler.keys:
+        scheduler.acquire(max_wait=0).release(RuntimeError("429 Resource has been exhausted"))
+
+
+def test_agent_runs_are_serialized_on_the_global_key(monkeypatch, keys):
+    started, finish = threading.Event(), threading.Event()
+    configured = []
+
+    class FakeAgent:
+        def __init__(self, **kwargs):
+            pass
+
+        def run(self, prompt):
+            started.set()
+            finish.wait(2)
+            return {"questions": ["q"]}
+
+    monkeypatch.setattr(gem, "Agent", FakeAgent)
+    monkeypatch.setattr(gem, "Gemini", lambda **kwargs: None)
+    monkeypatch.setattr(gem, "DuckDuckGo", lambda: None, raising=False)
+    monkeypatch.setattr(gem, "SerpApiTools", lambda **kwargs: None, raising=False)
+    monkeypatch.setattr(gem.genai, "configure", lambda api_key: configured.append(api_key))
+
+    results = []
+    first = threading.Thread(target=lambda: results.append(gem._agent_quiz("r", "s", "math", use_cache=False)))
+    first.start()
+    assert started.wait(2)
+    # A second agent run would swap the key under the first one; it falls back instead
+    assert gem._agent_quiz("other", "s", "math", use_cache=False) is None
+    finish.set()
+    first.join(2)
+    assert results == [{"questions": ["q"]}]
+    assert len(configured) == 1
+
+
+def test_cached_answers_are_served_while_every_key_rests(keys, model):
+    fresh = gem.analyze_report("cached report")
+    assert model == ["k1"]
+    rest_all(keys)
+    # No key is free, but neither call needs one
+    assert gem.analyze_report("cached report") == fresh
+    assert asyncio.run(gem.run_blocking(gem.analyze_report, "cached report")) == fresh
+    assert model == ["k1"]
+
+
+def test_no_free_key_raises_instead_of_answering_with_a_placeholder(keys, model):
+    rest_all(keys)
+    with pytest.raises(KeysExhausted):
+        gem.analyze_report("uncached report")
+    with pytest.raises(KeysExhausted):
+        asyncio.run(gem.run_blocking(gem.analyze_report, "uncached report"))
+    assert model == []
+
+
+def test_bypassing_the_cache_still_needs_a_key(keys, model):
+    gem.generate_roadmap("report", "syllabus")
+    rest_all(keys)
+    with pytest.raises(KeysExhausted):
+        gem.generate_roadmap("report", "syllabus", use_cache=False)
+
+
+def test_chat_turns_move_to_the_next_key_on_a_429(keys, model):
+    model.rate_limited = {"k1"}
+    assert gem.generate("why is the sky blue") == "answer to the sky blue"
+    assert asyncio.run(gem.run_blocking(gem.generate, "why is the sky blue")) == "answer to the sky blue"
+    # k1 rests after its 429, so the second turn goes straight to k2
+    assert model == ["k1", "k2", "k2"]
+
+    model.rate_limited = {"k1", "k2"}
+    keys.keys[1].cooldown_until = 0.0
+    with pytest.raises(KeysExhausted):
+        gem.generate("why is the sky blue")
+
+
+def analysis_group(group_id):
+    with pool.connection() as conn:
+        c = conn.cursor()
+        c.execute(
+            "INSERT INTO files (group_id, file_name, file_type, file_content, uploaded_at) VALUES (?, 'report.txt', 'text/plain', ?, '2024-01-01')",
+            (group_id, f"report for group {group_id}"),
+        )
+        c.execute(
+            "INSERT INTO syllabus_for_students (group_id, syllabus_content, topics_ratings, saved_at) VALUES (?, 'syllabus', '{}', '2024-01-01')",
+            (str(group_id),),
+        )
+        conn.commit()
+
+
+def test_inline_and_background_analysis_behave_the_same(keys, model):
+    client = TestClient(app)
+    for group_id in (8101, 8102):
+        analysis_group(group_id)
+
+    def inline(group_id):
+        response = client.post(f"/groups/{group_id}/analysis", params={"no_cache": True})
+        assert response.status_code == 200, response.text
+        return response.json()
+
+    def background(group_id):
+        return analysis.run_analysis_job({"group_id": group_id, "use_cache": False})
+
+    def without_timestamp(result):
+        return {k: v for k, v in result.items() if k != "timestamp"}
+
+    # k1 is rate limited: every part is retried on k2 on both paths
+    model.rate_limited = {"k1"}
+    first = [without_timestamp(run(group_id)) for run, group_id in ((inline, 8101), (background, 8102))]
+    assert first[0] == first[1]
+    assert first[0]["errors"] == {} and first[0]["stale"] is False
+    assert set(model) == {"k1", "k2"}
+
+    # No key left: both paths keep the saved analysis and report the same errors
+    for state in keys.keys:
+        state.cooldown_until = time.monotonic() + 600
+    second = [without_timestamp(run(group_id)) for run, group_id in ((inline, 8101), (background, 8102))]
+    for before, after in zip(first, second):
+        assert after["stale"] is True
+        assert [after[k] for k in ("analysis", "timetable", "roadmap")] == [before[k] for k in ("analysis", "timetable", "roadmap")]
+    assert second[0]["errors"] == second[1]["errors"]
+    assert set(second[0]["errors"]) == {"analysis", "timetable", "roadmap"}
+
+
+def test_analysis_never_keeps_the_placeholder(monkeypatch):
+    monkeypatch.setattr(analysis, "analyze_report", lambda report, **kwargs: gem.GEMINI_UNAVAILABLE)
+    monkeypatch.setattr(analysis, "generate_timetable", lambda report, syllabus, **kwargs: "timetable")
+    monkeypatch.setattr(analysis, "generate_roadmap", lambda report, syllabus, **kwargs: (_ for _ in ()).throw(KeysExhausted("busy")))
+    results, errors = analysis.run_generations("report", "syllabus")
+    assert results == {"timetable": "timetable"}
+    assert errors == {"analysis": "Gemini unavailable", "roadmap": "busy"}
+
+
+def test_consecutive_429s_double_the_cooldown_up_to_the_maximum():
+    scheduler = KeyScheduler(["k1"], rpm=0, tpm=0, cooldown=10, max_cooldown=25)
+    state = scheduler.keys[0]
+    pauses = []
+    for _ in range(3):
+        state.cooldown_until = 0.0
+        scheduler.acquire(max_wait=0).release(RuntimeError("429 quota"))
+        pauses.append(round(state.cooldown_until - time.monotonic()))
+    assert pauses == [10, 20, 25]
+    assert scheduler.try_acquire()[0] is None
+
+    # A call that got an answer resets the streak
+    state.cooldown_until = 0.0
+    lease = scheduler.acquire(max_wait=0)
+    lease.charge(1)
+    lease.release()
+    state.cooldown_until = 0.0
+    scheduler.acquire(max_wait=0).release(RuntimeError("429 quota"))
+    assert round(state.cooldown_until - time.monotonic()) == 10
+
+
+def test_rejected_keys_are_set_aside_and_others_take_over():
+    scheduler = KeyScheduler(["bad", "good"], rpm=0, tpm=0, cooldown=10, max_cooldown=300)
+    lease = scheduler.acquire(max_wait=0)
+    assert lease.key == "bad"
+    lease.release(RuntimeError("API key not valid"))
+    assert scheduler.snapshot()[0]["cooldown_seconds"] > 290
+    assert scheduler.acquire(max_wait=0).key == "good"
+
+
+def test_request_budget_is_spent_and_unused_leases_give_it_back():
+    scheduler = KeyScheduler(["k1"], rpm=2, tpm=0)
+    first = scheduler.acquire(max_wait=0)
+    second = scheduler.acquire(max_wait=0)
+    lease, wait = scheduler.try_acquire()
+    assert lease is None and 0 < wait <= 30
+    # A cache hit never called Gemini, so its request is returned
+    first.release()
+    assert scheduler.acquire(max_wait=0) is not None
+    second.charge(10)
+    second.release()
+    assert scheduler.try_acquire()[0] is None
+
+
+def test_token_budget_rests_a_key_that_overspent():
+    scheduler = KeyScheduler(["k1", "k2"], rpm=0, tpm=1000)
+    with scheduler.acquire(max_wait=0) as lease:
+        assert lease.key == "k1"
+        gem.record_usage(SimpleNamespace(usage_metadata=SimpleNamespace(total_token_count=1500)))
+    # k1 is in debt until its bucket refills, so calls go to k2
+    assert scheduler.snapshot()[0]["tokens_available"] < 0
+    assert [scheduler.acquire(max_wait=0).key for _ in range(3)] == ["k2", "k2", "k2"]
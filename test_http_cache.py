@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Checks conditional and partial downloads: ETags with 304s, single byte ranges
+with 206s, 416 for ranges past the end, and If-Range falling back to the whole body.
+"""
+import hashlib
+
+import pytest
+from fastapi.testclient import TestClient
+
+from api.app import app
+from api.services.http_cache import RangeNotSatisfiable, etag_matches, parse_range
+
+
+PDF = b"%PDF-1.4 " + bytes(range(256)) * 4
+client = TestClient(app)
+
+
+@pytest.fixture(scope="module")
+def url():
+    response = client.post("/admin/courses/range-course/files", files={"file": ("big.pdf", PDF, "application/pdf")})
+    assert response.status_code == 200, response.text
+    return f"/admin/courses/files/{response.json()['id']}/download"
+
+
+def test_full_download_carries_a_strong_etag(url):
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.content == PDF
+    assert response.headers["etag"] == f'"{hashlib.sha256(PDF).hexdigest()}"'
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.headers["cache-control"] == "no-cache"
+
+
+def test_matching_if_none_match_is_not_modified(url):
+    etag = client.get(url).headers["etag"]
+    response = client.get(url, headers={"If-None-Match": f'"other", W/{etag}'})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+    assert client.get(url, headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_byte_ranges(url):
+    response = client.get(url, headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.content == PDF[10:20]
+    assert response.headers["content-range"] == f"bytes 10-19/{len(PDF)}"
+
+    response = client.get(url, headers={"Range": "bytes=-5"})
+    assert response.status_code == 206
+    assert response.content == PDF[-5:]
+
+    response = client.get(url, headers={"Range": "bytes=1000-"})
+    assert response.status_code == 206
+    assert response.content == PDF[1000:]
+
+
+def test_range_past_the_end_is_not_satisfiable(url):
+    response = client.get(url, headers={"Range": f"bytes={len(PDF)}-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(PDF)}"
+
+
+def test_stale_if_range_gets_the_whole_body(url):
+    etag = client.get(url).headers["etag"]
+    assert client.get(url, headers={"Range": "bytes=0-3", "If-Range": etag}).status_code == 206
+    response = client.get(url, headers={"Range": "bytes=0-3", "If-Range": '"stale"'})
+    assert response.status_code == 200
+    assert response.content == PDF
+
+
+def test_parse_range():
+    assert parse_range("bytes=0-0", 10) == (0, 0)
+    assert parse_range("bytes=5-100", 10) == (5, 9)
+    assert parse_range("bytes=-100", 10) == (0, 9)
+    # Ignored: other units, several ranges, malformed or reversed
+    for header in ("items=0-1", "bytes=0-1,3-4", "bytes=a-b", "bytes=5", "bytes=5-2"):
+        assert parse_range(header, 10) is None
+    for header in ("bytes=10-", "bytes=-0"):
+        with pytest.raises(RangeNotSatisfiable):
+            parse_range(header, 10)
+
+
+def test_etag_matches():
+    assert etag_matches("*", '"a"')
+    assert etag_matches('"b", W/"a"', '"a"')
+    assert not etag_matches('"b"', '"a"')
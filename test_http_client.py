@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Checks the shared HTTP client's accounting: calls rejected by the per-host cap
+don't count against a dependency's circuit breaker while upstream errors do, and
+the per-host limits stop growing once there are enough hosts.
+"""
+import threading
+
+import pytest
+
+from api.services import http_client
+from api.services.breaker import OPEN, circuit
+
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+def busy_host(monkeypatch):
+    full = threading.BoundedSemaphore(1)
+    full.acquire()
+    monkeypatch.setattr(http_client, "_host_limit", lambda host: full)
+    monkeypatch.setattr(http_client, "HTTP_CONNECT_TIMEOUT", 0.01)
+
+
+def test_busy_host_is_not_a_dependency_failure(monkeypatch):
+    busy_host(monkeypatch)
+    breaker = circuit("test-busy")
+    for _ in range(breaker.failure_threshold + 1):
+        with pytest.raises(http_client.HostBusy):
+            http_client.get("https://busy.example/", circuit="test-busy")
+    assert breaker.snapshot() == {"state": "closed", "failures": 0}
+
+
+def test_upstream_errors_open_the_breaker(monkeypatch):
+    monkeypatch.setattr(http_client.session, "request", lambda *a, **k: Response(503))
+    breaker = circuit("test-upstream")
+    for _ in range(breaker.failure_threshold):
+        assert http_client.get("https://down.example/", circuit="test-upstream").status_code == 503
+    assert breaker.state == OPEN
+
+
+def test_host_limits_are_capped(monkeypatch):
+    monkeypatch.setattr(http_client, "_host_limits", {})
+    monkeypatch.setattr(http_client, "_MAX_HOSTS", 2)
+    first = http_client._host_limit("a.example")
+    http_client._host_limit("b.example")
+    assert http_client._host_limit("c.example") is http_client._other_hosts_limit
+    assert http_client._host_limit("d.example") is http_client._other_hosts_limit
+    assert http_client._host_limit("a.example") is first
+    assert len(http_client._host_limits) == 2
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Checks resized image variants: sizes and width lookup, and that two runs for the
+same image at once both succeed with each variant stored once, without either
+holding a pooled connection while Pillow renders.
+"""
+import io
+import threading
+
+from PIL import Image
+
+from api.db import pool
+from api.services import images
+from api.services.blobstore import blob_store
+
+
+def stored_png(width=2000, height=1000, color=(200, 30, 30)):
+    out = io.BytesIO()
+    Image.new("RGB", (width, height), color).save(out, "PNG")
+    return blob_store.put(out.getvalue())
+
+
+def variant_rows(digest):
+    with pool.connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT variant, width, height FROM image_variants WHERE source_sha256=? ORDER BY width", (digest,))
+        return [tuple(row) for row in c.fetchall()]
+
+
+def test_variants_are_downscaled_and_found_by_width():
+    digest = stored_png()
+    assert images.generate_variants(digest) == ["thumb", "feed", "full"]
+    assert variant_rows(digest) == [("thumb", 320, 160), ("feed", 800, 400), ("full", 1600, 800)]
+    assert images.generate_variants(digest) == []
+
+    with pool.connection() as conn:
+        blob, size, media_type = images.find_variant(conn, digest, 500)
+    assert media_type.startswith("image/")
+    assert blob_store.size(blob) == size
+    assert images.variant_for_width(5000) == "full"
+
+
+def test_concurrent_runs_for_one_image_both_succeed(monkeypatch):
+    digest = stored_png(color=(10, 120, 10))
+    both_rendering = threading.Barrier(2, timeout=5)
+    in_use = []
+    render = images.render_variant
+
+    def slow_render(data, max_width, *args, **kwargs):
+        # Both runs have seen every variant missing before either one inserts
+        if max_width == images.VARIANTS["thumb"]:
+            both_rendering.wait()
+        in_use.append(pool.stats()["in_use"])
+        return render(data, max_width, *args, **kwargs)
+
+    monkeypatch.setattr(images, "render_variant", slow_render)
+    results, errors = [], []
+
+    def run():
+        try:
+            results.append(images.run_image_variants_job({"sha256": digest}))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+
+    assert not errors
+    created = sorted(name for result in results for name in result["created"])
+    assert created == sorted(images.VARIANTS)
+    assert [row[0] for row in variant_rows(digest)] == ["thumb", "feed", "full"]
+    assert set(in_use) == {0}
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Checks the background job queue: idempotent enqueueing, heartbeats, re-queueing
+of jobs orphaned by a restart, and that handlers run without a held connection.
+"""
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+from api.app import app
+from api.core.config import JOB_MAX_ATTEMPTS
+from api.db import pool
+from api.services import jobs
+
+
+calls = []
+
+
+@jobs.register("test_echo")
+def run_echo_job(params: dict) -> dict:
+    # Handlers borrow their own connections; the runner holds none while they work
+    calls.append(pool.stats()["in_use"])
+    return {"echo": params["value"]}
+
+
+def enqueue(value, key=None):
+    with pool.connection() as conn:
+        return jobs.enqueue(conn, "test_echo", {"value": value}, key)
+
+
+def job(job_id):
+    with pool.connection() as conn:
+        return jobs.get_job(conn, job_id)
+
+
+def set_running(job_id, heartbeat_age, attempts=1):
+    heartbeat = (datetime.now() - timedelta(seconds=heartbeat_age)).isoformat()
+    with pool.connection() as conn:
+        c = conn.cursor()
+        c.execute(
+            "UPDATE jobs SET status='running', started_at=?, heartbeat_at=?, attempts=? WHERE id=?",
+            (heartbeat, heartbeat, attempts, job_id),
+        )
+        conn.commit()
+
+
+def test_idempotency_key_returns_the_first_job():
+    key = uuid.uuid4().hex
+    first, created = enqueue("a", key)
+    again, created_again = enqueue("a", key)
+    assert created and not created_again
+    assert again == first
+
+
+def test_idempotency_key_reused_for_other_params_is_rejected():
+    key = uuid.uuid4().hex
+    enqueue("group 1", key)
+    with pytest.raises(jobs.IdempotencyConflict):
+        enqueue("group 2", key)
+
+
+def test_reused_key_is_a_422_over_http():
+    key = uuid.uuid4().hex
+    client = TestClient(app)
+    first = client.post("/groups/1/analysis?background=true", headers={"Idempotency-Key": key})
+    assert first.status_code == 202
+    assert client.post("/groups/1/analysis?background=true", headers={"Idempotency-Key": key}).json()["job_id"] == first.json()["job_id"]
+    other = client.post("/groups/2/analysis?background=true", headers={"Idempotency-Key": key})
+    assert other.status_code == 422
+
+
+def test_identical_pending_job_is_reused():
+    value = uuid.uuid4().hex
+    first, _ = enqueue(value)
+    second, created = enqueue(value)
+    assert second == first and not created
+    other, created = enqueue(value + "-other")
+    assert other != first and created
+
+
+def test_run_records_the_result_without_holding_a_connection():
+    queue = jobs.JobQueue(workers=0)
+    job_id, _ = enqueue(uuid.uuid4().hex)
+    calls.clear()
+    queue._run(job_id)
+    assert calls == [0]
+    assert job(job_id)["status"] == "done"
+    # A second submission of a finished job is not run again
+    queue._run(job_id)
+    assert calls == [0]
+
+
+def test_sweep_requeues_only_jobs_with_a_stale_heartbeat():
+    queue = jobs.JobQueue(workers=0, stale_after=60)
+    orphaned, _ = enqueue(uuid.uuid4().hex)
+    alive, _ = enqueue(uuid.uuid4().hex)
+    set_running(orphaned, heartbeat_age=120)
+    set_running(alive, heartbeat_age=5)
+    assert orphaned in queue.sweep()
+    assert job(orphaned)["status"] == "queued"
+    assert job(alive)["status"] == "running"
+    queue._run(orphaned)
+    assert job(orphaned)["status"] == "done"
+
+
+def test_heartbeat_keeps_running_jobs_alive():
+    queue = jobs.JobQueue(workers=0, stale_after=60)
+    job_id, _ = enqueue(uuid.uuid4().hex)
+    set_running(job_id, heartbeat_age=120)
+    queue._running.add(job_id)
+    queue.heartbeat()
+    assert job_id not in queue.sweep()
+    assert job(job_id)["status"] == "running"
+
+
+def test_jobs_that_keep_dying_are_given_up_on():
+    queue = jobs.JobQueue(workers=0, stale_after=60)
+    job_id, _ = enqueue(uuid.uuid4().hex)
+    set_running(job_id, heartbeat_age=120, attempts=JOB_MAX_ATTEMPTS)
+    assert job_id not in queue.sweep()
+    assert job(job_id)["status"] == "failed"
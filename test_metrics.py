@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Checks the Prometheus exposition: counter, gauge, histogram and callback samples,
+label escaping, and that /metrics reports requests by route template.
+"""
+
+import pytest
+from fastapi.testclient import TestClient
+
+from api.app import app
+from api.services.metrics import Callback, Counter, Gauge, Histogram, Registry, _Metric
+
+
+def test_samples_render_in_the_text_format():
+    registry = Registry()
+    hits = registry.register(Counter("t_hits_total", "Hits", ("path",)))
+    depth = registry.register(Gauge("t_depth", "Depth"))
+    latency = registry.register(Histogram("t_seconds", "Latency", ("op",), buckets=(0.1, 1.0)))
+    registry.register(Callback("t_pool", "Pool", "state", lambda: {"idle": 2, "in_use": 1}))
+    registry.register(Callback("t_broken", "Broken", "state", lambda: 1 / 0))
+
+    hits.inc(path='say "hi"\n\\')
+    hits.inc(2, path='say "hi"\n\\')
+    depth.inc()
+    depth.inc()
+    depth.dec()
+    latency.observe(0.05, op="read")
+    latency.observe(0.5, op="read")
+    latency.observe(3, op="read")
+
+    assert registry.render().splitlines() == [
+        "# HELP t_hits_total Hits",
+        "# TYPE t_hits_total counter",
+        't_hits_total{path="say \\"hi\\"\\n\\\\"} 3',
+        "# HELP t_depth Depth",
+        "# TYPE t_depth gauge",
+        "t_depth 1",
+        "# HELP t_seconds Latency",
+        "# TYPE t_seconds histogram",
+        't_seconds_bucket{op="read",le="0.1"} 1',
+        't_seconds_bucket{op="read",le="1.0"} 2',
+        't_seconds_bucket{op="read",le="+Inf"} 3',
+        't_seconds_sum{op="read"} 3.55',
+        't_seconds_count{op="read"} 3',
+        "# HELP t_pool Pool",
+        "# TYPE t_pool gauge",
+        't_pool{state="idle"} 2',
+        't_pool{state="in_use"} 1',
+        # A failing collector drops its samples rather than the whole scrape
+        "# HELP t_broken Broken",
+        "# TYPE t_broken gauge",
+    ]
+
+
+def test_metric_without_samples_cannot_be_constructed():
+    class Bare(_Metric):
+        pass
+
+    with pytest.raises(TypeError):
+        Bare("t_bare", "Bare")
+
+
+def test_metrics_endpoint_counts_requests_by_route():
+    client = TestClient(app)
+    assert client.get("/health").status_code == 200
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    lines = response.text.splitlines()
+    assert "# TYPE http_requests_total counter" in lines
+    assert any(line.startswith('http_requests_total{method="GET",route="/health",status="200"} ') for line in lines)
+    assert any(line.startswith('http_request_duration_seconds_count{method="GET",route="/health"} ') for line in lines)
+    assert any(line.startswith('db_pool_connections{state=') for line in lines)
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Checks that workers migrating a fresh database at the same time apply every
+step exactly once and all come up at the latest version.
+"""
+import sqlite3
+import threading
+
+from api.db import SmartConn
+from api.migrations import LATEST_VERSION, current_version, migrate
+
+
+def connect(path):
+    return SmartConn(sqlite3.connect(path, check_same_thread=False, timeout=30), False)
+
+
+def test_concurrent_workers_apply_each_step_once(tmp_path):
+    path = str(tmp_path / "fresh.db")
+    workers = 4
+    barrier = threading.Barrier(workers)
+    applied, errors = [], []
+
+    def boot():
+        conn = connect(path)
+        try:
+            barrier.wait()
+            applied.append(migrate(conn))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=boot) for _ in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(60)
+
+    assert not errors
+    steps = sorted(number for versions in applied for number in versions)
+    assert steps == list(range(1, LATEST_VERSION + 1))
+    conn = connect(path)
+    try:
+        assert current_version(conn) == LATEST_VERSION
+        c = conn.cursor()
+        c.execute("SELECT COUNT(*) FROM schema_version")
+        assert c.fetchone()[0] == LATEST_VERSION
+    finally:
+        conn.close()
+
+
+def test_migrate_is_a_no_op_when_current(tmp_path):
+    path = str(tmp_path / "current.db")
+    conn = connect(path)
+    try:
+        assert migrate(conn) == list(range(1, LATEST_VERSION + 1))
+        assert migrate(conn) == []
+    finally:
+        conn.close()
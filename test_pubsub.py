@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Checks live-update delivery: events published from worker threads reach only the
+subscribers of their topic, a slow subscriber loses its oldest events rather than
+blocking the publisher, and a committed vote arrives on the poll's SSE stream.
+"""
+import asyncio
+import json
+
+from fastapi.testclient import TestClient
+
+from api.app import app
+from api.routers.updates import stream_poll_votes
+from api.services.pubsub import Broker
+
+
+client = TestClient(app)
+
+
+def test_events_reach_only_subscribers_of_the_topic():
+    broker = Broker()
+
+    async def scenario():
+        poll = broker.subscribe(["poll:1"])
+        course = broker.subscribe(["course:bio", "poll:1"])
+        other = broker.subscribe(["poll:2"])
+        # Publishers are request handlers in the threadpool
+        delivered = await asyncio.to_thread(broker.publish, "poll:1", {"votes": 1})
+        assert delivered == 2
+        assert await poll.get(timeout=1) == {"votes": 1}
+        assert await course.get(timeout=1) == {"votes": 1}
+        assert await other.get(timeout=0.05) is None
+        assert broker.stats() == {"poll": 3, "course": 1}
+
+        for sub in (poll, course, other):
+            sub.close()
+        assert broker.publish("poll:1", {"votes": 2}) == 0
+        assert broker.stats() == {}
+
+    asyncio.run(scenario())
+
+
+def test_slow_subscriber_keeps_the_newest_events():
+    broker = Broker(queue_size=2)
+
+    async def scenario():
+        sub = broker.subscribe(["poll:1"])
+        for votes in range(1, 5):
+            broker.publish("poll:1", {"votes": votes})
+        await asyncio.sleep(0)
+        assert [await sub.get(timeout=1), await sub.get(timeout=1)] == [{"votes": 3}, {"votes": 4}]
+        assert sub.dropped == 2
+
+    asyncio.run(scenario())
+    # The subscriber's loop is gone: publishing drops it instead of raising
+    assert broker.publish("poll:1", {"votes": 5}) == 0
+    assert broker.stats() == {}
+
+
+class Request:
+    def __init__(self):
+        self.disconnected = False
+
+    async def is_disconnected(self):
+        return self.disconnected
+
+
+def parse_sse(chunk):
+    lines = chunk.strip().splitlines()
+    return lines[0].split(": ", 1)[1], json.loads(lines[1].split(": ", 1)[1])
+
+
+def test_committed_vote_arrives_on_the_poll_stream():
+    poll = client.post("/admin/polls", json={"course_id": "pubsub-101", "question": "Ready?", "options": [{"option_text": "Yes"}, {"option_text": "No"}]}).json()
+    poll_id, option_id = poll["id"], poll["options"][1]["id"]
+
+    async def scenario():
+        request = Request()
+        response = await stream_poll_votes(poll_id, request)
+        body = response.body_iterator
+        event, data = parse_sse(await body.__anext__())
+        assert event == "snapshot"
+        assert data["options"] == [{"id": o["id"], "votes": 0} for o in poll["options"]]
+
+        vote = await asyncio.to_thread(client.post, "/polls/vote", json={"user_id": 7001, "option_id": option_id})
+        assert vote.status_code == 200
+        event, data = parse_sse(await asyncio.wait_for(body.__anext__(), 5))
+        assert event == "vote"
+        assert data == {"poll_id": poll_id, "option_id": option_id, "delta": 1, "votes": 1}
+
+        request.disconnected = True
+        await body.aclose()
+
+    asyncio.run(scenario())
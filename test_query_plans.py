@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Checks that the hot lookup queries are served by an index rather than a full table scan.
+"""
+import re
+
+from api.db import pool
+
+
+HOT_QUERIES = {
+    "files by group": ("SELECT id, file_name, file_type, uploaded_at FROM files WHERE group_id=?", (1,)),
+    "files by course": ("SELECT id, file_name, file_type, uploaded_at FROM files WHERE course_id=?", ("c1",)),
+    "chat history by session": (
+        "SELECT role, message, timestamp FROM chat_history WHERE user_id=? AND group_id=? AND session_id=? ORDER BY timestamp",
+        (1, 1, "s"),
+    ),
+    "chat image history": (
+        "SELECT role, message, timestamp FROM chat_history_image WHERE user_id=? AND group_id=? AND image_id=? AND session_id=? ORDER BY id",
+        (1, 1, "i", "s"),
+    ),
+    "chat video history": (
+        "SELECT role, message, timestamp FROM chat_history_video WHERE user_id=? AND group_id=? AND video_id=? AND session_id=? ORDER BY id",
+        (1, 1, "v", "s"),
+    ),
+    "chat sessions": (
+        "SELECT id, user_id, group_id, title, created_at FROM chat_sessions WHERE user_id=? AND group_id=? ORDER BY created_at DESC",
+        (1, 1),
+    ),
+    "quiz results": (
+        "SELECT subject, quiz_date, total_marks, details FROM quiz_results WHERE user_id=? AND group_id=? ORDER BY quiz_date",
+        (1, 1),
+    ),
+    "user groups": ("SELECT id, group_name FROM file_groups WHERE user_id=?", (1,)),
+    "group syllabus": ("SELECT syllabus_content FROM syllabus_for_students WHERE group_id=?", (1,)),
+    "course syllabus": ("SELECT syllabus_content, saved_at FROM syllabus WHERE course_id=?", ("c1",)),
+    "user vote": ("SELECT option_id FROM poll_votes WHERE user_id=? AND poll_id=?", (1, 1)),
+    "group chunk version": ("SELECT COUNT(*), MAX(id) FROM file_chunks WHERE group_id=?", (1,)),
+    "file chunks": ("DELETE FROM file_chunks WHERE file_id=?", (1,)),
+    "search document": ("DELETE FROM search_documents WHERE kind=? AND ref_id=?", ("file", 1)),
+    "feed poll options": (
+        """
+        SELECT o.poll_id, o.id, o.option_text, COALESCE(o.vote_count, 0)
+        FROM poll_options o
+        WHERE o.poll_id IN (SELECT id FROM polls WHERE course_id=? ORDER BY created_at DESC, id DESC LIMIT ?)
+        ORDER BY o.poll_id, o.id
+        """,
+        ("c1", 21),
+    ),
+    "feed user votes": (
+        "SELECT poll_id, option_id FROM poll_votes WHERE user_id=? AND poll_id IN "
+        "(SELECT id FROM polls WHERE course_id=? ORDER BY created_at DESC, id DESC LIMIT ?)",
+        (1, "c1", 21),
+    ),
+    "course polls": (
+        "SELECT id, question, created_at FROM polls WHERE course_id=? AND (created_at < ? OR (created_at = ? AND id < ?)) "
+        "ORDER BY created_at DESC, id DESC LIMIT ?",
+        ("c1", "2024", "2024", 10, 21),
+    ),
+    "course updates": (
+        "SELECT id, content, external_url, created_at FROM updates WHERE course_id=? AND created_at < ? "
+        "ORDER BY created_at DESC, id DESC LIMIT ?",
+        ("c1", "2024", 21),
+    ),
+}
+
+# "SCAN files" is a full table scan; "SCAN files USING INDEX ..." / "SEARCH ..." are fine.
+FULL_SCAN = re.compile(r"\bSCAN (?:TABLE )?(\w+)(?!.*\bUSING\b)")
+
+
+def full_scans(sql, params):
+    with pool.connection() as conn:
+        c = conn.cursor()
+        c.execute("EXPLAIN QUERY PLAN " + sql, params)
+        details = [row[-1] for row in c.fetchall()]
+    return [d for d in details if FULL_SCAN.search(d)]
+
+
+def test_hot_queries_use_indexes():
+    failures = {}
+    for name, (sql, params) in HOT_QUERIES.items():
+        scans = full_scans(sql, params)
+        if scans:
+            failures[name] = scans
+    assert not failures, f"Hot queries fell back to full table scans: {failures}"
+
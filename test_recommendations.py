@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Checks the recommendation race: the first non-empty backend wins, every backend
+gets the budget left when it starts as its timeout and makes a single attempt, and
+work queued past the deadline is skipped, so losers cannot pile up in the executor.
+"""
+import time
+
+from api.services import http_client
+from api.services import recommendations as recs
+
+
+def test_first_non_empty_result_wins():
+    backends = [
+        ("empty", lambda q, timeout: []),
+        ("broken", lambda q, timeout: 1 / 0),
+        ("good", lambda q, timeout: [q]),
+    ]
+    assert recs.race(backends, "cells", budget=2, hedge_delay=1) == ("good", ["cells"])
+
+
+def test_backends_get_the_remaining_budget_as_their_timeout():
+    timeouts = {}
+
+    def backend(name, delay, result):
+        def fn(q, timeout):
+            timeouts[name] = timeout
+            time.sleep(delay)
+            return result
+        return name, fn
+
+    started = time.monotonic()
+    name, _ = recs.race([backend("slow", 0.5, ["late"]), backend("fast", 0, ["x"])], "q", budget=1, hedge_delay=0.2)
+    assert name == "fast"
+    assert time.monotonic() - started < 0.5
+    assert 0.9 < timeouts["slow"] <= 1
+    assert timeouts["fast"] <= 0.8
+
+
+def test_gives_up_after_the_budget():
+    started = time.monotonic()
+    assert recs.race([("hung", lambda q, timeout: time.sleep(1) or ["x"])], "q", budget=0.2) == (None, [])
+    assert time.monotonic() - started < 0.5
+
+
+def test_work_queued_past_the_deadline_is_skipped():
+    calls = []
+    assert recs._call(lambda q, timeout: calls.append(q) or [q], "q", time.monotonic() - 1) == []
+    assert calls == []
+
+
+def test_backends_make_one_attempt_within_their_timeout(monkeypatch):
+    seen = []
+
+    class Response:
+        text = '<a href="https://example.org/a" class="result__url">'
+
+    monkeypatch.setattr(http_client, "request", lambda method, url, **kwargs: seen.append(kwargs) or Response())
+    assert recs._duckduckgo("cells", 2.5) == ["https://example.org/a"]
+    assert seen[0]["timeout"] == 2.5
+    assert seen[0]["retries"] is False
+
+
+def test_single_attempt_requests_skip_the_retrying_session(monkeypatch):
+    used = []
+
+    class Response:
+        status_code = 200
+
+    monkeypatch.setattr(http_client.session, "request", lambda *a, **k: used.append("retrying") or Response())
+    monkeypatch.setattr(http_client.single_attempt_session, "request", lambda *a, **k: used.append("single") or Response())
+    http_client.get("https://example.org/", retries=False)
+    http_client.get("https://example.org/")
+    assert used == ["single", "retrying"]
+    assert http_client.single_attempt_session.get_adapter("https://example.org/").max_retries.total == 0
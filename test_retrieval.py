@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Checks BM25 retrieval over study files: chunking, ranking, per-group scoping,
+index rebuilds when a group's files change, and passage selection for long text.
+"""
+
+from api.db import pool
+from api.services.retrieval import BM25Index, chunk_text, relevant_passages, search_group, tokenize
+
+
+def add_file(group_id, name, text):
+    with pool.connection() as conn:
+        c = conn.cursor()
+        c.execute(
+            "INSERT INTO files (group_id, file_name, file_type, file_content, uploaded_at) VALUES (?, ?, 'text/plain', ?, '2024-01-01')",
+            (group_id, name, text),
+        )
+        conn.commit()
+        return c.lastrowid
+
+
+def test_chunks_overlap_and_cover_the_text():
+    words = [f"w{i}" for i in range(25)]
+    chunks = chunk_text(" ".join(words), words=10, overlap=4)
+    assert chunks[0].split() == words[:10]
+    assert chunks[1].split()[:4] == words[6:10]
+    assert chunks[-1].split()[-1] == "w24"
+    assert chunk_text("   ") == []
+
+
+def test_bm25_ranks_the_matching_chunk_first():
+    index = BM25Index([
+        (1, "bio.txt", 0, "Photosynthesis turns light into chemical energy in the chloroplast"),
+        (1, "bio.txt", 1, "Mitochondria release energy from glucose"),
+        (2, "history.txt", 0, "The treaty ended the war in 1648"),
+    ])
+    results = index.search("where does photosynthesis happen", 3)
+    assert [(r.file_id, r.chunk_index) for r in results] == [(1, 0)]
+    assert results[0].score > 0
+    # Rarer terms outweigh common ones
+    assert [r.chunk_index for r in index.search("energy glucose", 2)] == [1, 0]
+    assert index.search("the of and", 3) == []
+    assert tokenize("The Cell's Wall") == ["cell", "s", "wall"]
+
+
+def test_search_is_scoped_to_the_group_and_sees_new_files():
+    add_file(301, "cells.txt", "The cell membrane controls what enters the cell")
+    add_file(302, "other.txt", "Cell biology for another group")
+    with pool.connection() as conn:
+        assert [r.file_name for r in search_group(conn, 301, "cell membrane", 5)] == ["cells.txt"]
+
+    add_file(301, "membranes.txt", "Membrane proteins and membrane transport")
+    with pool.connection() as conn:
+        names = [r.file_name for r in search_group(conn, 301, "membrane", 5)]
+    assert sorted(names) == ["cells.txt", "membranes.txt"]
+    assert names[0] == "membranes.txt"
+
+
+def test_fill_pads_with_unmatched_chunks():
+    add_file(303, "a.txt", "Enzymes speed up reactions")
+    add_file(303, "b.txt", "Rivers erode valleys")
+    with pool.connection() as conn:
+        assert len(search_group(conn, 303, "enzymes", 2)) == 1
+        filled = search_group(conn, 303, "enzymes", 2, fill=True)
+    assert [r.file_name for r in filled] == ["a.txt", "b.txt"]
+    assert filled[1].score == 0.0
+
+
+def test_relevant_passages_keeps_the_best_windows_in_order():
+    short = "only a few words"
+    assert relevant_passages(short, "words", 3) == short
+
+    filler = " ".join(f"filler{i}" for i in range(1000))
+    text = f"volcano eruption basics {filler} glacier retreat data {filler} volcano lava flows"
+    passages = relevant_passages(text, "volcano", 2)
+    parts = passages.split("\n…\n")
+    assert len(parts) == 2
+    assert parts[0].startswith("volcano eruption")
+    assert parts[1].endswith("volcano lava flows")
+    assert "glacier" not in passages
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Checks full-text search scoping: a student finds their own chats, files in their
+groups and their course's files and updates, never another student's, and
+group_id / kinds narrow the results.
+"""
+
+from fastapi.testclient import TestClient
+
+from api.app import app
+from api.db import pool
+from api.services.search import fts5_query, index_document, remove_document
+
+
+client = TestClient(app)
+ids = {}
+
+
+def setup_module(module):
+    with pool.connection() as conn:
+        c = conn.cursor()
+        for name, course in (("alice", "bio-101"), ("bob", "geo-201")):
+            c.execute("INSERT INTO users (username, password, course_id) VALUES (?, 'x', ?)", (f"search-{name}", course))
+            ids[name] = c.lastrowid
+            for group in ("notes", "extra"):
+                c.execute("INSERT INTO file_groups (user_id, group_name) VALUES (?, ?)", (ids[name], group))
+                ids[f"{name}-{group}"] = c.lastrowid
+
+        index_document(conn, "file", 1, "Osmosis moves water across a membrane", title="osmosis.txt", group_id=ids["alice-notes"])
+        index_document(conn, "file", 2, "Membrane transport revision", title="revision.txt", group_id=ids["alice-extra"])
+        index_document(conn, "file", 3, "Membrane of a volcano chamber", title="bob.txt", group_id=ids["bob-notes"])
+        index_document(conn, "file", 4, "Course handout on membrane structure", title="handout.pdf", course_id="bio-101")
+        index_document(conn, "chat", 1, "What is a membrane made of?", user_id=ids["alice"], group_id=ids["alice-notes"], session_id="s1")
+        index_document(conn, "chat", 2, "Is a membrane like a crust?", user_id=ids["bob"], group_id=ids["bob-notes"], session_id="s2")
+        index_document(conn, "update", 1, "Membrane quiz on Friday", course_id="bio-101")
+        index_document(conn, "update", 2, "Membrane field trip", course_id="geo-201")
+        conn.commit()
+
+
+def found(**params):
+    response = client.get("/search", params={"q": "membrane", **params})
+    assert response.status_code == 200, response.text
+    return {(r["kind"], r["id"]) for r in response.json()}
+
+
+def test_results_are_limited_to_what_the_student_can_see():
+    assert found(user_id=ids["alice"]) == {("file", 1), ("file", 2), ("file", 4), ("chat", 1), ("update", 1)}
+    assert found(user_id=ids["bob"]) == {("file", 3), ("chat", 2), ("update", 2)}
+
+
+def test_group_and_kinds_narrow_the_results():
+    assert found(user_id=ids["alice"], group_id=ids["alice-notes"]) == {("file", 1), ("chat", 1)}
+    # Another student's group yields nothing rather than their files
+    assert found(user_id=ids["alice"], group_id=ids["bob-notes"]) == set()
+    assert found(user_id=ids["alice"], kinds="update,chat") == {("chat", 1), ("update", 1)}
+    response = client.get("/search", params={"q": "membrane", "user_id": ids["alice"], "kinds": "file,poll"})
+    assert response.status_code == 400
+
+
+def test_matches_are_ranked_and_highlighted():
+    response = client.get("/search", params={"q": "osmo", "user_id": ids["alice"]})
+    results = response.json()
+    assert [(r["kind"], r["id"]) for r in results] == [("file", 1)]
+    assert "<mark>Osmosis</mark>" in results[0]["snippet"]
+
+
+def test_removed_documents_are_not_found():
+    with pool.connection() as conn:
+        remove_document(conn, "update", 1)
+        conn.commit()
+    assert ("update", 1) not in found(user_id=ids["alice"])
+
+
+def test_fts5_query_quotes_user_input():
+    assert fts5_query('cell "wall" OR -x') == '"cell" "wall" "OR" "x"*'
+    assert fts5_query("  ?! ") == ""
+    assert client.get("/search", params={"q": "?!", "user_id": ids["alice"]}).json() == []